@@ -0,0 +1,26 @@
+"""
+gunicorn settings for production, use with -c config/gunicorn.py.
+
+With PROMETHEUS_MULTIPROC_DIR set, every worker keeps its metrics in files of its own in the directory, see
+juhannus.metrics. Files of an earlier run are removed at start and those of exited workers are merged into the totals.
+"""
+
+import os
+import shutil
+
+# Workers fork from a master that has imported the app already, so that booting or recycling a worker skips
+# the imports. GUNICORN_PRELOAD=False imports in every worker again
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() in ('true', '1', 'yes')
+
+
+def on_starting(server):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
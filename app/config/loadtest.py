@@ -0,0 +1,22 @@
+"""
+WSGI and ASGI config for the replay_deadline load test.
+
+The clock of the app is shifted by LOADTEST_CLOCK_OFFSET seconds, so that the voting deadline of the test event
+arrives during the test. Never use this for serving the site.
+"""
+
+import datetime
+import os
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.utils import timezone
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+_offset = datetime.timedelta(seconds=float(os.environ['LOADTEST_CLOCK_OFFSET']))
+_now = timezone.now
+timezone.now = lambda: _now() + _offset
+
+application = get_wsgi_application()
+asgi_application = get_asgi_application()
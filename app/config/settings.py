@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
+import importlib.util
 import os
+import socket
 import sys
 
 import environ
@@ -39,11 +41,22 @@ DEBUG = env.bool('DEBUG')
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS')
 CSRF_TRUSTED_ORIGINS = env.list('CSRF_TRUSTED_ORIGINS')
 
-if DEBUG:
-    import socket
+# Development tools (debug toolbar, django-extensions), installed from requirements-dev.txt. Production leaves them
+# out, which keeps them out of every worker boot
+DEV_TOOLS = env.bool('DEV_TOOLS', default=DEBUG and importlib.util.find_spec('debug_toolbar') is not None)
 
-    hostname, _, ips = socket.gethostbyname_ex(socket.gethostname())
-    INTERNAL_IPS = [ip[:-1] + '1' for ip in ips] + ['127.0.0.1', '10.0.2.2']
+
+class DockerHostIps:
+    # INTERNAL_IPS of the docker host, looked up on first use instead of with a DNS query on every start
+    def __contains__(self, address):
+        if not hasattr(self, 'ips'):
+            _, _, ips = socket.gethostbyname_ex(socket.gethostname())
+            self.ips = [ip[:-1] + '1' for ip in ips] + ['127.0.0.1', '10.0.2.2']
+        return address in self.ips
+
+
+if DEV_TOOLS:
+    INTERNAL_IPS = DockerHostIps()
 
 DEBUG_TOOLBAR_CONFIG = {
     # Display Django Debug Toolbar in docker when DEBUG = True
@@ -59,7 +72,6 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     # packages
-    'django_extensions',
     'django_simple_plausible',
     # apps
     'juhannus',
@@ -67,11 +79,12 @@ INSTALLED_APPS = [
     'django.contrib.admin',
 ]
 
-if DEBUG:
-    # inject DDT only when DEBUG = True, to reduce overhead
+if DEV_TOOLS:
+    # inject DDT and the extensions only with the development tools, to reduce overhead
     for i, item in enumerate(INSTALLED_APPS):
         if item == "django.contrib.staticfiles":
             INSTALLED_APPS.insert(i + 1, "debug_toolbar")
+            INSTALLED_APPS.insert(i + 2, "django_extensions")
             break
 
 DEBUG_TOOLBAR_CONFIG['IS_RUNNING_TESTS'] = 'test' not in sys.argv  # I don't like this, but was unable to get it to work otherwise
@@ -86,8 +99,45 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-if DEBUG:
-    # inject DDT only when DEBUG = True, to reduce overhead
+# Static files from the app itself when no proxy serves them, see juhannus.staticfiles
+SERVE_STATIC = env.bool("SERVE_STATIC", default=True)
+if SERVE_STATIC:
+    MIDDLEWARE.insert(1, "juhannus.middleware.StaticFilesMiddleware")
+
+# Prometheus metrics at /metrics, see juhannus.metrics. Scrapers authenticate with "Authorization: Bearer <token>"
+METRICS = env.bool("METRICS", default=True)
+METRICS_TOKEN = env.str("METRICS_TOKEN", default=None)
+if METRICS:
+    # First, so that the latency covers the other middleware too
+    MIDDLEWARE.insert(0, "juhannus.middleware.MetricsMiddleware")
+
+# Opt-in cProfile of sampled requests, see juhannus.middleware.ProfilingMiddleware and the profile_report command
+PROFILING = env.bool("PROFILING", default=False)
+PROFILE_SAMPLE_RATE = env.float("PROFILE_SAMPLE_RATE", default=0.01)
+PROFILE_ROUTES = env.list("PROFILE_ROUTES", default=[])
+PROFILE_TOKEN = env.str("PROFILE_TOKEN", default=None)
+PROFILE_DIR = env.str("PROFILE_DIR", default=os.path.join(BASE_DIR, "profiles"))
+if PROFILING:
+    MIDDLEWARE.insert(1 if METRICS else 0, "juhannus.middleware.ProfilingMiddleware")
+
+# Token buckets for posts to the event pages, per client and for everybody together, see juhannus.ratelimit.
+# CacheRateLimiter shares the buckets between the workers through a shared cache. Behind a proxy VOTE_CLIENT_HEADER
+# names the header it puts the client address in, e.g. X-Forwarded-For
+VOTE_RATE_LIMIT = env.bool("VOTE_RATE_LIMIT", default=True)
+VOTE_RATE_LIMITER = env.str("VOTE_RATE_LIMITER", default="juhannus.ratelimit.LocalRateLimiter")
+VOTE_CLIENT_RATE = env.float("VOTE_CLIENT_RATE", default=0.2)
+VOTE_CLIENT_BURST = env.int("VOTE_CLIENT_BURST", default=10)
+VOTE_GLOBAL_RATE = env.float("VOTE_GLOBAL_RATE", default=50)
+VOTE_GLOBAL_BURST = env.int("VOTE_GLOBAL_BURST", default=200)
+VOTE_CLIENT_HEADER = env.str("VOTE_CLIENT_HEADER", default=None)
+if VOTE_RATE_LIMIT:
+    # Ahead of the session and the csrf check, which would read the session and parse the form
+    before = ("juhannus.middleware.StaticFilesMiddleware" if SERVE_STATIC
+              else "django.middleware.security.SecurityMiddleware")
+    MIDDLEWARE.insert(MIDDLEWARE.index(before) + 1, "juhannus.middleware.VoteRateLimitMiddleware")
+
+if DEV_TOOLS:
+    # inject DDT only with the development tools, to reduce overhead
     for i, item in enumerate(MIDDLEWARE):
         if item == "django.middleware.common.CommonMiddleware":
             MIDDLEWARE.insert(i + 1, "debug_toolbar.middleware.DebugToolbarMiddleware")
@@ -120,6 +170,15 @@ DATABASES = {
     'default': env.db()
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a cache shared by all gunicorn workers (file, memcached, redis) in production. With the local memory default
+# the page cache of finalized years is off, a purge would only reach the worker that handled the admin edit
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://')
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -157,8 +216,34 @@ USE_TZ = True
 STATIC_ROOT = env('STATIC_ROOT')
 STATIC_URL = env('STATIC_URL')
 
+# Fingerprinted names with .gz/.br siblings, written by collectstatic
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "juhannus.staticfiles.PrecompressedManifestStaticFilesStorage"},
+}
+
 MEDIA_URL = env('MEDIA_URL')
 MEDIA_ROOT = env('MEDIA_ROOT')
 
+# Write votes in batches during the deadline spike, see juhannus.batching. Only pays off where a process serves
+# many requests at once (ASGI, gthread workers), with sync workers every batch has one vote and waits the delay
+VOTE_BATCHING = env.bool("VOTE_BATCHING", default=False)
+VOTE_BATCH_SIZE = env.int("VOTE_BATCH_SIZE", default=50)
+VOTE_BATCH_DELAY = env.float("VOTE_BATCH_DELAY", default=0.02)
+
+# Seconds a rendered page of a finalized year is kept, edits purge it earlier
+PAGE_CACHE_TIMEOUT = env.int("PAGE_CACHE_TIMEOUT", default=24 * 3600)
+
+# Participants per window of the event page table, the following windows are fetched as the table is scrolled
+PARTICIPANT_WINDOW = env.int("PARTICIPANT_WINDOW", default=200)
+
+# Seconds browsers and proxies may reuse the stats page without asking, its data comes from stats.json
+STATS_PAGE_MAX_AGE = env.int("STATS_PAGE_MAX_AGE", default=3600)
+
+# Fan-out of participant and result changes to the live feed, see juhannus.broker. The feed is only on under ASGI
+# with a broker shared by the workers, juhannus.broker.CacheBroker with a shared cache (CACHE_URL)
+LIVE_BROKER = env.str("LIVE_BROKER", default="juhannus.broker.LocalBroker")
+LIVE_STREAM_SECONDS = env.int("LIVE_STREAM_SECONDS", default=300)
+
 PLAUSIBLE_SITES = env.str("PLAUSIBLE_SITES", None)
 PLAUSIBLE_SCRIPT_URL = env.str("PLAUSIBLE_SCRIPT_URL", None)
@@ -17,12 +17,16 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 
+from juhannus.views import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Where Prometheus looks by default
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('', include('juhannus.urls')),
 ]
 
-if settings.DEBUG:
+if settings.DEV_TOOLS:
     import debug_toolbar
 
     urlpatterns = [path('__debug__/', include(debug_toolbar.urls))] + urlpatterns
\ No newline at end of file
@@ -1,9 +1,50 @@
-from django.db import models
+from functools import partial
+
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.paginator import Paginator
+from django.db import IntegrityError, connection, models
 from django.forms import Textarea
-from django.contrib import admin
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 
-from juhannus.models import Header, Body, Event, Participant
+from juhannus.forms import ParticipantAdminForm
+from juhannus.models import Header, Body, Event, Participant, normalize_name
+from juhannus.signals import delete_participants, move_participants
+
+# Changelists count up to this many rows exactly, bigger results are estimated
+COUNT_LIMIT = 10000
+
+
+def estimate_count(model):
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] > 0 else None
+    # Ids are not reused, so the largest one is an upper bound that the primary key index answers right away
+    return model.objects.aggregate(models.Max("pk"))["pk__max"]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts at most COUNT_LIMIT rows, or up to the page after the requested one if that is further. Past that an
+    unfiltered list gets an estimate of the table size, and a filtered one the rows counted and one more, so that
+    its last page link leads on to further pages without any page load counting millions of rows
+    """
+
+    def __init__(self, *args, page=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_limit = max(COUNT_LIMIT, (page + 1) * self.per_page)
+
+    @cached_property
+    def count(self):
+        count = self.object_list[:self.count_limit + 1].count()
+        if count <= self.count_limit:
+            return count
+        if not self.object_list.query.where:
+            return max(estimate_count(self.object_list.model) or 0, count - 1)
+        return count
 
 
 class HeaderAdmin(admin.ModelAdmin):
@@ -30,17 +71,81 @@ admin.site.register(Body, BodyAdmin)
 
 
 class EventAdmin(admin.ModelAdmin):
-    list_display = ['year', 'header', 'body', 'result', 'is_final']
+    list_display = ['year', 'header', 'body', 'result', 'is_final', 'participant_count']
+    list_select_related = ['header', 'body', 'histogram']
+
+    @admin.display(description="participants", ordering="histogram__count")
+    def participant_count(self, obj):
+        return obj.get_histogram().count
 
 
 admin.site.register(Event, EventAdmin)
 
 
 class ParticipantAdmin(admin.ModelAdmin):
+    """
+    Kept usable with millions of participants: the event is joined into the list query, counts are bounded,
+    the name search is an indexed prefix search and the bulk actions are single statements
+    """
+    form = ParticipantAdminForm
     list_display = ['id', 'name', 'event', 'vote', 'visible', 'created']
+    list_select_related = ['event']
     search_fields = ['name']
+    search_help_text = "Names starting with the search, case-insensitive"
     list_filter = ['visible', 'event']
     list_editable = ['visible']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['hide', 'unhide', 'bulk_delete']
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page = max(int(request.GET.get(PAGE_VAR, 1)), 1)
+        except ValueError:
+            page = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page=page)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = normalize_name(search_term)
+        if not term:
+            return queryset, False
+        queryset = queryset.filter(normalized_name__startswith=term)
+        if connection.vendor != "postgresql":
+            # Only the pattern opclass on PostgreSQL makes LIKE 'x%' use the index, the range seeks it elsewhere
+            queryset = queryset.filter(normalized_name__gte=term, normalized_name__lt=term + "\U0010ffff")
+        return queryset, False
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # Replaced by the set-based delete below
+        actions.pop('delete_selected', None)
+        if self.has_change_permission(request):
+            for event in Event.objects.order_by('-year'):
+                name = f'move_to_{event.year}'
+                actions[name] = (partial(self.move, event=event), name,
+                                 f"Move selected participants to {event.year}")
+        return actions
+
+    @admin.action(description="Hide selected participants", permissions=['change'])
+    def hide(self, request, queryset):
+        self.message_user(request, f"Hid {queryset.update(visible=False)} participants")
+
+    @admin.action(description="Unhide selected participants", permissions=['change'])
+    def unhide(self, request, queryset):
+        self.message_user(request, f"Unhid {queryset.update(visible=True)} participants")
+
+    @admin.action(description="Delete selected participants", permissions=['delete'])
+    def bulk_delete(self, request, queryset):
+        self.message_user(request, f"Deleted {delete_participants(queryset)} participants")
+
+    def move(self, modeladmin, request, queryset, event):
+        try:
+            moved = move_participants(queryset, event)
+        except IntegrityError:
+            self.message_user(request, f"Some of the names are already in use in {event.year}, nothing was moved",
+                              messages.ERROR)
+            return
+        self.message_user(request, f"Moved {moved} participants to {event.year}")
 
 
 admin.site.register(Participant, ParticipantAdmin)
@@ -0,0 +1,147 @@
+import base64
+import binascii
+import json
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views import generic
+
+from juhannus import pagecache
+from juhannus.models import Event
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(key, pk):
+    return base64.urlsafe_b64encode(json.dumps([key, pk]).encode()).decode()
+
+
+def decode_cursor(cursor, variant):
+    """
+    The (key, id) of a cursor for the variant's ordering, lowercased names for ?name= and votes for ?vote=.
+    A cursor of another ordering would compare a name with the vote column, it is as invalid as garbage
+    """
+    try:
+        key, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    key_type = str if variant.startswith("name-") else int
+    if type(pk) is not int or type(key) is not key_type:
+        raise ValueError("Invalid cursor")
+    return key, pk
+
+
+def get_page_size(params):
+    try:
+        return min(max(int(params.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return PAGE_SIZE
+
+
+def get_keyset_page(participants, variant, after=None):
+    """
+    Participants ordered like EventView (?name=/?vote=, asc/desc) with the id as tiebreaker, starting after the
+    (key, id) cursor. Seeking on the key instead of OFFSET keeps deep pages as cheap as the first one
+    """
+    sort_order, direction = variant.split("-")
+    participants = participants.annotate(lname=Lower("name"))
+    key = "lname" if sort_order == "name" else "vote"
+    if after is not None:
+        value, pk = after
+        comparison = "gt" if direction == "asc" else "lt"
+        participants = participants.filter(Q(**{f"{key}__{comparison}": value})
+                                           | Q(**{key: value, f"pk__{comparison}": pk}))
+    prefix = "" if direction == "asc" else "-"
+    return participants.order_by(f"{prefix}{key}", f"{prefix}pk"), key
+
+
+def serialize_event(event):
+    histogram = event.get_histogram()
+    return {
+        "year": event.year,
+        "result": event.result,
+        "is_final": event.is_final,
+        "voting_deadline": event.get_voting_deadline(),
+        "results_deadline": event.get_results_deadline(),
+        "voting_available": event.is_voting_available(),
+        "participants": histogram.count,
+        "median": histogram.median,
+        "mean": histogram.mean,
+        "modified": event.get_change_marker(),
+        "url": reverse("juhannus:api-participants", kwargs={"year": event.year}),
+    }
+
+
+class EventListApiView(generic.View):
+    def get(self, request, *args, **kwargs):
+        events = Event.objects.select_related("histogram").order_by("year")
+        return JsonResponse({"events": [serialize_event(event) for event in events]})
+
+
+class EventApiView(generic.View):
+    def get(self, request, *args, **kwargs):
+        event = get_object_or_404(Event.objects.select_related("histogram"), year=kwargs["year"])
+        return JsonResponse(serialize_event(event))
+
+
+class ParticipantListApiView(generic.View):
+    encoder = DjangoJSONEncoder()
+
+    def get(self, request, *args, **kwargs):
+        event = get_object_or_404(Event.objects.only("id"), year=kwargs["year"])
+        variant = pagecache.get_sort_variant(request.GET)
+        try:
+            after = decode_cursor(request.GET["after"], variant) if request.GET.get("after") else None
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        limit = get_page_size(request.GET)
+        participants, key = get_keyset_page(event.participants.all(), variant, after)
+        rows = participants.values_list("id", "name", "vote", "rank", "created", key)[:limit + 1]
+        # Under ASGI a sync iterator would be read into a list before sending, the async one streams
+        stream = self.astream if isinstance(request, ASGIRequest) else self.stream
+        return StreamingHttpResponse(stream(rows, limit, request), content_type="application/json")
+
+    def stream(self, rows, limit, request):
+        yield '{"participants": ['
+        last = None
+        for i, row in enumerate(rows.iterator(chunk_size=limit + 1)):
+            if i == limit:
+                break
+            yield self.encode_row(i, row)
+            last = row
+        else:
+            last = None
+        yield self.encode_end(last, request)
+
+    async def astream(self, rows, limit, request):
+        yield '{"participants": ['
+        i, last = 0, None
+        # The page is a single chunk anyway, and aiterator() of values_list() queries inside the event loop
+        async for row in rows:
+            if i == limit:
+                break
+            yield self.encode_row(i, row)
+            i, last = i + 1, row
+        else:
+            last = None
+        yield self.encode_end(last, request)
+
+    def encode_row(self, i, row):
+        pk, name, vote, rank, created, _ = row
+        return ("," if i else "") + self.encoder.encode({"id": pk, "name": name, "vote": vote, "rank": rank,
+                                                               "created": created})
+
+    def encode_end(self, last, request):
+        # last is the final row of a page that has more after it, the extra row only told that there is one
+        if last is None:
+            return '], "next": null}'
+        params = request.GET.copy()
+        params["after"] = encode_cursor(last[5], last[0])
+        return f'], "next": {self.encoder.encode("?" + params.urlencode())}}}'
@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def track_queries(sender, connection, **kwargs):
+    from juhannus import metrics
+    if metrics.track_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.track_queries)
 
 
 class JuhannusConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'juhannus'
+
+    def ready(self):
+        from juhannus import signals  # noqa: F401
+        if settings.METRICS:
+            connection_created.connect(track_queries, dispatch_uid='juhannus.metrics')
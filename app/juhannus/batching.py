@@ -0,0 +1,148 @@
+import enum
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+from juhannus.models import Participant, normalize_name
+from juhannus.signals import participants_created
+
+logger = logging.getLogger(__name__)
+
+
+class VoteStatus(enum.Enum):
+    ACCEPTED = "accepted"
+    NAME_IN_USE = "name in use"
+    CLOSED = "closed"
+    FAILED = "failed"
+
+
+class PendingVote:
+    def __init__(self, participant):
+        self.participant = participant
+        self.status = None
+        self.done = threading.Event()
+        # Under VoteBatcher.lock: taken by the worker, or given up on by the submitter, whichever comes first
+        self.taken = False
+        self.cancelled = False
+
+
+class VoteBatcher:
+    """
+    Queues votes that passed the accept-time checks and writes them with bulk_create from a worker thread,
+    batch_size votes or max_delay seconds at a time. submit() blocks until the vote has been written or rejected.
+
+    The batcher is per process, so batches only fill up when a process serves many requests at once: under ASGI or
+    threaded gunicorn workers. Sync WSGI workers serve one request per process, every batch then has a single vote
+    and the batcher only adds max_delay to each vote
+    """
+
+    def __init__(self, batch_size=50, max_delay=0.02, timeout=10):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending_names = set()
+        self.worker = None
+
+    def submit(self, participant):
+        if not participant.event.is_voting_available():
+            return VoteStatus.CLOSED
+
+        key = (participant.event_id, normalize_name(participant.name))
+        with self.lock:
+            if key in self.pending_names:
+                return VoteStatus.NAME_IN_USE
+            self.pending_names.add(key)
+        try:
+            if Participant.objects.filter(event_id=key[0], normalized_name=key[1]).exists():
+                return VoteStatus.NAME_IN_USE
+            vote = PendingVote(participant)
+            self.queue.put(vote)
+            self.start()
+            if not vote.done.wait(self.timeout):
+                with self.lock:
+                    vote.cancelled = not vote.taken
+                if vote.cancelled:
+                    # The worker skips it, the voter can safely try again
+                    return VoteStatus.FAILED
+                # Already being written, report what became of it rather than a failure that may not be one
+                vote.done.wait()
+            return vote.status or VoteStatus.FAILED
+        finally:
+            with self.lock:
+                self.pending_names.discard(key)
+
+    def start(self):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name="vote-batcher", daemon=True)
+                self.worker.start()
+
+    def take(self, until=None):
+        """
+        The next queued vote that has not been given up on, waiting until the monotonic time until (forever if None)
+        """
+        while True:
+            vote = self.queue.get(timeout=None if until is None else max(until - time.monotonic(), 0))
+            with self.lock:
+                if not vote.cancelled:
+                    vote.taken = True
+                    return vote
+
+    def run(self):
+        while True:
+            batch = [self.take()]
+            flush_at = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.take(flush_at))
+                except queue.Empty:
+                    break
+            try:
+                close_old_connections()
+                self.write(batch)
+            except Exception:
+                logger.exception("Writing a batch of %s votes failed", len(batch))
+            finally:
+                for vote in batch:
+                    vote.done.set()
+
+    def write(self, batch):
+        participants = [vote.participant for vote in batch]
+        for participant in participants:
+            participant.normalized_name = normalize_name(participant.name)
+        try:
+            with transaction.atomic():
+                Participant.objects.bulk_create(participants)
+                participants_created(participants)
+        except IntegrityError:
+            # A vote saved outside the batcher took one of the names, find out which one row by row
+            for vote in batch:
+                vote.participant.pk = None
+                try:
+                    with transaction.atomic():
+                        vote.participant.save()
+                except IntegrityError:
+                    vote.status = VoteStatus.NAME_IN_USE
+                else:
+                    vote.status = VoteStatus.ACCEPTED
+            return
+        for vote in batch:
+            vote.status = VoteStatus.ACCEPTED
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = VoteBatcher(batch_size=settings.VOTE_BATCH_SIZE, max_delay=settings.VOTE_BATCH_DELAY)
+        return _batcher
@@ -0,0 +1,166 @@
+import asyncio
+import collections
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.module_loading import import_string
+
+from juhannus.pagecache import is_shared_cache
+
+
+class LocalBroker:
+    """
+    In-process fan-out of change messages to every connected live feed. Messages are numbered so that a
+    reconnecting client can resume from Last-Event-ID as long as the message is still in the history.
+    Only reaches clients of the same process and its ids mean nothing to other workers, so the live feed stays off
+    with it, see is_live_feed_available
+    """
+    shared = False
+
+    def __init__(self, history=1000):
+        self.condition = threading.Condition()
+        self.messages = collections.deque(maxlen=history)
+        self.ids = itertools.count(1)
+        self.last_id = 0
+        self.waiters = set()
+
+    def publish(self, event, data):
+        with self.condition:
+            self.last_id = next(self.ids)
+            self.messages.append((self.last_id, event, data))
+            self.condition.notify_all()
+            # Publishing happens in the threads of sync code, async listeners are woken up in their own loop
+            for loop, waiter in self.waiters:
+                loop.call_soon_threadsafe(waiter.set)
+        return self.last_id
+
+    def get_messages(self, after):
+        return [message for message in self.messages if message[0] > after]
+
+    def get_start(self, last_id):
+        # An id from before a restart of the broker cannot be resumed from, start over from now
+        return self.last_id if last_id is None or last_id > self.last_id else last_id
+
+    async def alisten(self, last_id=None, timeout=15, duration=None):
+        """
+        Yields (id, event, data) after last_id (or from now on), and None every timeout seconds without messages
+        """
+        stop_at = duration and time.monotonic() + duration
+        after = self.get_start(last_id)
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.condition:
+            self.waiters.add(waiter)
+        try:
+            while not stop_at or time.monotonic() < stop_at:
+                wait = min(timeout, stop_at - time.monotonic()) if stop_at else timeout
+                with self.condition:
+                    messages = self.get_messages(after)
+                    waiter[1].clear()
+                if not messages:
+                    try:
+                        await asyncio.wait_for(waiter[1].wait(), max(wait, 0))
+                    except asyncio.TimeoutError:
+                        yield None
+                    continue
+                for message in messages:
+                    yield message
+                after = messages[-1][0]
+        finally:
+            with self.condition:
+                self.waiters.discard(waiter)
+
+
+class CacheBroker:
+    """
+    Messages in the default cache, so that every worker streams the changes made in the others and message ids are
+    the same in all of them. Needs a cache shared by the workers with an atomic incr (memcached, redis). Listeners
+    poll the cache every poll_interval seconds
+    """
+    last_id_key = "juhannus:live:last-id"
+
+    def __init__(self, history=1000, poll_interval=1, message_timeout=3600):
+        self.history = history
+        self.poll_interval = poll_interval
+        self.message_timeout = message_timeout
+
+    @property
+    def shared(self):
+        # A cache in the memory of each process (the default) would only carry the messages of its own worker
+        return is_shared_cache()
+
+    def get_message_key(self, message_id):
+        return f"juhannus:live:message:{message_id}"
+
+    def publish(self, event, data):
+        cache.add(self.last_id_key, 0, timeout=None)
+        message_id = cache.incr(self.last_id_key)
+        cache.set(self.get_message_key(message_id), (message_id, event, data), timeout=self.message_timeout)
+        return message_id
+
+    async def aget_messages(self, after):
+        """
+        The messages after after up to the first one that is missing, and the id of that one (None if none is)
+        """
+        last_id = await cache.aget(self.last_id_key, 0)
+        ids = range(max(after, last_id - self.history) + 1, last_id + 1)
+        stored = await cache.aget_many([self.get_message_key(message_id) for message_id in ids])
+        messages = []
+        for message_id in ids:
+            message = stored.get(self.get_message_key(message_id))
+            if message is None:
+                return messages, message_id
+            messages.append(message)
+        return messages, None
+
+    async def alisten(self, last_id=None, timeout=15, duration=None):
+        """
+        Yields (id, event, data) after last_id (or from now on), and None every timeout seconds without messages
+        """
+        stop_at = duration and time.monotonic() + duration
+        current = await cache.aget(self.last_id_key, 0)
+        # An id from before the cache was cleared cannot be resumed from, start over from now
+        after = current if last_id is None or last_id > current else last_id
+        quiet_since = time.monotonic()
+        waited_for = None
+        while not stop_at or time.monotonic() < stop_at:
+            messages, missing = await self.aget_messages(after)
+            if not messages and missing is not None and missing == waited_for:
+                # Still missing a poll later: expired, or its publisher died between numbering and storing it
+                after = missing
+                continue
+            # Another worker may be storing it right now, give it one poll
+            waited_for = missing
+            for message in messages:
+                yield message
+            if messages:
+                after = messages[-1][0]
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= timeout:
+                yield None
+                quiet_since = time.monotonic()
+            wait = min(self.poll_interval, stop_at - time.monotonic()) if stop_at else self.poll_interval
+            await asyncio.sleep(max(wait, 0))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.LIVE_BROKER)()
+        return _broker
+
+
+def is_live_feed_available(request):
+    """
+    A stream holds its connection for LIVE_STREAM_SECONDS, which only the event loop of ASGI can afford, and the
+    other workers only hear of changes, and understand Last-Event-ID, through a shared broker
+    """
+    return isinstance(request, ASGIRequest) and get_broker().shared
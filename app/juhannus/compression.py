@@ -0,0 +1,52 @@
+import gzip
+
+import brotli
+
+# Precompressed siblings that a front proxy (or our own static serving) can pick by Accept-Encoding
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+# Below this the headers outweigh the savings
+MIN_COMPRESS_SIZE = 256
+
+
+def compress(content, encoding, fast=False):
+    # The best ratio for content compressed once and served many times, fast for content built per request
+    if encoding == 'br':
+        return brotli.compress(content, quality=4 if fast else 11)
+    if encoding == 'gzip':
+        # Fixed mtime keeps the output identical for identical input
+        return gzip.compress(content, compresslevel=6 if fast else 9, mtime=0)
+    raise ValueError(f"Unknown encoding {encoding}")
+
+
+def compress_variants(content, fast=False):
+    """
+    {encoding: compressed content} of the encodings that make content smaller, empty for content below
+    MIN_COMPRESS_SIZE
+    """
+    if len(content) < MIN_COMPRESS_SIZE:
+        return {}
+    variants = {encoding: compress(content, encoding, fast) for encoding in ENCODINGS}
+    return {encoding: variant for encoding, variant in variants.items() if len(variant) < len(content)}
+
+
+def get_accepted_encodings(request):
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        encoding, _, params = part.partition(';')
+        try:
+            quality = float(params.strip().removeprefix('q=')) if params.strip() else 1
+        except ValueError:
+            quality = 0
+        if encoding.strip() and quality > 0:
+            accepted.add(encoding.strip().lower())
+    return accepted
+
+
+def write_precompressed(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    for encoding, suffix in ENCODINGS.items():
+        path.with_name(path.name + suffix).write_bytes(compress(content, encoding))
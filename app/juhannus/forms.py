@@ -1,19 +1,18 @@
 from django import forms
 
-from juhannus.models import Participant
+from juhannus.models import Participant, normalize_name
 
 
 class SubmitForm(forms.ModelForm):
 
-    def clean(self):
-        action = self.data.get("action")
-        if action == "delete":
-            return self.cleaned_data
+    name_in_use_message = "Name already in use. Choose another"
+
+    def add_name_in_use_error(self):
+        # Duplicate names are not queried for up front, the unique index rejects them when saving
+        self.add_error("name", self.name_in_use_message)
 
-        name = self.cleaned_data.get("name")
-        event = self.cleaned_data.get("event")
-        if event.participants.filter(name__iexact=name.strip()) and action != "modify":
-            raise forms.ValidationError({"name": "Name already in use. Choose another"})
+    def add_not_saved_error(self):
+        self.add_error("vote", "Vote could not be saved, try again")
 
     class Meta:
         model = Participant
@@ -36,3 +35,19 @@ class SubmitForm(forms.ModelForm):
                 'min': 0,
                 'max': 100})
         }
+
+
+class ParticipantAdminForm(forms.ModelForm):
+    def clean(self):
+        cleaned_data = super().clean()
+        name = cleaned_data.get("name")
+        event = cleaned_data.get("event")
+        if name and event:
+            duplicates = event.participants.exclude(pk=self.instance.pk).filter(normalized_name=normalize_name(name))
+            if duplicates.exists():
+                raise forms.ValidationError({"name": SubmitForm.name_in_use_message})
+        return cleaned_data
+
+    class Meta:
+        model = Participant
+        fields = ('name', 'event', 'vote', 'visible')
@@ -0,0 +1,102 @@
+import io
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from juhannus.models import Event, Participant
+
+SORTS = ["name=asc", "name=desc", "vote=asc", "vote=desc"]
+BENCHMARK_USER = "benchmark-staff"
+# Cleared before every request, so not the cache the running site shares
+BENCHMARK_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                "LOCATION": "benchmark-pages"}}
+
+
+class Command(BaseCommand):
+    help = ("Measure latency and query counts of the event pages, the stats page and vote posts on the current data, "
+            "or on seed_data datasets of each of --sizes participants in a test database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='*', default=[],
+                            help="Seed a dataset of each size in a test database before measuring")
+        parser.add_argument('--years', type=int, default=30, help="Years to seed with --sizes")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    @override_settings(CACHES=BENCHMARK_CACHES)
+    def handle(self, *args, **options):
+        if not options['sizes']:
+            if not Event.objects.exists():
+                raise CommandError("No events, seed some with seed_data or pass --sizes")
+            self.benchmark(options)
+            return
+
+        # Seeding replaces years, which is for a test database like replay_deadline's and not the configured one
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def benchmark(self, options):
+        # The admin's view of the pages, with the edit controls
+        user = get_user_model().objects.create_user(BENCHMARK_USER, is_staff=True, is_superuser=True)
+        try:
+            self.stdout.write(f"{'participants':>12} {'page':<28} {'user':<9} {'ms':>8} {'queries':>7}")
+            for size in options['sizes'] or [None]:
+                if size is not None:
+                    call_command('seed_data', participants=size, years=options['years'], replace=True,
+                                 stdout=io.StringIO())
+                self.run_benchmarks(user, options['repeat'])
+        finally:
+            user.delete()
+
+    @override_settings(ALLOWED_HOSTS=["testserver"], VOTE_RATE_LIMIT=False)
+    def run_benchmarks(self, user, repeat):
+        size = Participant.objects.count()
+        # Created under the override, so that the rate limit of vote posts is left out of their middleware
+        anonymous, staff = Client(), Client()
+        staff.force_login(user)
+        # Pages of the latest event and of the biggest finished one
+        latest = Event.objects.order_by("year").last()
+        biggest = (Event.objects.filter(is_final=True).order_by("-histogram__count").first() or latest)
+        requests = []
+        for year in sorted({latest.year, biggest.year}):
+            url = reverse("juhannus:event-detail", kwargs={"year": year})
+            for sort in SORTS:
+                requests += [(f"{url}?{sort}", "anonymous", anonymous), (f"{url}?{sort}", "staff", staff)]
+        requests += [(reverse("juhannus:event-stats"), "anonymous", anonymous)]
+
+        for url, name, client in requests:
+            elapsed, queries = self.measure(repeat, lambda: client.get(url))
+            self.stdout.write(f"{size:>12} {url:<28} {name:<9} {elapsed * 1000:>8.1f} {queries:>7}")
+
+        # Staff can vote after the deadline too, the posted votes are removed afterwards
+        posts = iter(range(repeat))
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": latest.year})
+        elapsed, queries = self.measure(repeat, lambda: staff.post(endpoint, {
+            "name": f"{BENCHMARK_USER}-{next(posts)}", "vote": 50, "event": latest.pk, "action": "save"}))
+        self.stdout.write(f"{size:>12} {'POST ' + endpoint:<28} {'staff':<9} {elapsed * 1000:>8.1f} {queries:>7}")
+        for participant in latest.participants.filter(name__startswith=f"{BENCHMARK_USER}-"):
+            participant.delete()
+
+    def measure(self, repeat, request):
+        timings = []
+        for _ in range(repeat):
+            # Measure building the page, not the page cache
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = request()
+                timings.append(time.perf_counter() - start)
+            if response.status_code not in (200, 302):
+                raise CommandError(f"Got {response.status_code}")
+        return statistics.median(timings), len(queries)
@@ -0,0 +1,144 @@
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+
+SERVERS = {
+    'wsgi': ['config.wsgi'],
+    'asgi': ['config.asgi', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+class Command(BaseCommand):
+    help = ("Compare how gunicorn serves the WSGI and the ASGI application at equal worker counts. Holds "
+            "--connections slow clients on the event and stats pages, which send their requests a part at a time, "
+            "and times a page request meanwhile. The live feed is measured under ASGI only, the WSGI application "
+            "does not serve it")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--connections', type=int, default=50, help="Slow clients and live feed streams")
+        parser.add_argument('--timeout', type=float, default=5, help="Seconds to wait for each response")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        modes = ['wsgi', 'asgi'] if options['mode'] == 'both' else [options['mode']]
+        self.stdout.write(f"{'mode':<6} {'workers':>7} {'slow':>5} {'served':>7} {'page ms':>8} {'streams':>11}")
+        for mode in modes:
+            # The feed needs a broker shared by the workers, the file cache stands in for memcached or redis.
+            # Without DEBUG the pages link to the collected static files
+            with tempfile.TemporaryDirectory() as directory:
+                static_root = os.path.join(directory, 'static')
+                with override_settings(STATIC_ROOT=static_root):
+                    call_command('collectstatic', interactive=False, verbosity=0)
+                env = {'DEBUG': 'False', 'LIVE_BROKER': 'juhannus.broker.CacheBroker',
+                       'CACHE_URL': f'filecache://{os.path.join(directory, "cache")}', 'STATIC_ROOT': static_root}
+                with run_server([*SERVERS[mode], '-w', str(options['workers'])], options['port'], env):
+                    served, page_time = self.measure_slow_clients(options['port'], options['connections'],
+                                                                  options['timeout'])
+                    # is_live_feed_available is False under WSGI, there is nothing to count
+                    streams = (f"{self.measure_streams(options['port'], options['connections'], options['timeout'])}"
+                               if mode == 'asgi' else "unsupported")
+            page = f"{page_time * 1000:.0f}" if page_time is not None else "failed"
+            self.stdout.write(f"{mode:<6} {options['workers']:>7} {options['connections']:>5} {served:>7} "
+                              f"{page:>8} {streams:>11}")
+
+    def measure_slow_clients(self, port, connections, timeout):
+        """
+        Opens connections that send all but the end of their request headers, like clients on a slow network,
+        and times a page request while they are held. Returns how many of the slow requests were answered once
+        finished, and the page time (None if it timed out or failed)
+        """
+        paths = [reverse("juhannus:event-latest"), reverse("juhannus:event-stats")]
+        slow = []
+        for index in range(connections):
+            sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+            sock.sendall(f"GET {paths[index % 2]} HTTP/1.1\r\nHost: 127.0.0.1\r\n".encode())
+            slow.append(sock)
+        # Give the workers time to pick the slow connections up
+        time.sleep(0.5)
+
+        # A sync worker is stuck reading the headers of a slow client, an async one serves other requests meanwhile
+        start = time.perf_counter()
+        sock = request(port, paths[0], timeout)
+        try:
+            page_time = time.perf_counter() - start if sock.recv(1024).startswith(b"HTTP/1.1 200") else None
+        except OSError:
+            page_time = None
+        sock.close()
+
+        served = 0
+        for sock in slow:
+            try:
+                sock.sendall(b"Connection: close\r\n\r\n")
+                served += sock.recv(1024).startswith(b"HTTP/1.1 200")
+            except OSError:
+                pass
+            sock.close()
+        return served, page_time
+
+    def measure_streams(self, port, connections, timeout):
+        # Live feed streams held open at once, each one would hold a worker of a sync server
+        streams = []
+        lock = threading.Lock()
+
+        def open_stream():
+            sock = request(port, reverse("juhannus:event-live"), timeout)
+            try:
+                if sock.recv(1024).startswith(b"HTTP/1.1 200"):
+                    with lock:
+                        streams.append(sock)
+                    return
+            except OSError:
+                pass
+            sock.close()
+
+        threads = [threading.Thread(target=open_stream) for _ in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for sock in streams:
+            sock.close()
+        return len(streams)
+
+
+@contextlib.contextmanager
+def run_server(args, port, env):
+    """
+    Runs gunicorn with args on 127.0.0.1:port while in the block, with env added to the environment
+    """
+    command = [sys.executable, '-m', 'gunicorn', *args, '-b', f'127.0.0.1:{port}', '--timeout', '120']
+    env = {**os.environ, 'ALLOWED_HOSTS': '127.0.0.1', **env}
+    process = subprocess.Popen(command, env=env, cwd=settings.BASE_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise CommandError(f"Server did not start: {' '.join(command)}")
+        yield
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def request(port, path, timeout):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+    sock.sendall(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+    return sock
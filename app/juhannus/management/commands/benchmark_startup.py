@@ -0,0 +1,109 @@
+import http.client
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from juhannus.management.commands.benchmark_servers import run_server
+
+PROFILES = {
+    'production': {'DEBUG': 'False', 'DEV_TOOLS': 'False'},
+    'development': {'DEBUG': 'True', 'DEV_TOOLS': 'True'},
+}
+
+# Run in a fresh interpreter under -X importtime: load the WSGI application, then serve one request through it
+CHILD = """
+import io, json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+from config.wsgi import application
+imported = time.perf_counter()
+statuses = []
+environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'SERVER_NAME': '127.0.0.1', 'SERVER_PORT': '80',
+           'HTTP_HOST': '127.0.0.1', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr}
+b''.join(application(environ, lambda status, headers: statuses.append(status)))
+print(json.dumps({'import': imported - start, 'response': time.perf_counter() - imported, 'status': statuses[0]}))
+"""
+
+
+class Command(BaseCommand):
+    help = ("Compare the startup of the production and the development profile: import time per top-level package "
+            "and time to the first response in a fresh interpreter, and with --gunicorn the time from starting "
+            "gunicorn to its first response, which is also what recycling a worker costs")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15, help="Packages to list")
+        parser.add_argument('--gunicorn', action='store_true')
+        parser.add_argument('--port', type=int, default=8767)
+
+    def handle(self, *args, **options):
+        profiles = dict(PROFILES)
+        if importlib.util.find_spec('debug_toolbar') is None:
+            self.stdout.write("Development tools are not installed (requirements-dev.txt), skipping development")
+            del profiles['development']
+
+        results = {name: self.measure(env, options['repeat']) for name, env in profiles.items()}
+        self.stdout.write(f"{'ms, median of ' + str(options['repeat']):<32}"
+                          + "".join(f"{name:>13}" for name in results))
+        totals = Counter()
+        for packages in [result['packages'] for result in results.values()]:
+            totals.update(packages)
+        for package, _ in totals.most_common(options['top']):
+            self.stdout.write(f"{package:<32}"
+                              + "".join(f"{result['packages'].get(package, 0):>13.1f}" for result in results.values()))
+        for key, label in [('import', "import total"), ('response', "first response")]:
+            self.stdout.write(f"{label:<32}" + "".join(f"{result[key]:>13.1f}" for result in results.values()))
+
+        if options['gunicorn']:
+            for name, env in profiles.items():
+                timings = [self.boot(env, options['port']) for _ in range(options['repeat'])]
+                self.stdout.write(f"{'gunicorn boot ' + name:<32}{statistics.median(timings) * 1000:>13.1f}")
+
+    def measure(self, env, repeat):
+        runs = []
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=settings.BASE_DIR,
+                                     env={**os.environ, 'ALLOWED_HOSTS': '127.0.0.1', **env},
+                                     capture_output=True, text=True)
+            if process.returncode:
+                raise CommandError(process.stderr[-2000:])
+            timings = json.loads(process.stdout.splitlines()[-1])
+            if not timings['status'].startswith(('200', '302')):
+                raise CommandError(f"First response was {timings['status']}")
+            runs.append((timings, self.parse_importtime(process.stderr)))
+
+        packages = {package: statistics.median(run[1].get(package, 0) for run in runs)
+                    for package in set().union(*(run[1] for run in runs))}
+        return {
+            'packages': packages,
+            'import': statistics.median(run[0]['import'] for run in runs) * 1000,
+            'response': statistics.median(run[0]['response'] for run in runs) * 1000,
+        }
+
+    def parse_importtime(self, stderr):
+        # "import time: self [us] | cumulative | package", self times summed per top-level package, in ms
+        packages = Counter()
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, _, name = line[len('import time:'):].split('|')
+            packages[name.strip().split('.')[0]] += int(own) / 1000
+        return packages
+
+    def boot(self, env, port):
+        start = time.perf_counter()
+        with run_server(['config.wsgi', '-c', 'config/gunicorn.py', '-w', '1'], port, env):
+            # The master listens before the worker is up, the first response waits for the worker
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+        return time.perf_counter() - start
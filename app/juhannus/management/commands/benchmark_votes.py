@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from juhannus import batching
+from juhannus.models import Event, Header, Body
+
+BENCHMARK_YEAR = 9999
+# Votes purge pages and publish to the live feed, which is none of the running site's business
+BENCHMARK_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                "LOCATION": "benchmark-votes"}}
+
+
+class Command(BaseCommand):
+    help = ("Compare sustained vote submissions per second of the direct and the batched save path, "
+            f"voting in a {BENCHMARK_YEAR} event of a test database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16, help="Concurrent clients")
+        parser.add_argument('--votes', type=int, default=1000, help="Votes per mode")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--batch-delay', type=float, default=0.02)
+        parser.add_argument('--mode', choices=['direct', 'batched', 'both'], default='both')
+
+    @override_settings(CACHES=BENCHMARK_CACHES)
+    def handle(self, *args, **options):
+        # A test database like replay_deadline's, the event and the leaderboard rows of the votes stay out of the
+        # configured one
+        old_name = connection.settings_dict["NAME"]
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == "sqlite":
+                # The clients vote from threads with connections of their own, which an in-memory database
+                # would lock out of its tables
+                connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "benchmark.sqlite3")
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.benchmark(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def benchmark(self, options):
+        modes = ['direct', 'batched'] if options['mode'] == 'both' else [options['mode']]
+        event = Event.objects.create(year=BENCHMARK_YEAR, header=Header.objects.create(title="benchmark", text=""),
+                                     body=Body.objects.create(title="benchmark", text=""))
+        try:
+            self.stdout.write(f"{'mode':<8} {'votes':>6} {'seconds':>8} {'votes/s':>8} {'accepted':>9} {'errors':>7}")
+            for mode in modes:
+                batching._batcher = batching.VoteBatcher(batch_size=options['batch_size'],
+                                                         max_delay=options['batch_delay'])
+                # Every client posts from the same address, the rate limits would turn most of them away
+                with override_settings(VOTE_BATCHING=mode == 'batched', VOTE_RATE_LIMIT=False,
+                                       ALLOWED_HOSTS=['testserver']):
+                    elapsed, errors = self.run_clients(event, mode, options['clients'], options['votes'])
+                accepted = event.participants.filter(name__startswith=f"{mode}-").count()
+                self.stdout.write(f"{mode:<8} {options['votes']:>6} {elapsed:>8.2f} "
+                                  f"{options['votes'] / elapsed:>8.1f} {accepted:>9} {errors:>7}")
+        finally:
+            batching._batcher = None
+
+    def run_clients(self, event, mode, clients, votes):
+        endpoint = reverse("juhannus:event-latest")
+        errors = []
+
+        def client(offset):
+            http = Client()
+            for i in range(offset, votes, clients):
+                data = {"name": f"{mode}-{i}", "vote": i % 101, "event": event.pk, "action": "save"}
+                try:
+                    if http.post(endpoint, data).status_code != 302:
+                        errors.append(i)
+                except Exception:
+                    errors.append(i)
+
+        threads = [threading.Thread(target=client, args=(offset,)) for offset in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, len(errors)
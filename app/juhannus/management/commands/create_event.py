@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from juhannus.models import Event, create_midsummer_event, get_midsummer_week_start
+
+
+class Command(BaseCommand):
+    help = ("Create the Event of the year from the previous header and body once midsummer week has started. "
+            "Safe to run repeatedly, e.g. daily from cron and on container start. Without it the first page request "
+            "of midsummer week creates the event")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help="Defaults to the current year")
+        parser.add_argument('--force', action='store_true', help="Create the event even before midsummer week")
+
+    def handle(self, *args, **options):
+        year = options['year'] or timezone.localtime().year
+        if Event.objects.filter(year=year).exists():
+            self.stdout.write(f"Event for {year} already exists")
+            return
+
+        week_start = get_midsummer_week_start(year)
+        if timezone.localtime() < week_start and not options['force']:
+            self.stdout.write(f"Midsummer week {year} starts {week_start:%Y-%m-%d}, not creating the event yet")
+            return
+
+        try:
+            created = create_midsummer_event(year)
+        except Event.DoesNotExist as e:
+            raise CommandError(e)
+        if created is None:
+            # Another run or the request fallback got there first
+            self.stdout.write(f"Event for {year} already exists")
+            return
+        self.stdout.write(f"Created event for {year}")
@@ -0,0 +1,101 @@
+import hashlib
+import json
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import reverse
+
+from juhannus import pagecache
+from juhannus.compression import ENCODINGS, write_precompressed
+from juhannus.models import Event, change_marker
+from juhannus.views import EventView, StatsView, StatsDataView
+
+MANIFEST_NAME = "manifest.json"
+
+
+def get_fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class Command(BaseCommand):
+    help = ("Render finalized years and the stats page into static files with .gz/.br siblings. "
+            "The stats page loads stats.json, which ignores ?limit= there. <year>/index.html is the default order, "
+            "<year>/<name|vote>-<asc|desc>.html the ?name=/?vote= orders")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', type=Path)
+        parser.add_argument('--force', action='store_true', help="Render every page even if its data is unchanged")
+
+    def handle(self, *args, **options):
+        self.directory = options['directory']
+        self.factory = RequestFactory()
+        manifest_path = self.directory / MANIFEST_NAME
+        old_manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {"pages": {}}
+        manifest = {"pages": {}}
+
+        events = list(Event.objects.annotate(changed=change_marker()).order_by("year"))
+        years = [event.year for event in events]
+        pages = {}
+        # There is nothing to fetch further windows of the table from in the archive
+        event_view = EventView.as_view(windowed=False)
+        for event in events:
+            if event.is_final and not event.is_voting_available():
+                variants = {"index": {}}
+                variants.update({variant: dict([variant.split("-")]) for variant in pagecache.SORT_VARIANTS})
+                pages[str(event.year)] = (
+                    get_fingerprint(event.year, event.changed, years),
+                    {f"{event.year}/{name}.html": (event_view, "juhannus:event-detail", {"year": event.year}, params)
+                     for name, params in variants.items()})
+        pages["stats"] = (
+            get_fingerprint(max((event.changed for event in events), default=None), years),
+            {"stats/index.html": (StatsView.as_view(), "juhannus:event-stats", {}, {}),
+             "stats.json": (StatsDataView.as_view(), "juhannus:event-stats-data", {}, {})})
+
+        rendered = skipped = 0
+        for key, (fingerprint, files) in pages.items():
+            old = old_manifest["pages"].get(key)
+            if old and old["fingerprint"] == fingerprint and not options['force'] and self.exists(old["files"]):
+                manifest["pages"][key] = old
+                skipped += 1
+                continue
+            hashes = {}
+            for path, page in files.items():
+                hashes[path] = self.export(path, *page, old_hash=(old or {}).get("files", {}).get(path))
+            manifest["pages"][key] = {"fingerprint": fingerprint, "files": hashes}
+            rendered += 1
+
+        for key, old in old_manifest["pages"].items():
+            if key not in manifest["pages"]:
+                self.remove(old["files"])
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        self.stdout.write(f"Exported {rendered} pages, {skipped} unchanged")
+
+    def export(self, path, view, url_name, kwargs, params, old_hash=None):
+        request = self.factory.get(reverse(url_name, kwargs=kwargs), params)
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+
+        # The views are async, normally the authentication middleware provides auser
+        request.auser = auser
+        response = async_to_sync(view)(request, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if content_hash != old_hash or not self.exists([path]):
+            write_precompressed(self.directory / path, response.content)
+        return content_hash
+
+    def exists(self, paths):
+        return all((self.directory / path).exists() for path in paths)
+
+    def remove(self, paths):
+        for path in paths:
+            for suffix in ["", *ENCODINGS.values()]:
+                (self.directory / (path + suffix)).unlink(missing_ok=True)
@@ -0,0 +1,47 @@
+import datetime
+import io
+import pstats
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from juhannus import profiling
+
+
+class Command(BaseCommand):
+    help = ("Aggregate the request profiles of ProfilingMiddleware into a summary per view and the top hot functions "
+            "over all matching profiles")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILE_DIR)
+        parser.add_argument('--view', help="Only profiles of views whose name contains this, e.g. event-detail")
+        parser.add_argument('--hours', type=float, help="Only profiles of the last --hours hours")
+        parser.add_argument('--top', type=int, default=30, help="Functions to list")
+        parser.add_argument('--sort', choices=['tottime', 'cumulative', 'ncalls'], default='tottime',
+                            help="tottime finds the hot functions, cumulative the expensive call paths")
+
+    def handle(self, *args, **options):
+        files = profiling.read_directory(options['dir'])
+        if options['view']:
+            files = [file for file in files if options['view'] in file.view]
+        if options['hours']:
+            since = timezone.now() - datetime.timedelta(hours=options['hours'])
+            files = [file for file in files if file.time >= since]
+        if not files:
+            raise CommandError(f"No matching profiles in {options['dir']}")
+
+        self.stdout.write(f"{'view':<32} {'requests':>8} {'p50 ms':>7} {'max ms':>7} {'queries':>7}")
+        for view in sorted({file.view for file in files}):
+            rows = [file for file in files if file.view == view]
+            self.stdout.write(f"{view:<32} {len(rows):>8} {statistics.median(row.milliseconds for row in rows):>7.0f} "
+                              f"{max(row.milliseconds for row in rows):>7} "
+                              f"{statistics.mean(row.queries for row in rows):>7.1f}")
+
+        output = io.StringIO()
+        stats = pstats.Stats(*(str(file.path) for file in files), stream=output)
+        # Not a line per profile file in the header
+        stats.files = []
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['top'])
+        self.stdout.write(output.getvalue())
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django.db import transaction
+
+from juhannus.models import Event, LeaderboardEntry
+
+
+class Command(BaseCommand):
+    help = ("Rank the participants of events with a result again and rebuild the all-time leaderboard from them, "
+            "or compare the leaderboard against the stored ranks with --check")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report differences between the stored and the live leaderboard")
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            with transaction.atomic():
+                for event in Event.objects.exclude(result=None):
+                    event.rank_participants()
+                counts = LeaderboardEntry.rebuild()
+            self.stdout.write(f"Leaderboard rebuilt with {len(counts)} names")
+            return
+
+        live = LeaderboardEntry.compute()
+        stored = {entry.name: {'participations': entry.participations, 'wins': entry.wins}
+                  for entry in LeaderboardEntry.objects.exclude(participations=0, wins=0)}
+        differences = 0
+        for name in sorted(live.keys() | stored.keys()):
+            if live.get(name) != stored.get(name):
+                differences += 1
+                self.stdout.write(f"{name}: stored {stored.get(name)}, live {live.get(name)}")
+        if differences:
+            raise CommandError(f"Leaderboard differs from participants for {differences} names")
+        self.stdout.write(f"Leaderboard matches participants ({len(live)} names)")
@@ -0,0 +1,172 @@
+import datetime
+import http.client
+import io
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.cookies import SimpleCookie
+from typing import NamedTuple
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from juhannus.management.commands.benchmark_servers import run_server
+from juhannus.models import Event, Participant
+
+SERVERS = {
+    'wsgi': ['config.loadtest:application'],
+    'asgi': ['config.loadtest:asgi_application', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+PAGES = ["/", "/?name=asc", "/?name=desc", "/?vote=asc", "/?vote=desc"]
+
+
+class Result(NamedTuple):
+    kind: str
+    elapsed: float
+    status: int | None  # None when the connection failed
+    sent_at: datetime.datetime  # on the shifted clock of the app
+    name: str | None = None
+    duplicate: bool = False
+    name_in_use: bool = False
+
+
+class Command(BaseCommand):
+    help = ("Rehearse the rush before the voting deadline: start the app on a test database with its clock shifted "
+            "to --before seconds ahead of the deadline, and run concurrent clients mixing page loads and votes "
+            "until --after seconds past it. Set VOTE_BATCHING etc. in the environment as for the real server. "
+            "The vote rate limits are off unless --rate-limit")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=32)
+        parser.add_argument('--before', type=float, default=20, help="Seconds of load before the deadline")
+        parser.add_argument('--after', type=float, default=5, help="Seconds of load after the deadline")
+        parser.add_argument('--post-share', type=float, default=0.3, help="Share of requests that are votes")
+        parser.add_argument('--duplicate-share', type=float, default=0.05,
+                            help="Share of votes reusing a name another client already voted with")
+        parser.add_argument('--participants', type=int, default=10000, help="Participants seeded before the test")
+        parser.add_argument('--server', choices=SERVERS, default='wsgi')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--port', type=int, default=8766)
+        parser.add_argument('--rate-limit', action='store_true',
+                            help="Keep the vote rate limits on, with every client on an address of its own")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        database_url = os.environ["DATABASE_URL"]
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == "sqlite":
+                # The server processes need a file, an in-memory test database is not shared with them
+                connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "loadtest.sqlite3")
+            test_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                call_command("seed_data", participants=options['participants'], stdout=io.StringIO())
+                if connection.vendor == "sqlite":
+                    database_url = f"sqlite:///{test_name}"
+                else:
+                    database_url = urllib.parse.urlsplit(database_url)._replace(path="/" + test_name).geturl()
+                self.replay(options, database_url)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def replay(self, options, database_url):
+        event = Event.objects.order_by("year").last()
+        deadline = event.get_voting_deadline()
+        offset = (deadline - timezone.now()).total_seconds() - options['before']
+        env = {'DATABASE_URL': database_url, 'LOADTEST_CLOCK_OFFSET': str(offset), 'DEBUG': 'False'}
+        if options['rate_limit']:
+            # All clients connect from 127.0.0.1, the limits go by the address each one claims instead
+            env['VOTE_CLIENT_HEADER'] = 'X-Forwarded-For'
+        else:
+            env['VOTE_RATE_LIMIT'] = 'False'
+        args = [*SERVERS[options['server']], '-w', str(options['workers'])]
+
+        results = []
+        names = []
+        with run_server(args, options['port'], env):
+            stop_at = time.monotonic() + options['before'] + options['after']
+            threads = [threading.Thread(target=self.client, args=(i, options, event, stop_at, offset, results, names))
+                       for i in range(options['clients'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.report(options, event, deadline, results)
+
+    def client(self, number, options, event, stop_at, offset, results, names):
+        rng = random.Random(number)
+        conn = http.client.HTTPConnection("127.0.0.1", options['port'], timeout=30)
+        address = {"X-Forwarded-For": f"10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}"}
+        csrf_token = None
+        i = 0
+        while time.monotonic() < stop_at:
+            i += 1
+            # The first page load gets the csrf cookie for voting
+            if csrf_token is None or rng.random() >= options['post_share']:
+                kind, method, path, body, headers = "page", "GET", rng.choice(PAGES), None, {**address}
+                name, duplicate = None, False
+            else:
+                duplicate = bool(names) and rng.random() < options['duplicate_share']
+                name = rng.choice(names) if duplicate else f"rush {number}-{i}"
+                kind, method, path = "vote", "POST", "/"
+                body = urllib.parse.urlencode({"name": name, "vote": rng.randint(0, 100), "event": event.pk,
+                                               "action": "save", "csrfmiddlewaretoken": csrf_token})
+                headers = {"Content-Type": "application/x-www-form-urlencoded", "Cookie": f"csrftoken={csrf_token}",
+                           **address}
+            sent_at = timezone.now() + datetime.timedelta(seconds=offset)
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                content = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                results.append(Result(kind, time.perf_counter() - start, None, sent_at, name, duplicate))
+                continue
+            elapsed = time.perf_counter() - start
+            cookie = SimpleCookie(response.getheader("Set-Cookie") or "")
+            if "csrftoken" in cookie:
+                csrf_token = cookie["csrftoken"].value
+            if name and not duplicate:
+                # Only names that have been submitted are reused, so the first use is always the original
+                names.append(name)
+            results.append(Result(kind, elapsed, response.status, sent_at, name, duplicate,
+                                  b"Name already in use" in content))
+        conn.close()
+
+    def report(self, options, event, deadline, results):
+        elapsed = options['before'] + options['after']
+        self.stdout.write(f"{'kind':<6} {'requests':>9} {'req/s':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} "
+                          f"{'errors':>7} {'429':>6} {'4xx':>6}")
+        for kind in ["page", "vote"]:
+            rows = [row for row in results if row.kind == kind]
+            if not rows:
+                continue
+            timings = sorted(row.elapsed * 1000 for row in rows)
+            percentiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+            errors = sum(1 for row in rows if row.status is None or row.status >= 500)
+            limited = sum(1 for row in rows if row.status == 429)
+            refused = sum(1 for row in rows if row.status is not None and 400 <= row.status < 500) - limited
+            self.stdout.write(f"{kind:<6} {len(rows):>9} {len(rows) / elapsed:>7.1f} {percentiles[49]:>7.0f} "
+                              f"{percentiles[94]:>7.0f} {percentiles[98]:>7.0f} {errors:>7} {limited:>6} {refused:>6}")
+
+        # Votes turned away before the form (rate limits, csrf) are in the 429 and 4xx columns only
+        votes = [row for row in results if row.kind == "vote" and row.status is not None and row.status < 400]
+        saved = set(event.participants.filter(name__startswith="rush ").values_list("name", flat=True))
+        new = [row for row in votes if not row.duplicate]
+        before = [row for row in new if row.sent_at <= deadline]
+        late = [row for row in new if row.sent_at > deadline]
+        duplicates = [row for row in votes if row.duplicate]
+        duplicate_rows = (Participant.objects.values("event", "normalized_name").annotate(count=Count("id"))
+                          .filter(count__gt=1).count())
+        self.stdout.write(f"Votes before the deadline: {len(before)}, saved {sum(row.name in saved for row in before)}")
+        self.stdout.write(f"Reused names: {len(duplicates)}, rejected as in use "
+                          f"{sum(row.name_in_use for row in duplicates)}, duplicates in the database {duplicate_rows}")
+        self.stdout.write(f"Votes after the deadline: {len(late)}, "
+                          f"wrongly accepted {sum(row.name in saved for row in late)}")
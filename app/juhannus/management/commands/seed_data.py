@@ -0,0 +1,84 @@
+import random
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from juhannus.models import (Event, Header, Body, Participant, VoteHistogram, LeaderboardEntry, VOTE_MIN, VOTE_MAX,
+                             normalize_name)
+
+FIRST_NAMES = ["Aino", "Antti", "Eero", "Elina", "Emma", "Heikki", "Helmi", "Ilkka", "Jari", "Juha", "Jukka", "Kaisa",
+               "Kalle", "Laura", "Leena", "Liisa", "Markku", "Mikko", "Minna", "Noora", "Olli", "Pekka", "Pirjo",
+               "Riikka", "Sanna", "Seppo", "Tiina", "Timo", "Tuula", "Ville"]
+LAST_NAMES = ["Heikkinen", "Hämäläinen", "Järvinen", "Koskinen", "Korhonen", "Laine", "Lehtonen", "Mäkelä",
+              "Mäkinen", "Nieminen", "Saarinen", "Salminen", "Virtanen"]
+# Share of each year's participants that did not take part the year before
+NEW_SHARE = 0.3
+
+
+def get_name(index):
+    # Later names are variants of the earlier ones, the way people with a common name tell themselves apart
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[index // len(FIRST_NAMES) % len(LAST_NAMES)]
+    variant = index // (len(FIRST_NAMES) * len(LAST_NAMES))
+    name = f"{first} {last}" if variant == 0 else f"{first} {last} {variant}"
+    return name.lower() if index % 7 == 0 else name
+
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic dataset for benchmarking: events of the last --years years sharing a header and body, "
+            "and --participants participants spread over them, mostly the same people from year to year")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=30)
+        parser.add_argument('--participants', type=int, default=10000, help="Participants over all years")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, the same seed gives the same data")
+        parser.add_argument('--replace', action='store_true', help="Delete existing events of the seeded years")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        last_year = timezone.localtime().year
+        years = list(range(last_year - options['years'] + 1, last_year + 1))
+        existing = Event.objects.filter(year__in=years)
+        if existing.exists() and not options['replace']:
+            raise CommandError(f"Events exist for {years[0]}-{years[-1]}, use --replace to delete them")
+
+        # Attendance grows over the years
+        weights = [1 + i / len(years) for i in range(len(years))]
+        counts = [int(options['participants'] * weight / sum(weights)) for weight in weights]
+        counts[-1] += options['participants'] - sum(counts)
+
+        with transaction.atomic():
+            # Deleting participants one signal at a time would take hours at millions of rows
+            Participant.objects.filter(event__in=existing)._raw_delete(Participant.objects.db)
+            existing.delete()
+            header = (Header.objects.filter(title="Seed").first()
+                      or Header.objects.create(title="Seed", text="Juhannus $year"))
+            body = (Body.objects.filter(title="Seed").first()
+                    or Body.objects.create(title="Seed", text="Juhannus $year, arvaa luku väliltä 0-100"))
+            offset = 0
+            for year, count in zip(years, counts):
+                self.seed_event(rng, year, count, offset, header, body, is_final=year != last_year)
+                offset += int(count * NEW_SHARE)
+                self.stdout.write(f"{year}: {count} participants")
+
+            # bulk_create skips the signals that keep these up to date
+            for event in Event.objects.filter(year__in=years):
+                VoteHistogram.rebuild(event.pk)
+                event.rank_participants()
+            LeaderboardEntry.rebuild()
+        cache.clear()
+        self.stdout.write(f"Seeded {sum(counts)} participants in {len(years)} events")
+
+    def seed_event(self, rng, year, count, offset, header, body, is_final):
+        mean = rng.uniform(10, 25)
+        votes = [min(max(round(rng.gauss(mean, 6)), VOTE_MIN), VOTE_MAX) for _ in range(count)]
+        result = min(max(round(rng.gauss(mean, 4)), VOTE_MIN), VOTE_MAX)
+        event = Event.objects.create(year=year, header=header, body=body,
+                                     result=result if is_final else None, is_final=is_final)
+        participants = []
+        for i, vote in enumerate(votes):
+            name = get_name(offset + i)
+            participants.append(Participant(event=event, name=name, normalized_name=normalize_name(name), vote=vote))
+        Participant.objects.bulk_create(participants, batch_size=5000)
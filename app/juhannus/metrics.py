@@ -0,0 +1,93 @@
+"""
+Prometheus metrics of requests, queries, template rendering and votes, served at /metrics.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR and run with config/gunicorn.py, so that every worker writes its values
+to its own files in the directory and /metrics adds them up, whichever worker answers the scrape.
+"""
+
+import os
+import time
+from contextvars import ContextVar
+
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    # gunicorn creates it empty at start (config/gunicorn.py), other servers just need it to exist
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from prometheus_client import CONTENT_TYPE_LATEST as CONTENT_TYPE
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+
+# Fine enough for telling a cached page from a rendered one, coarse enough to keep the series few
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram('juhannus_request_seconds', "Time to respond, by route", ['route', 'method'],
+                            buckets=LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('juhannus_request_queries', "Database queries per request, by route", ['route'],
+                            buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128))
+REQUEST_QUERY_SECONDS = Histogram('juhannus_request_query_seconds', "Time in database queries per request, by route",
+                                  ['route'], buckets=LATENCY_BUCKETS)
+RENDER_SECONDS = Histogram('juhannus_template_render_seconds', "Time to render template responses, by route",
+                           ['route'], buckets=LATENCY_BUCKETS)
+VOTES = Counter('juhannus_votes',
+                "Submitted votes by outcome: accepted, closed, name_in_use, failed, invalid or rate_limited",
+                ['outcome'])
+
+# [queries, seconds] of the request being served, context variables follow the request into sync_to_async threads
+_queries = ContextVar('juhannus_metrics_queries', default=None)
+
+
+def get_route(request):
+    match = request.resolver_match
+    if match is None:
+        return 'other'
+    if match.app_name == 'admin':
+        return 'admin'
+    if match.app_name == 'juhannus':
+        return match.url_name
+    return 'other'
+
+
+def track_queries(execute, sql, params, many, context):
+    # Installed on every connection, see apps.JuhannusConfig.ready
+    counts = _queries.get()
+    if counts is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counts[0] += 1
+        counts[1] += time.perf_counter() - start
+
+
+def start_request():
+    return time.perf_counter(), _queries.set([0, 0.0])
+
+
+def finish_request(request, started):
+    start, token = started
+    counts = _queries.get()
+    _queries.reset(token)
+    route = get_route(request)
+    REQUEST_SECONDS.labels(route, request.method).observe(time.perf_counter() - start)
+    REQUEST_QUERIES.labels(route).observe(counts[0])
+    REQUEST_QUERY_SECONDS.labels(route).observe(counts[1])
+
+
+def time_render(request, response):
+    # Template responses render after the view has returned, the callback runs when rendering is done
+    start = time.perf_counter()
+    route = get_route(request)
+    response.add_post_render_callback(
+        lambda rendered: RENDER_SECONDS.labels(route).observe(time.perf_counter() - start))
+
+
+def count_vote(outcome):
+    VOTES.labels(outcome).inc()
+
+
+def export():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
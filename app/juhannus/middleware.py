@@ -0,0 +1,155 @@
+import hmac
+import math
+import random
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from juhannus import metrics, profiling, ratelimit, staticfiles
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query counts and query time of every request and the render time of template responses,
+    see juhannus.metrics. Works in both the sync and the async stack, so ASGI requests do not hop threads for it
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = metrics.start_request()
+        try:
+            return self.get_response(request)
+        finally:
+            metrics.finish_request(request, started)
+
+    async def __acall__(self, request):
+        started = metrics.start_request()
+        try:
+            return await self.get_response(request)
+        finally:
+            metrics.finish_request(request, started)
+
+    def process_template_response(self, request, response):
+        metrics.time_render(request, response)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    cProfiles a PROFILE_SAMPLE_RATE share of requests, every request to the PROFILE_ROUTES URL names and requests
+    with the header "X-Profile: <PROFILE_TOKEN>", see juhannus.profiling. Sync only on purpose: under ASGI Django
+    then calls the async views through async_to_sync from this thread, and their thread-sensitive ORM calls and
+    the rendering come back to the profiled thread like under WSGI
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.is_sampled(request):
+            return self.get_response(request)
+        return profiling.run(self.get_response, request, settings.PROFILE_DIR)
+
+    def is_sampled(self, request):
+        token = settings.PROFILE_TOKEN
+        if token and hmac.compare_digest(request.headers.get("X-Profile", ""), token):
+            return True
+        if settings.PROFILE_ROUTES:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                match = None
+            if match and {match.url_name, match.view_name} & set(settings.PROFILE_ROUTES):
+                return True
+        return random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+class StaticFilesMiddleware:
+    """
+    Serves STATIC_ROOT at STATIC_URL when no proxy does it, see juhannus.staticfiles. Sits right after
+    SecurityMiddleware, so that assets skip the session, csrf and auth middleware and the url resolving
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        url = urlsplit(settings.STATIC_URL)
+        if url.netloc or not settings.STATIC_ROOT:
+            # Served from another host
+            raise MiddlewareNotUsed
+        self.prefix = url.path
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        if request.method not in ("GET", "HEAD") or not request.path_info.startswith(self.prefix):
+            return None
+        return staticfiles.serve(request, request.path_info[len(self.prefix):])
+
+
+class VoteRateLimitMiddleware:
+    """
+    Answers form posts to the event pages with 429 once the client or everybody together runs out of tokens, see
+    juhannus.ratelimit. Sits before the session, csrf and auth middleware, so that a turned away request is not
+    parsed and does not touch the database. Staff edits post to the same pages and count too, telling staff apart
+    would take the session
+    """
+    sync_capable = True
+    async_capable = True
+    routes = {"event-latest", "event-detail"}
+
+    def __init__(self, get_response):
+        # Off in settings, or in an override_settings around the client of a benchmark
+        if not settings.VOTE_RATE_LIMIT:
+            raise MiddlewareNotUsed
+        self.limiter = ratelimit.create_rate_limiter()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.limit(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.limit(request) or await self.get_response(request)
+
+    def limit(self, request):
+        if request.method not in ("POST", "PUT"):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.url_name not in self.routes:
+            return None
+        wait = self.limiter.take(ratelimit.get_client(request))
+        if not wait:
+            return None
+        metrics.count_vote("rate_limited")
+        return HttpResponse("Liikaa yrityksiä, odota hetki ja yritä uudelleen.", status=429,
+                            content_type="text/plain; charset=utf-8", headers={"Retry-After": math.ceil(wait)})
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.15 on 2026-10-18 11:42
+
+import django.db.models.deletion
+import juhannus.models
+from django.db import migrations, models
+
+
+def build_histograms(apps, schema_editor):
+    Event = apps.get_model('juhannus', 'Event')
+    Participant = apps.get_model('juhannus', 'Participant')
+    VoteHistogram = apps.get_model('juhannus', 'VoteHistogram')
+    for event_id in Event.objects.values_list('id', flat=True):
+        buckets = juhannus.models.empty_buckets()
+        votes = (Participant.objects
+                 .filter(event_id=event_id)
+                 .values_list('vote')
+                 .annotate(count=models.Count('id'))
+                 .order_by())
+        for vote, count in votes:
+            buckets[vote] = count
+        VoteHistogram.objects.create(event_id=event_id, buckets=buckets, count=sum(buckets),
+                                     total=sum(vote * count for vote, count in enumerate(buckets)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juhannus', '0003_auto_20220308_1542'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteHistogram',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='histogram', serialize=False, to='juhannus.event')),
+                ('buckets', models.JSONField(default=juhannus.models.empty_buckets)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_histograms, migrations.RunPython.noop),
+    ]
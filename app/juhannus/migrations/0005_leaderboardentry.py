@@ -0,0 +1,42 @@
+# Generated by Django 5.2.15 on 2026-10-18 11:44
+
+from django.db import migrations, models
+
+from juhannus.models import normalize_name
+
+
+def build_leaderboard(apps, schema_editor):
+    Participant = apps.get_model('juhannus', 'Participant')
+    LeaderboardEntry = apps.get_model('juhannus', 'LeaderboardEntry')
+    counts = {}
+    rows = Participant.objects.values_list('name', 'vote', 'event__result', 'event__is_final').iterator()
+    for name, vote, result, is_final in rows:
+        entry = counts.setdefault(normalize_name(name), {'participations': 0, 'wins': 0})
+        entry['participations'] += 1
+        if is_final and vote == result:
+            entry['wins'] += 1
+    LeaderboardEntry.objects.bulk_create(
+        [LeaderboardEntry(name=name, **entry) for name, entry in counts.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juhannus', '0004_votehistogram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('participations', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-participations', 'name'], name='leaderboard_participations_idx'), models.Index(fields=['-wins', 'name'], name='leaderboard_wins_idx')],
+            },
+        ),
+        migrations.RunPython(build_leaderboard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.15 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+from juhannus.models import normalize_name
+
+
+def backfill_normalized_names(apps, schema_editor):
+    Participant = apps.get_model('juhannus', 'Participant')
+    seen = set()
+    participants = Participant.objects.only('id', 'event_id', 'name').order_by('id')
+    for participant in participants.iterator():
+        normalized = normalize_name(participant.name)
+        if (participant.event_id, normalized) in seen:
+            # The old iexact check could be raced, keep the later duplicates apart instead of failing
+            suffix = f"#{participant.pk}"
+            normalized = normalized[:64 - len(suffix)] + suffix
+        seen.add((participant.event_id, normalized))
+        participant.normalized_name = normalized
+        participant.save(update_fields=['normalized_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juhannus', '0005_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_normalized_names, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='participant',
+            constraint=models.UniqueConstraint(fields=('event', 'normalized_name'), name='unique_participant_name_per_event', violation_error_message='Name already in use. Choose another'),
+        ),
+    ]
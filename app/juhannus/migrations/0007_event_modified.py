@@ -0,0 +1,20 @@
+# Generated by Django 5.2.15 on 2026-10-18 12:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juhannus', '0006_participant_normalized_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
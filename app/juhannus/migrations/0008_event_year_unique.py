@@ -0,0 +1,67 @@
+# Generated by Django 5.2.15 on 2026-10-18 11:53
+
+import juhannus.models
+from django.db import migrations, models
+from django.db.models import Count
+
+from juhannus.models import normalize_name
+
+
+def merge_duplicate_years(apps, schema_editor):
+    # Concurrent requests could create the same year twice before it was unique. The participants of the duplicates
+    # move to the event that has a result, or else to the first one. Ranks come with 0011_participant_rank
+    Event = apps.get_model('juhannus', 'Event')
+    Participant = apps.get_model('juhannus', 'Participant')
+    VoteHistogram = apps.get_model('juhannus', 'VoteHistogram')
+    LeaderboardEntry = apps.get_model('juhannus', 'LeaderboardEntry')
+    years = (Event.objects.values('year').annotate(count=Count('id')).filter(count__gt=1)
+             .values_list('year', flat=True))
+    for year in list(years):
+        kept, *duplicates = sorted(Event.objects.filter(year=year), key=lambda event: (event.result is None, event.pk))
+        taken = set(Participant.objects.filter(event=kept).values_list('normalized_name', flat=True))
+        for duplicate in duplicates:
+            for participant in Participant.objects.filter(event=duplicate).order_by('id'):
+                if participant.normalized_name in taken:
+                    # Same as the backfill of normalized_name, duplicates are kept apart instead of failing
+                    suffix = f"#{participant.pk}"
+                    participant.normalized_name = participant.normalized_name[:64 - len(suffix)] + suffix
+                taken.add(participant.normalized_name)
+                won = duplicate.is_final and participant.vote == duplicate.result
+                wins = kept.is_final and participant.vote == kept.result
+                if won != wins:
+                    LeaderboardEntry.objects.filter(name=normalize_name(participant.name)).update(
+                        wins=models.F('wins') + (1 if wins else -1))
+                participant.event = kept
+                participant.save(update_fields=['event', 'normalized_name'])
+            duplicate.delete()
+
+        buckets = juhannus.models.empty_buckets()
+        votes = (Participant.objects
+                 .filter(event=kept)
+                 .values_list('vote')
+                 .annotate(count=Count('id'))
+                 .order_by())
+        for vote, count in votes:
+            buckets[vote] = count
+        VoteHistogram.objects.update_or_create(event=kept, defaults={
+            'buckets': buckets, 'count': sum(buckets),
+            'total': sum(vote * count for vote, count in enumerate(buckets))})
+
+
+class Migration(migrations.Migration):
+    # The merge commits in a transaction of its own, postgres does not alter a table with pending deferred constraint
+    # checks
+    atomic = False
+
+    dependencies = [
+        ('juhannus', '0007_event_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_years, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name='event',
+            name='year',
+            field=models.IntegerField(unique=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.15 on 2026-10-18 12:11
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juhannus', '0008_event_year_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(models.F('event'), django.db.models.functions.text.Lower('name'), models.F('id'), name='participant_event_lname_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['event', 'vote', 'id'], name='participant_event_vote_idx'),
+        ),
+    ]
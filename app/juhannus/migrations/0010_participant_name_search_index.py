@@ -0,0 +1,17 @@
+# Generated by Django 5.2.15 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juhannus', '0009_participant_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['normalized_name'], name='participant_name_search_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.15 on 2026-10-18 12:20
+
+import bisect
+
+from django.db import migrations, models
+
+from juhannus.models import normalize_name
+
+
+def rank_participants(apps, schema_editor):
+    # Same ranking as Event.rank_participants, the wins of the leaderboard become the closest guesses
+    Event = apps.get_model('juhannus', 'Event')
+    Participant = apps.get_model('juhannus', 'Participant')
+    LeaderboardEntry = apps.get_model('juhannus', 'LeaderboardEntry')
+    for event in Event.objects.exclude(result=None):
+        participants = list(Participant.objects.filter(event=event).only('id', 'vote'))
+        distances = sorted(abs(participant.vote - event.result) for participant in participants)
+        for participant in participants:
+            participant.distance = abs(participant.vote - event.result)
+            participant.rank = bisect.bisect_left(distances, participant.distance) + 1
+        Participant.objects.bulk_update(participants, ['distance', 'rank'], batch_size=1000)
+    wins = {}
+    for name in Participant.objects.filter(rank=1, event__is_final=True).values_list('name', flat=True):
+        wins[normalize_name(name)] = wins.get(normalize_name(name), 0) + 1
+    for entry in LeaderboardEntry.objects.all():
+        if entry.wins != wins.get(entry.name, 0):
+            entry.wins = wins.get(entry.name, 0)
+            entry.save(update_fields=['wins'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juhannus', '0010_participant_name_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='distance',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='rank',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(rank_participants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juhannus', '0011_participant_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votehistogram',
+            name='modified',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,20 +1,90 @@
 import re
 import datetime
+import functools
+import threading
 
+from collections import Counter
 from string import Template
+from typing import NamedTuple
 
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Abs, Coalesce, Greatest, Lower
 from django.utils import timezone
 
+VOTE_MIN = 0
+VOTE_MAX = 100
 
-def get_midsummer_saturday(year):
+
+# Length of Participant.normalized_name and LeaderboardEntry.name
+NORMALIZED_NAME_MAX_LENGTH = 64
+
+
+def normalize_name(name):
+    # casefold() can make a name longer than it was ("ﬃ" -> "ffi"), three times the 32 characters at most
+    return name.strip().casefold()[:NORMALIZED_NAME_MAX_LENGTH]
+
+
+class MidsummerCalendar(NamedTuple):
+    saturday: datetime.datetime
+    voting_deadline: datetime.datetime
+    results_deadline: datetime.datetime
+
+
+@functools.lru_cache(maxsize=256)
+def _get_midsummer_calendar(year, tz):
     # Midsummer saturday is always between june 20-26
     day = 20
     while datetime.datetime(year, 6, day).weekday() != 5:
         day += 1
-    # return pytz.timezone(settings.TIME_ZONE).localize(datetime.datetime(year, 6, day))
-    return timezone.localtime().replace(year=year, month=6, day=day, minute=0, hour=0, second=0, microsecond=0)
+    sat = timezone.make_aware(datetime.datetime(year, 6, day), tz)
+    thu = sat - datetime.timedelta(days=2)
+    sun = sat + datetime.timedelta(days=1)
+    return MidsummerCalendar(saturday=sat,
+                             voting_deadline=thu.replace(hour=23, minute=59, second=59),
+                             results_deadline=sun.replace(hour=22, minute=00, second=00))
+
+
+def get_midsummer_calendar(year):
+    # The dates only depend on the year and the active time zone, so they are computed once per process
+    return _get_midsummer_calendar(year, timezone.get_current_timezone())
+
+
+def get_midsummer_saturday(year):
+    return get_midsummer_calendar(year).saturday
+
+
+def get_midsummer_week_start(year):
+    # Midsummer week starts on the monday before midsummer saturday
+    return get_midsummer_saturday(year) - datetime.timedelta(days=5)
+
+
+def create_midsummer_event(year):
+    """
+    Creates the Event of the year from the header and body of the latest earlier one. Returns None if the year
+    already has an event, Event.year is unique so concurrent callers cannot both create it
+    """
+    previous = Event.objects.filter(year__lt=year).order_by("year").last()
+    if previous is None:
+        raise Event.DoesNotExist("No earlier event to copy the header and body from")
+    try:
+        with transaction.atomic():
+            return Event.objects.create(year=year, header=previous.header, body=previous.body)
+    except IntegrityError:
+        return None
+
+
+# (Header/Body, pk, year, time zone) -> (source text, substituted text). Shared by the threads of the worker,
+# the lock keeps forget_rendered_texts from iterating while a request adds to it
+_rendered_texts = {}
+_rendered_texts_lock = threading.Lock()
+RENDERED_TEXTS_MAX = 1024
+
+
+def forget_rendered_texts(source):
+    with _rendered_texts_lock:
+        for key in [key for key in _rendered_texts if key[:2] == (type(source).__name__, source.pk)]:
+            del _rendered_texts[key]
 
 
 class Header(models.Model):
@@ -34,7 +104,7 @@ class Body(models.Model):
 
 
 class Event(models.Model):
-    year = models.IntegerField()
+    year = models.IntegerField(unique=True)
 
     header = models.ForeignKey(Header, on_delete=models.CASCADE, related_name='events')
     body = models.ForeignKey(Body, on_delete=models.CASCADE, related_name='events')
@@ -42,21 +112,64 @@ class Event(models.Model):
     result = models.PositiveIntegerField(blank=True, null=True)
     is_final = models.BooleanField(default=False)
 
-    def get_midsummer_saturday(self, year=None):
-        # Midsummer saturday is always between june 20-26
+    # Last change to the event or its header/body, see signals.mark_changed. Participants move
+    # VoteHistogram.modified instead, so that votes do not write this row; get_change_marker has both
+    modified = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_state()
+        return instance
+
+    def remember_state(self):
+        if self.get_deferred_fields() & {'year', 'result', 'is_final'}:
+            self._db_state = None
+            return
+        self._db_state = {'year': self.year, 'result': self.result, 'is_final': self.is_final}
+
+    def get_db_state(self):
+        return getattr(self, '_db_state', None)
+
+    def rank_participants(self):
+        """
+        Stores how far each participant's vote is from the result and their rank by that distance, ties sharing
+        the rank (1, 1, 3), so that the closest guesses win also when nobody hit the result. One grouped read of
+        the vote index and one update, pages and stats read the stored ranks instead of ranking on every request
+        """
+        participants = Participant.objects.filter(event_id=self.pk)
+        if self.result is None:
+            return participants.exclude(rank=None, distance=None).update(rank=None, distance=None)
+        counts = Counter()
+        for vote, count in participants.values_list('vote').annotate(count=models.Count('id')).order_by():
+            counts[abs(vote - self.result)] += count
+        ranks = []
+        rank = 1
+        for distance in sorted(counts):
+            ranks.append(models.When(vote__in={self.result - distance, self.result + distance}, then=rank))
+            rank += counts[distance]
+        if not ranks:
+            return 0
+        return participants.update(distance=Abs(models.F('vote') - self.result),
+                                   rank=models.Case(*ranks, output_field=models.PositiveIntegerField()))
+
+    def get_calendar(self, year=None):
         if not year:
             year = self.year
-        return get_midsummer_saturday(year)
+        # Templates ask for the deadlines several times per render, keep them on the instance
+        calendars = self.__dict__.setdefault('_calendars', {})
+        if year not in calendars:
+            calendars[year] = get_midsummer_calendar(year)
+        return calendars[year]
+
+    def get_midsummer_saturday(self, year=None):
+        return self.get_calendar(year).saturday
 
     def get_voting_deadline(self, year=None):
-        sat = self.get_midsummer_saturday(year)
-        thu = sat - datetime.timedelta(days=2)
-        return thu.replace(hour=23, minute=59, second=59)
+        return self.get_calendar(year).voting_deadline
 
     def get_results_deadline(self, year=None):
-        sat = self.get_midsummer_saturday(year)
-        sun = sat + datetime.timedelta(days=1)
-        return sun.replace(hour=22, minute=00, second=00)
+        return self.get_calendar(year).results_deadline
 
     def is_voting_available(self, year=None):
         deadline = self.get_voting_deadline(year)
@@ -76,11 +189,33 @@ class Event(models.Model):
         tmp_str = Template(text)
         return tmp_str.safe_substitute(substitutions)
 
+    def get_change_marker(self):
+        return max(self.modified, self.get_histogram().modified or self.modified)
+
+    def get_histogram(self):
+        try:
+            return self.histogram
+        except VoteHistogram.DoesNotExist:
+            return VoteHistogram.rebuild(self.pk)
+
+    def _get_rendered_text(self, source):
+        key = (type(source).__name__, source.pk, self.year, timezone.get_current_timezone())
+        cached = _rendered_texts.get(key)
+        # Comparing the text keeps stale entries out even when another process handled the edit
+        if cached is not None and cached[0] == source.text:
+            return cached[1]
+        rendered = self._subst_text(source.text)
+        with _rendered_texts_lock:
+            if len(_rendered_texts) >= RENDERED_TEXTS_MAX:
+                _rendered_texts.clear()
+            _rendered_texts[key] = (source.text, rendered)
+        return rendered
+
     def get_header_text(self):
-        return self._subst_text(self.header.text)
+        return self._get_rendered_text(self.header)
 
     def get_body_text(self):
-        return self._subst_text(self.body.text)
+        return self._get_rendered_text(self.body)
 
     def __str__(self):
         return f"Midsummer {self.year}"
@@ -96,12 +231,218 @@ class Participant(models.Model):
                             )
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='participants')
     vote = models.PositiveIntegerField(validators=[
-        MaxValueValidator(100),
-        MinValueValidator(0)
+        MaxValueValidator(VOTE_MAX),
+        MinValueValidator(VOTE_MIN)
     ])
 
     created = models.DateTimeField(auto_now_add=True)
     visible = models.BooleanField(default=True)
+    # Stripped and case-folded name, so that duplicates are caught by a unique index instead of iexact scans
+    normalized_name = models.CharField(max_length=NORMALIZED_NAME_MAX_LENGTH, editable=False)
+    # Distance of the vote from the result of the event and the rank by it, see Event.rank_participants
+    distance = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    rank = models.PositiveIntegerField(blank=True, null=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'normalized_name'], name='unique_participant_name_per_event',
+                                    violation_error_message='Name already in use. Choose another'),
+        ]
+        # The listings of EventView and the API walk these in order instead of sorting the event's rows,
+        # the id makes the keyset pagination tiebreaker part of the index
+        indexes = [
+            models.Index(models.F('event'), Lower('name'), models.F('id'), name='participant_event_lname_idx'),
+            models.Index(fields=['event', 'vote', 'id'], name='participant_event_vote_idx'),
+            # Prefix search of the admin, the pattern opclass lets PostgreSQL use it for LIKE 'x%'
+            models.Index(fields=['normalized_name'], name='participant_name_search_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_state()
+        return instance
+
+    def remember_state(self):
+        # What the row looks like in the db, so that signal handlers can apply deltas instead of recounting
+        if self.get_deferred_fields() & {'event_id', 'vote', 'name', 'rank'}:
+            self._db_state = None
+            return
+        self._db_state = {'event_id': self.event_id, 'vote': self.vote, 'name': self.name, 'rank': self.rank}
+
+    def get_db_state(self):
+        return getattr(self, '_db_state', None)
+
+    def update_normalized_name(self):
+        # Only for new and renamed participants, the migrations gave legacy duplicates a #pk suffix that saves of
+        # their other fields must keep
+        old = self.get_db_state()
+        if old is None or old['name'] != self.name:
+            self.normalized_name = normalize_name(self.name)
+
+    def clean(self):
+        self.update_normalized_name()
+
+    def save(self, *args, **kwargs):
+        self.update_normalized_name()
+        if kwargs.get('update_fields') is not None and 'name' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'normalized_name'}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+def change_marker():
+    """
+    The change marker of events in a query, see Event.get_change_marker. Events whose histogram is missing or
+    has not seen a change since it was built fall back to Event.modified
+    """
+    return Greatest('modified', Coalesce('histogram__modified', 'modified'))
+
+
+def empty_buckets():
+    return [0] * (VOTE_MAX - VOTE_MIN + 1)
+
+
+class VoteHistogram(models.Model):
+    # One bucket per possible vote, kept up to date by signals so that pages never have to scan participants
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, primary_key=True, related_name='histogram')
+    buckets = models.JSONField(default=empty_buckets)
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    # Last change to the participants of the event, written by the same update as the buckets. None until the
+    # first change after the histogram was built, rebuilding it is not a change
+    modified = models.DateTimeField(blank=True, null=True)
+
+    @classmethod
+    def rebuild(cls, event_id, modified=None):
+        buckets = empty_buckets()
+        votes = (Participant.objects
+                 .filter(event_id=event_id)
+                 .values_list('vote')
+                 .annotate(count=models.Count('id'))
+                 .order_by())
+        for vote, count in votes:
+            buckets[vote - VOTE_MIN] = count
+        histogram, _ = cls.objects.update_or_create(event_id=event_id, defaults={
+            'buckets': buckets,
+            'count': sum(buckets),
+            'total': sum(i * count for i, count in enumerate(buckets, start=VOTE_MIN)),
+            **({'modified': modified} if modified else {}),
+        })
+        return histogram
+
+    @classmethod
+    def mark_changed(cls, event_id):
+        # Changes that do not move a vote, such as renames, still change the pages
+        if not cls.objects.filter(event_id=event_id).update(modified=timezone.now()):
+            cls.rebuild(event_id, modified=timezone.now())
+
+    @classmethod
+    def apply(cls, event_id, vote, delta):
+        cls.apply_many(event_id, {vote: delta})
+
+    @classmethod
+    def apply_many(cls, event_id, deltas):
+        with transaction.atomic():
+            histogram = cls.objects.select_for_update().filter(event_id=event_id).first()
+            if histogram is None:
+                if any(delta > 0 for delta in deltas.values()):
+                    # Rebuilding reads the participant rows, which already include this change
+                    cls.rebuild(event_id, modified=timezone.now())
+                # else the event is being deleted and its histogram went with it
+                return
+            for vote, delta in deltas.items():
+                histogram.buckets[vote - VOTE_MIN] = max(histogram.buckets[vote - VOTE_MIN] + delta, 0)
+                histogram.count = max(histogram.count + delta, 0)
+                histogram.total = max(histogram.total + delta * vote, 0)
+            histogram.modified = timezone.now()
+            histogram.save()
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return round(self.total / self.count, 1)
+
+    @property
+    def median(self):
+        if not self.count:
+            return None
+        # 0-based positions of the middle element(s)
+        low, high = (self.count - 1) // 2, self.count // 2
+        low_vote = high_vote = None
+        seen = 0
+        for vote, count in enumerate(self.buckets, start=VOTE_MIN):
+            seen += count
+            if low_vote is None and seen > low:
+                low_vote = vote
+            if seen > high:
+                high_vote = vote
+                break
+        median = (low_vote + high_vote) / 2
+        return int(median) if median.is_integer() else median
+
+    def get_distribution(self, width=40):
+        # (vote, count, bar) for every vote that somebody guessed, bars scaled to the most popular vote
+        peak = max(self.buckets)
+        return [(vote, count, '#' * max(1, round(count / peak * width)))
+                for vote, count in enumerate(self.buckets, start=VOTE_MIN) if count]
+
+    def __str__(self):
+        return f"Histogram {self.event_id}"
+
+
+class LeaderboardEntry(models.Model):
+    # All-time participations and wins per normalized name, kept up to date by signals
+    name = models.CharField(max_length=NORMALIZED_NAME_MAX_LENGTH, unique=True)
+    participations = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-participations', 'name'], name='leaderboard_participations_idx'),
+            models.Index(fields=['-wins', 'name'], name='leaderboard_wins_idx'),
+        ]
+
+    @classmethod
+    def apply(cls, name, participations=0, wins=0):
+        name = normalize_name(name)
+        # Clamped at zero so that rows loaded around the signals (fixtures, raw sql) cannot break saves,
+        # rebuild_leaderboard fixes any drift
+        increment = {'participations': Greatest(models.F('participations') + participations, 0),
+                     'wins': Greatest(models.F('wins') + wins, 0)}
+        with transaction.atomic():
+            if cls.objects.filter(name=name).update(**increment):
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(name=name, participations=max(participations, 0), wins=max(wins, 0))
+            except IntegrityError:
+                # A concurrent first vote of the name inserted the row in between
+                cls.objects.filter(name=name).update(**increment)
+
+    @classmethod
+    def compute(cls):
+        counts = {}
+        rows = Participant.objects.values_list('name', 'rank', 'event__is_final').iterator()
+        for name, rank, is_final in rows:
+            entry = counts.setdefault(normalize_name(name), {'participations': 0, 'wins': 0})
+            entry['participations'] += 1
+            # The closest guesses win once the result has been confirmed
+            if is_final and rank == 1:
+                entry['wins'] += 1
+        return counts
+
+    @classmethod
+    def rebuild(cls):
+        counts = cls.compute()
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([cls(name=name, **entry) for name, entry in counts.items()], batch_size=1000)
+        return counts
 
     def __str__(self):
         return self.name
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.cache import cache
+
+# Rendered pages of finalized events never change on their own, so they are kept until a signal purges them or
+# PAGE_CACHE_TIMEOUT passes. Purges only reach every worker through a shared cache, see is_shared_cache
+SORT_VARIANTS = ["name-asc", "name-desc", "vote-asc", "vote-desc"]
+# Caches of this process only, entries and deletes of one worker do not reach the others
+LOCAL_CACHE_BACKENDS = {"django.core.cache.backends.locmem.LocMemCache", "django.core.cache.backends.dummy.DummyCache"}
+
+
+def is_shared_cache():
+    return settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHE_BACKENDS
+
+
+def get_sort_variant(params):
+    # Same interpretation of ?name= and ?vote= as EventView.get_context_data
+    sort_order = "vote" if params.get("vote") else "name"
+    direction = "desc" if params.get(sort_order, "").lower() == "desc" else "asc"
+    return f"{sort_order}-{direction}"
+
+
+def get_page_key(year, variant):
+    return f"juhannus:page:{year}:{variant}"
+
+
+def get_page(year, params):
+    if not is_shared_cache():
+        return None
+    return cache.get(get_page_key(year, get_sort_variant(params)))
+
+
+async def aget_page(year, params):
+    if not is_shared_cache():
+        return None
+    return await cache.aget(get_page_key(year, get_sort_variant(params)))
+
+
+def set_page(year, params, response):
+    # A page kept in one worker's memory would outlive the purge of an edit handled by another worker
+    if not is_shared_cache():
+        return
+    page = {
+        "content": response.content,
+        "headers": {"ETag": response.headers["ETag"]} if "ETag" in response else {},
+    }
+    cache.set(get_page_key(year, get_sort_variant(params)), page, timeout=settings.PAGE_CACHE_TIMEOUT)
+
+
+def purge_pages(*years):
+    cache.delete_many([get_page_key(year, variant) for year in years for variant in SORT_VARIANTS])
+
+
+# The stats.json payloads, replaced when a request finds the events changed since the payload was built
+def get_stats_key(limit):
+    return f"juhannus:stats:{limit or 'all'}"
+
+
+async def aget_stats(limit):
+    return await cache.aget(get_stats_key(limit))
+
+
+async def aset_stats(limit, payload):
+    await cache.aset(get_stats_key(limit), payload, timeout=None)
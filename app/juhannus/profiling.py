@@ -0,0 +1,87 @@
+"""
+Sampled cProfile of requests, written to PROFILE_DIR for the profile_report command.
+
+Profile files are named <time>-<pid>-<view>-<queries>q-<milliseconds>ms.prof, where view is the URL name of the
+request with : replaced by a dot.
+"""
+
+import cProfile
+import datetime
+import os
+import re
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from django.utils import timezone
+
+FILENAME = re.compile(r"^(?P<time>\d{8}T\d{6}\.\d{6})-(?P<pid>\d+)-(?P<view>[\w.-]+)-(?P<queries>\d+)q-"
+                      r"(?P<milliseconds>\d+)ms\.prof$")
+
+
+class ProfileFile(NamedTuple):
+    path: Path
+    time: datetime.datetime
+    view: str
+    queries: int
+    milliseconds: int
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def get_view_name(request):
+    match = request.resolver_match
+    name = match.view_name if match else "unresolved"
+    return re.sub(r"[^\w.-]", ".", name)
+
+
+def save(profile, directory, request, queries, elapsed):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    now = timezone.now().strftime("%Y%m%dT%H%M%S.%f")
+    name = f"{now}-{os.getpid()}-{get_view_name(request)}-{queries}q-{round(elapsed * 1000)}ms.prof"
+    profile.dump_stats(directory / name)
+    return directory / name
+
+
+def read_directory(directory):
+    files = []
+    for path in sorted(Path(directory).glob("*.prof")):
+        match = FILENAME.match(path.name)
+        if match is None:
+            continue
+        files.append(ProfileFile(
+            path=path,
+            time=datetime.datetime.strptime(match["time"], "%Y%m%dT%H%M%S.%f").replace(tzinfo=datetime.timezone.utc),
+            view=match["view"],
+            queries=int(match["queries"]),
+            milliseconds=int(match["milliseconds"]),
+        ))
+    return files
+
+
+def run(get_response, request, directory):
+    """
+    Serves the request under cProfile and saves the profile. Only the calling thread is profiled, which covers the
+    view, the ORM and rendering as long as the middleware runs synchronously, see ProfilingMiddleware
+    """
+    from django.db import connection
+
+    counter = QueryCounter()
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        profile.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profile.disable()
+    save(profile, directory, request, counter.count, time.perf_counter() - start)
+    return response
@@ -0,0 +1,115 @@
+"""
+Token buckets for the vote form, checked by juhannus.middleware.VoteRateLimitMiddleware before the request reaches
+csrf, sessions, the form or the database.
+
+Every client has a bucket of VOTE_CLIENT_BURST tokens that refills at VOTE_CLIENT_RATE tokens per second, and all
+clients share one bucket of VOTE_GLOBAL_BURST / VOTE_GLOBAL_RATE. A request takes a token from both buckets or from
+neither, so a flooding client empties its own bucket and is then turned away without draining the global one that
+everybody else votes from.
+"""
+
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+GLOBAL = "*"
+
+
+class RateLimiter:
+    # time.time in the shared limiter, the buckets are compared between processes
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, client_rate, client_burst, global_rate, global_burst):
+        self.limits = {"client": (client_rate, client_burst), GLOBAL: (global_rate, global_burst)}
+
+    def take(self, client):
+        """
+        0 if client may submit now, otherwise the seconds until it may
+        """
+        raise NotImplementedError
+
+    def consume(self, buckets, now):
+        """
+        Takes a token from each of {key: (tokens, updated) or None for a full bucket} if all of them have one.
+        Returns the seconds to wait (0 when the tokens were taken) and the buckets after it
+        """
+        refilled, wait = {}, 0
+        for key, bucket in buckets.items():
+            rate, burst = self.limits[GLOBAL if key == GLOBAL else "client"]
+            tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+            refilled[key] = tokens
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+        if not wait:
+            refilled = {key: tokens - 1 for key, tokens in refilled.items()}
+        return wait, {key: (tokens, now) for key, tokens in refilled.items()}
+
+    def get_expiry(self, key, bucket):
+        # Seconds until the bucket is full, after that it need not be kept
+        rate, burst = self.limits[GLOBAL if key == GLOBAL else "client"]
+        return (burst - bucket[0]) / rate
+
+
+class LocalRateLimiter(RateLimiter):
+    """
+    Buckets in this process. Every gunicorn worker limits on its own, so the effective limits are multiplied by the
+    number of workers. CacheRateLimiter shares the buckets through the cache
+    """
+
+    def __init__(self, *args, max_clients=10000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.prune_at = max_clients
+
+    def take(self, client):
+        now = self.clock()
+        with self.lock:
+            if len(self.buckets) > self.prune_at:
+                self.prune(now)
+            wait, buckets = self.consume({key: self.buckets.get(key) for key in [GLOBAL, client]}, now)
+            if not wait:
+                self.buckets.update(buckets)
+        return wait
+
+    def prune(self, now):
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if now - bucket[1] < self.get_expiry(key, bucket)}
+        # Many clients at once keep their buckets, the next pruning waits until there are twice as many
+        self.prune_at = max(self.prune_at, 2 * len(self.buckets))
+
+
+class CacheRateLimiter(RateLimiter):
+    """
+    Buckets in the default cache, shared by the workers when the cache is (memcached, redis, see CACHES). One read
+    and one write of the cache per request. Workers that check the same bucket at the same moment can both take the
+    last token, which lets a few extra requests through under contention but never blocks on a lock
+    """
+    clock = staticmethod(time.time)
+
+    def take(self, client):
+        keys = {GLOBAL: "juhannus:ratelimit:global", client: f"juhannus:ratelimit:client:{client}"}
+        stored = cache.get_many(keys.values())
+        wait, buckets = self.consume({key: stored.get(cache_key) for key, cache_key in keys.items()}, self.clock())
+        if not wait:
+            expiry = max(self.get_expiry(key, bucket) for key, bucket in buckets.items())
+            cache.set_many({keys[key]: bucket for key, bucket in buckets.items()}, timeout=math.ceil(expiry) + 1)
+        return wait
+
+
+def create_rate_limiter():
+    return import_string(settings.VOTE_RATE_LIMITER)(settings.VOTE_CLIENT_RATE, settings.VOTE_CLIENT_BURST,
+                                                     settings.VOTE_GLOBAL_RATE, settings.VOTE_GLOBAL_BURST)
+
+
+def get_client(request):
+    if settings.VOTE_CLIENT_HEADER:
+        # The proxy appends the address it saw, anything before it came from the client
+        forwarded = request.headers.get(settings.VOTE_CLIENT_HEADER, "").rsplit(",", 1)[-1].strip()
+        if forwarded:
+            return forwarded
+    return request.META.get("REMOTE_ADDR", "")
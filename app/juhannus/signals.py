@@ -0,0 +1,259 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from juhannus import pagecache
+from juhannus.broker import get_broker
+from juhannus.models import Header, Body, Event, Participant, VoteHistogram, LeaderboardEntry, \
+    forget_rendered_texts, normalize_name
+
+
+def add_to_leaderboard(name, event, rank, sign):
+    # Wins only count once the result has been confirmed
+    wins = int(rank == 1 and event is not None and event.is_final)
+    LeaderboardEntry.apply(name, participations=sign, wins=sign * wins)
+
+
+def get_winners(event, is_final):
+    if not is_final:
+        return Counter()
+    return Counter(normalize_name(name) for name in event.participants.filter(rank=1).values_list('name', flat=True))
+
+
+def rank_participants(event, was_final=None):
+    """
+    Ranks the participants of the event against its result and moves the leaderboard wins of the event from
+    the old winners to the new ones
+    """
+    old = get_winners(event, event.is_final if was_final is None else was_final)
+    event.rank_participants()
+    new = get_winners(event, event.is_final)
+    for name in old | new:
+        if new[name] != old[name]:
+            LeaderboardEntry.apply(name, wins=new[name] - old[name])
+
+
+def rank_events(event_ids):
+    # A new or changed vote can change who is closest in events that already have a result
+    events = list(Event.objects.filter(pk__in=event_ids).exclude(result=None))
+    for event in events:
+        rank_participants(event)
+    return bool(events)
+
+
+def rank_event(event):
+    # rank_events for an event that is loaded already
+    if event is None or event.result is None:
+        return False
+    rank_participants(event)
+    return True
+
+
+def get_event(participant, event_id):
+    # The vote form loads the event of the vote, other events are read
+    if event_id == participant.event_id and Participant.event.is_cached(participant):
+        return participant.event
+    return Event.objects.filter(pk=event_id).first()
+
+
+def publish(event, data):
+    # Live feeds only hear about changes that were committed
+    transaction.on_commit(lambda: get_broker().publish(event, data))
+
+
+def purge_pages(*years):
+    # Once the change is committed, a request in between would render the old data and cache it again
+    years = set(years)
+    transaction.on_commit(lambda: pagecache.purge_pages(*years))
+
+
+def publish_participant(event, participant, year):
+    publish(event, {'year': year, 'id': participant.pk, 'name': participant.name, 'vote': participant.vote})
+
+
+@receiver([post_save, post_delete], sender=Event)
+def purge_all_pages(sender, instance, **kwargs):
+    # Every page links to every year, so any change to an event goes stale everywhere
+    old_year = (instance.get_db_state() or {}).get('year', instance.year)
+    purge_pages(*Event.objects.values_list('year', flat=True), instance.year, old_year)
+
+
+def mark_changed(events):
+    # Moves the change marker of the events forward and drops their cached pages. Participant changes move the
+    # marker of the histogram instead, with the update that counts the vote
+    years = list(events.values_list('year', flat=True))
+    events.update(modified=timezone.now())
+    purge_pages(*years)
+
+
+def purge_event_pages(event_ids):
+    # The histogram updates moved the change markers already
+    purge_pages(*Event.objects.filter(pk__in=event_ids).values_list('year', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Header)
+@receiver([post_save, post_delete], sender=Body)
+def text_changed(sender, instance, **kwargs):
+    forget_rendered_texts(instance)
+    mark_changed(instance.events.all())
+
+
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        VoteHistogram.objects.get_or_create(event_id=instance.pk)
+    old = instance.get_db_state()
+    if not created and (old is None or (old['result'], old['is_final']) != (instance.result, instance.is_final)):
+        rank_participants(instance, was_final=old['is_final'] if old else instance.is_final)
+        if old:
+            publish('result', {'year': instance.year, 'result': instance.result, 'is_final': instance.is_final})
+    instance.remember_state()
+
+
+@receiver(pre_save, sender=Participant)
+def fetch_participant_state(sender, instance, raw, **kwargs):
+    # An instance that was never loaded (or with deferred fields) has nothing to diff against, read the row it
+    # is about to overwrite so that participant_saved can still apply deltas
+    if raw or instance.pk is None or instance.get_db_state() is not None:
+        return
+    instance._db_state = (Participant.objects.filter(pk=instance.pk)
+                          .values('event_id', 'vote', 'name', 'rank').first())
+
+
+@receiver(post_save, sender=Participant)
+def participant_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    old = instance.get_db_state()
+    new = {'event_id': instance.event_id, 'vote': instance.vote, 'name': instance.name, 'rank': instance.rank}
+    event = get_event(instance, instance.event_id)
+    old_event = event if created or old['event_id'] == new['event_id'] else get_event(instance, old['event_id'])
+    if created:
+        VoteHistogram.apply(instance.event_id, instance.vote, 1)
+        add_to_leaderboard(instance.name, event, instance.rank, 1)
+        if rank_event(event):
+            instance.refresh_from_db(fields=['rank', 'distance'])
+        publish_participant('participant-new', instance, event.year)
+    else:
+        moved = (old['event_id'], old['vote']) != (new['event_id'], new['vote'])
+        if moved:
+            VoteHistogram.apply(old['event_id'], old['vote'], -1)
+            VoteHistogram.apply(new['event_id'], new['vote'], 1)
+        else:
+            VoteHistogram.mark_changed(instance.event_id)
+        if old != new:
+            add_to_leaderboard(old['name'], old_event, old['rank'], -1)
+            add_to_leaderboard(new['name'], event, new['rank'], 1)
+        if moved and (rank_event(old_event) | (old_event is not event and rank_event(event))):
+            # Saves write the rank, keep it in step with the db
+            instance.refresh_from_db(fields=['rank', 'distance'])
+        if old['event_id'] != new['event_id']:
+            publish_participant('participant-deleted', instance, old_event and old_event.year)
+            publish_participant('participant-new', instance, event.year)
+        elif old != new:
+            publish_participant('participant-modified', instance, event.year)
+    purge_pages(*{event.year, old_event and old_event.year} - {None})
+    instance.remember_state()
+
+
+@receiver(post_delete, sender=Participant)
+def participant_deleted(sender, instance, **kwargs):
+    old = instance.get_db_state() or {'event_id': instance.event_id, 'vote': instance.vote, 'name': instance.name,
+                                      'rank': instance.rank}
+    # None when the participant goes with its event
+    event = get_event(instance, old['event_id'])
+    VoteHistogram.apply(old['event_id'], old['vote'], -1)
+    add_to_leaderboard(old['name'], event, old['rank'], -1)
+    rank_event(event)
+    if event is not None:
+        purge_pages(event.year)
+    publish_participant('participant-deleted', instance, event and event.year)
+
+
+def participants_created(participants):
+    # bulk_create sends no post_save, so do what participant_saved would have done with one update per event
+    votes = defaultdict(Counter)
+    for participant in participants:
+        votes[participant.event_id][participant.vote] += 1
+    for event_id, deltas in votes.items():
+        VoteHistogram.apply_many(event_id, deltas)
+    for participant in participants:
+        # Unranked until rank_events below, which moves any wins
+        LeaderboardEntry.apply(participant.name, participations=1)
+    rank_events(votes)
+    years = dict(Event.objects.filter(pk__in=votes).values_list('pk', 'year'))
+    purge_pages(*years.values())
+    for participant in participants:
+        participant.remember_state()
+        publish_participant('participant-new', participant, years[participant.event_id])
+
+
+def get_leaderboard_counts(participants):
+    """
+    {normalized name: (participations, wins)} of the participants
+    """
+    wins = Q(rank=1, event__is_final=True)
+    counts = defaultdict(lambda: (0, 0))
+    rows = (participants.values_list('name')
+            .annotate(participations=Count('id'), wins=Count('id', filter=wins))
+            .order_by())
+    for name, participations, win_count in rows:
+        old = counts[normalize_name(name)]
+        counts[normalize_name(name)] = (old[0] + participations, old[1] + win_count)
+    return counts
+
+
+def get_vote_counts(participants):
+    votes = defaultdict(Counter)
+    for event_id, vote, count in participants.values_list('event_id', 'vote').annotate(count=Count('id')).order_by():
+        votes[event_id][vote] += count
+    return votes
+
+
+def delete_participants(participants):
+    """
+    Deletes the participants with one statement, where queryset.delete() would send post_delete row by row.
+    The histograms and the leaderboard get what participant_deleted would have applied, aggregated per event
+    and name
+    """
+    with transaction.atomic():
+        votes = get_vote_counts(participants)
+        names = get_leaderboard_counts(participants)
+        deleted = participants._raw_delete(participants.db)
+        for event_id, counts in votes.items():
+            VoteHistogram.apply_many(event_id, {vote: -count for vote, count in counts.items()})
+        for name, (participations, wins) in names.items():
+            LeaderboardEntry.apply(name, participations=-participations, wins=-wins)
+        rank_events(votes)
+        purge_event_pages(votes)
+    return deleted
+
+
+def move_participants(participants, event):
+    """
+    Moves the participants to the event with one statement, keeping the histograms and the leaderboard wins up to
+    date like participant_saved would. Raises IntegrityError if a name is already in use in the event
+    """
+    participants = participants.exclude(event=event)
+    with transaction.atomic():
+        votes = get_vote_counts(participants)
+        if not votes:
+            return 0
+        names = get_leaderboard_counts(participants)
+        # The moved rows lose their wins and get ranked again in the event
+        moved = participants.update(event=event, rank=None, distance=None)
+        for event_id, counts in votes.items():
+            VoteHistogram.apply_many(event_id, {vote: -count for vote, count in counts.items()})
+        VoteHistogram.apply_many(event.pk, sum(votes.values(), Counter()))
+        for name, (_, wins) in names.items():
+            if wins:
+                LeaderboardEntry.apply(name, wins=-wins)
+        rank_events([*votes, event.pk])
+        purge_event_pages([*votes, event.pk])
+    return moved
@@ -0,0 +1,95 @@
+"""
+Fingerprinted and precompressed static files, and serving them from the app when there is no proxy in front.
+
+collectstatic writes style.<hash>.css with style.<hash>.css.gz/.br siblings. Files with a hash in the name never
+change, so they are served as immutable and repeat visitors do not even revalidate them.
+"""
+
+import mimetypes
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from juhannus.compression import ENCODINGS, compress_variants, get_accepted_encodings
+
+# Images and fonts are compressed already
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.svg', '.txt', '.html', '.json', '.map', '.xml', '.ico'}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Without a manifest (development, tests) pages link the plain names instead of failing
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Not collected, there is nothing to hash
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if not dry_run:
+            for name in hashed_names:
+                self.write_compressed(name)
+
+    def write_compressed(self, name):
+        path = Path(self.path(name))
+        if path.suffix not in COMPRESSIBLE:
+            return
+        for encoding, compressed in compress_variants(path.read_bytes()).items():
+            path.with_name(path.name + ENCODINGS[encoding]).write_bytes(compressed)
+
+
+def get_hashed_names():
+    # The manifest is read once per process, collectstatic runs before a restart
+    if not hasattr(staticfiles_storage, '_hashed_names'):
+        staticfiles_storage._hashed_names = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+    return staticfiles_storage._hashed_names
+
+
+def serve(request, path):
+    """
+    Response for the file at path in STATIC_ROOT, or None when there is no such file. Picks a .br or .gz sibling
+    by Accept-Encoding
+    """
+    try:
+        full_path = Path(safe_join(settings.STATIC_ROOT, path))
+    except SuspiciousFileOperation:
+        return None
+    if not full_path.is_file():
+        return None
+
+    headers = {'Cache-Control': IMMUTABLE if path in get_hashed_names() else 'no-cache'}
+    variants = [(encoding, full_path.with_name(full_path.name + suffix)) for encoding, suffix in ENCODINGS.items()]
+    variants = [(encoding, variant) for encoding, variant in variants if variant.is_file()]
+    if variants:
+        # Caches must keep the encodings apart even for clients that got the plain file
+        headers['Vary'] = 'Accept-Encoding'
+    accepted = get_accepted_encodings(request)
+    encoding, file_path = next(((encoding, variant) for encoding, variant in variants if encoding in accepted),
+                               (None, full_path))
+
+    stat = file_path.stat()
+    headers['Last-Modified'] = http_date(stat.st_mtime)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified(headers=headers)
+
+    content_type, _ = mimetypes.guess_type(full_path.name)
+    response = FileResponse(file_path.open('rb'), content_type=content_type or 'application/octet-stream',
+                            headers=headers)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response.headers.pop('Content-Disposition', None)
+    return response
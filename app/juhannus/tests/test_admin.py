@@ -0,0 +1,126 @@
+from unittest import mock
+
+from django.contrib.admin import helpers
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from juhannus.models import Event, Participant, VoteHistogram, LeaderboardEntry
+from juhannus.tests.utils import add_participants
+
+
+class ParticipantAdminTests(TestCase):
+    fixtures = ['test_juhannus_events.json', 'test_juhannus_users.json']
+
+    def setUp(self):
+        self.client.login(username='superuser', password='123')
+        self.url = reverse("admin:juhannus_participant_changelist")
+        event = Event.objects.get(year=2018)
+        event.result = 10
+        event.is_final = True
+        event.save()
+        add_participants(event)
+        Participant.objects.create(event=event, name="Alphonse", vote=7)
+        # Fixtures bypass the signals
+        for event in Event.objects.all():
+            VoteHistogram.rebuild(event.pk)
+        LeaderboardEntry.rebuild()
+
+    def assertAggregatesUpToDate(self):
+        for event in Event.objects.all():
+            self.assertEqual(VoteHistogram.objects.get(event=event).buckets, VoteHistogram.rebuild(event.pk).buckets)
+        self.assertEqual({entry.name: (entry.participations, entry.wins)
+                          for entry in LeaderboardEntry.objects.filter(participations__gt=0)},
+                         {name: (entry["participations"], entry["wins"])
+                          for name, entry in LeaderboardEntry.compute().items()})
+
+    def run_action(self, action, names):
+        pks = Participant.objects.filter(name__in=names).values_list("pk", flat=True)
+        return self.client.post(self.url, {"action": action, helpers.ACTION_CHECKBOX_NAME: list(pks)}, follow=True)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        with self.assertNumQueries(8):
+            self.client.get(self.url)
+        Participant.objects.create(event=Event.objects.get(year=2020), name="foxtrot", vote=1)
+        with self.assertNumQueries(8):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Midsummer 2020")
+
+    def test_estimated_count(self):
+        with mock.patch("juhannus.admin.COUNT_LIMIT", 3):
+            response = self.client.get(self.url)
+            self.assertEqual(response.context["cl"].result_count, Participant.objects.latest("pk").pk)
+            response = self.client.get(self.url, {"vote__exact": 10})
+            self.assertEqual(response.context["cl"].result_count, 3)
+            response = self.client.get(self.url, {"visible__exact": 1})
+            self.assertEqual(response.context["cl"].result_count, Participant.objects.filter(visible=True).count())
+
+    def test_estimated_count_pages_past_the_limit(self):
+        visible = list(Participant.objects.filter(visible=True).order_by("-pk").values_list("name", flat=True))
+        with mock.patch("juhannus.admin.COUNT_LIMIT", 3), \
+                mock.patch("juhannus.admin.ParticipantAdmin.list_per_page", 1):
+            # A filtered count stops one row past the limit, so the last page link leads on
+            response = self.client.get(self.url, {"visible__exact": 1})
+            self.assertEqual(response.context["cl"].result_count, 4)
+            response = self.client.get(self.url, {"visible__exact": 1, "p": 4})
+            self.assertEqual(response.context["cl"].result_count, 6)
+            self.assertEqual([participant.name for participant in response.context["cl"].result_list], [visible[3]])
+            response = self.client.get(self.url, {"visible__exact": 1, "p": len(visible)})
+            self.assertEqual(response.context["cl"].result_count, len(visible))
+            self.assertEqual([participant.name for participant in response.context["cl"].result_list], [visible[-1]])
+
+    def test_list_editable_keeps_legacy_duplicates(self):
+        # The backfill of normalized_name kept races of the old iexact check apart with a #pk suffix
+        original = Participant.objects.get(name="bravo")
+        duplicate = Participant.objects.create(event=Event.objects.get(year=2020), name="Bravo ", vote=1)
+        Participant.objects.filter(pk=duplicate.pk).update(event=original.event,
+                                                           normalized_name=f"bravo#{duplicate.pk}")
+        participants = list(Participant.objects.order_by("-pk"))
+        data = {"form-TOTAL_FORMS": len(participants), "form-INITIAL_FORMS": len(participants), "_save": "Save"}
+        for index, participant in enumerate(participants):
+            data[f"form-{index}-id"] = participant.pk
+            data[f"form-{index}-visible"] = "on" if participant.pk != duplicate.pk else ""
+        self.assertEqual(self.client.post(self.url, data).status_code, 302)
+        duplicate.refresh_from_db()
+        self.assertEqual((duplicate.visible, duplicate.normalized_name), (False, f"bravo#{duplicate.pk}"))
+        # A rename normalizes the new name
+        duplicate.name = "Bravissimo"
+        duplicate.save()
+        self.assertEqual(Participant.objects.get(pk=duplicate.pk).normalized_name, "bravissimo")
+
+    def test_prefix_search(self):
+        response = self.client.get(self.url, {"q": " ALPH"})
+        self.assertEqual(sorted(p.name for p in response.context["cl"].result_list), ["Alpha", "Alphonse"])
+        response = self.client.get(self.url, {"q": "lpha"})
+        self.assertEqual(list(response.context["cl"].result_list), [])
+
+    def test_hide_and_unhide(self):
+        self.run_action("hide", ["Alpha", "bravo"])
+        self.assertEqual(set(Participant.objects.filter(visible=False).values_list("name", flat=True)),
+                         {"Alpha", "bravo"})
+        self.run_action("unhide", ["Alpha"])
+        self.assertEqual(list(Participant.objects.filter(visible=False).values_list("name", flat=True)), ["bravo"])
+
+    def test_delete(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.run_action("bulk_delete", ["Alpha", "bravo", "charlie"])
+        self.assertEqual(len([query for query in queries if query["sql"].startswith("DELETE")]), 1)
+        self.assertFalse(Participant.objects.filter(name__in=["Alpha", "bravo", "charlie"]).exists())
+        self.assertAggregatesUpToDate()
+
+    def test_move(self):
+        response = self.run_action("move_to_2020", ["Alpha", "charlie"])
+        self.assertContains(response, "Moved 2 participants to 2020")
+        self.assertEqual(Event.objects.get(year=2020).participants.count(), 2)
+        self.assertEqual(LeaderboardEntry.objects.get(name="alpha").wins, 0)
+        self.assertAggregatesUpToDate()
+
+        self.run_action("move_to_2018", ["Alpha"])
+        self.assertEqual(LeaderboardEntry.objects.get(name="alpha").wins, 1)
+        self.assertAggregatesUpToDate()
+
+        Participant.objects.create(event=Event.objects.get(year=2020), name="DELTA", vote=1)
+        response = self.run_action("move_to_2020", ["delta"])
+        self.assertContains(response, "nothing was moved")
+        self.assertEqual(Participant.objects.get(name="delta").event.year, 2018)
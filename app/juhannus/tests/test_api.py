@@ -0,0 +1,70 @@
+import json
+
+from django.http import QueryDict
+from django.test import TestCase
+from django.urls import reverse
+
+from juhannus import api
+from juhannus.models import Event
+from juhannus.tests.utils import add_participants
+
+
+class ApiTests(TestCase):
+    fixtures = ['test_juhannus_events.json']
+
+    def setUp(self):
+        add_participants(Event.objects.get(year=2018))
+
+    def get_all(self, params):
+        endpoint = reverse("juhannus:api-participants", kwargs={"year": 2018})
+        names, url, pages = [], endpoint + params, 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response["Content-Type"], "application/json")
+            data = json.loads(b"".join(response.streaming_content))
+            names += [participant["name"] for participant in data["participants"]]
+            url = data["next"] and endpoint + data["next"]
+            pages += 1
+        return names, pages
+
+    def test_events(self):
+        data = self.client.get(reverse("juhannus:api-events")).json()
+        self.assertEqual([event["year"] for event in data["events"]], [2018, 2020])
+        data = self.client.get(reverse("juhannus:api-event", kwargs={"year": 2018})).json()
+        self.assertEqual((data["participants"], data["median"]), (6, 10))
+        self.assertEqual(self.client.get(reverse("juhannus:api-event", kwargs={"year": 1999})).status_code, 404)
+
+    def test_participants_by_name(self):
+        expected = ["Alpha", "Asset 463 / Groovy ^ Pier", "bravo", "charlie", "delta", "echo"]
+        self.assertEqual(self.get_all("?limit=2"), (expected, 3))
+        self.assertEqual(self.get_all("?name=desc&limit=4"), (expected[::-1], 2))
+        self.assertEqual(self.get_all(""), (expected, 1))
+
+    def test_participants_by_vote(self):
+        names, pages = self.get_all("?vote=asc&limit=1")
+        self.assertEqual(names, ["charlie", "Asset 463 / Groovy ^ Pier", "bravo", "Alpha", "echo", "delta"])
+        self.assertEqual(pages, 6)
+        names, _ = self.get_all("?vote=desc&limit=2")
+        self.assertEqual(names, ["delta", "echo", "Alpha", "bravo", "Asset 463 / Groovy ^ Pier", "charlie"])
+
+    def test_invalid_cursor(self):
+        endpoint = reverse("juhannus:api-participants", kwargs={"year": 2018})
+        self.assertEqual(self.client.get(endpoint + "?after=garbage").status_code, 400)
+        # A cursor of the vote ordering under the name ordering and the other way around
+        response = self.client.get(endpoint + "?vote=asc&limit=1")
+        after = QueryDict(json.loads(b"".join(response.streaming_content))["next"][1:])["after"]
+        self.assertEqual(self.client.get(endpoint + "?name=asc&after=" + after).status_code, 400)
+        self.assertEqual(self.client.get(endpoint + "?vote=desc&after=" + after).status_code, 200)
+        after = api.encode_cursor("alpha", 1)
+        self.assertEqual(self.client.get(endpoint + "?vote=asc&after=" + after).status_code, 400)
+        self.assertEqual(self.client.get(endpoint + "?after=" + api.encode_cursor(True, 1)).status_code, 400)
+
+    async def test_participants_stream_under_asgi(self):
+        endpoint = reverse("juhannus:api-participants", kwargs={"year": 2018})
+        response = await self.async_client.get(endpoint + "?limit=4")
+        # A sync iterator would be buffered whole before sending
+        self.assertTrue(response.is_async)
+        data = json.loads(b"".join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual([participant["name"] for participant in data["participants"]],
+                         ["Alpha", "Asset 463 / Groovy ^ Pier", "bravo", "charlie"])
+        self.assertEqual(QueryDict(data["next"][1:])["after"], api.encode_cursor("charlie", data["participants"][3]["id"]))
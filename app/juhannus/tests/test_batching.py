@@ -0,0 +1,113 @@
+import threading
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY
+
+from juhannus import batching
+from juhannus.batching import VoteBatcher, VoteStatus
+from juhannus.models import Event, Participant, VoteHistogram, LeaderboardEntry
+
+
+class BatchingTests(TransactionTestCase):
+    fixtures = ['test_juhannus_events.json']
+
+    def setUp(self):
+        self.event = Event.objects.get(year=2020)
+        now_in_past = timezone.now().replace(year=2019, month=1, day=1)
+        patcher = mock.patch('juhannus.models.timezone.now', return_value=now_in_past)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit_all(self, batcher, names):
+        results = {}
+
+        def submit(name, vote):
+            results[name] = batcher.submit(Participant(event=self.event, name=name, vote=vote))
+
+        threads = [threading.Thread(target=submit, args=(name, i)) for i, name in enumerate(names)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_batched_votes(self):
+        # One batch of everything, so that the accept-time reads are over before the worker writes. The shared
+        # in-memory sqlite of the tests locks whole tables instead of waiting like a real database
+        batcher = VoteBatcher(batch_size=25, max_delay=5)
+        names = [f"voter {i}" for i in range(25)]
+        results = self.submit_all(batcher, names)
+        self.assertEqual(set(results.values()), {VoteStatus.ACCEPTED})
+        self.assertEqual(self.event.participants.count(), 25)
+        histogram = VoteHistogram.objects.get(event=self.event)
+        self.assertEqual((histogram.count, histogram.total), (25, sum(range(25))))
+        self.assertEqual(LeaderboardEntry.objects.get(name="voter 3").participations, 1)
+
+    def test_rejections(self):
+        batcher = VoteBatcher(batch_size=10, max_delay=0.5)
+        results = self.submit_all(batcher, ["same", "SAME ", "Same"])
+        self.assertEqual(sorted(status.value for status in results.values()),
+                         ["accepted", "name in use", "name in use"])
+        self.assertEqual(batcher.submit(Participant(event=self.event, name="same", vote=1)), VoteStatus.NAME_IN_USE)
+        closed = Participant(event=Event.objects.get(year=2018), name="late", vote=1)
+        with mock.patch('juhannus.models.timezone.now', return_value=timezone.now().replace(year=2030)):
+            self.assertEqual(batcher.submit(closed), VoteStatus.CLOSED)
+
+    def test_race_with_direct_save(self):
+        batcher = VoteBatcher(batch_size=10, max_delay=0.05)
+        participants = [Participant(event=self.event, name=name, vote=1) for name in ["first", "taken"]]
+        batch = [batching.PendingVote(participant) for participant in participants]
+        Participant.objects.create(event=self.event, name="Taken", vote=2)
+        batcher.write(batch)
+        self.assertEqual([vote.status for vote in batch], [VoteStatus.ACCEPTED, VoteStatus.NAME_IN_USE])
+        self.assertEqual(VoteHistogram.objects.get(event=self.event).count, 2)
+
+    def test_timeout_before_the_worker_takes_the_vote(self):
+        batcher = VoteBatcher(batch_size=10, max_delay=0.01, timeout=0.05)
+        with mock.patch.object(batcher, "start"):
+            status = batcher.submit(Participant(event=self.event, name="late", vote=1))
+        self.assertEqual(status, VoteStatus.FAILED)
+        # The worker skips the vote given up on, so trying again works
+        self.assertEqual(batcher.submit(Participant(event=self.event, name="late", vote=1)), VoteStatus.ACCEPTED)
+        self.assertEqual(self.event.participants.filter(name="late").count(), 1)
+
+    def test_timeout_while_writing(self):
+        batcher = VoteBatcher(batch_size=10, max_delay=0.01, timeout=0.05)
+        write = batcher.write
+
+        def slow_write(batch):
+            threading.Event().wait(0.2)
+            write(batch)
+
+        with mock.patch.object(batcher, "write", slow_write):
+            status = batcher.submit(Participant(event=self.event, name="slow", vote=1))
+        # The vote was saved after the timeout, and the voter hears so
+        self.assertEqual(status, VoteStatus.ACCEPTED)
+        self.assertTrue(self.event.participants.filter(name="slow").exists())
+
+    @override_settings(VOTE_BATCHING=True)
+    def test_view(self):
+        endpoint = reverse("juhannus:event-latest")
+        response = self.client.post(endpoint, {"name": "abc", "vote": 6, "event": self.event.pk, "action": "save"})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(endpoint, {"name": "ABC", "vote": 6, "event": self.event.pk, "action": "save"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context["form"], "name", "Name already in use. Choose another")
+        self.assertEqual(self.event.participants.count(), 1)
+
+    @override_settings(VOTE_BATCHING=True)
+    def test_view_after_deadline(self):
+        def closed():
+            return REGISTRY.get_sample_value("juhannus_votes_total", {"outcome": "closed"}) or 0
+
+        before = closed()
+        with mock.patch('juhannus.models.timezone.now', return_value=timezone.now().replace(year=2030)):
+            response = self.client.post(reverse("juhannus:event-latest"),
+                                        {"name": "late", "vote": 6, "event": self.event.pk, "action": "save"})
+        # Redirected like the direct path, and counted as closed instead of accepted
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.event.participants.exists())
+        self.assertEqual(closed(), before + 1)
@@ -0,0 +1,160 @@
+import datetime
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import brotli
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from juhannus.management.commands.benchmark_startup import Command as BenchmarkStartup
+from juhannus.models import Event, Participant, LeaderboardEntry, get_midsummer_saturday
+from juhannus.tests.utils import shared_cache
+
+
+class CommandsTests(TestCase):
+    fixtures = ["test_juhannus_events.json"]
+
+    def test_create_event_prior_midsummer_week(self):
+        week_before_midsummer = get_midsummer_saturday(2019) - datetime.timedelta(days=7)
+        event_count = Event.objects.count()
+        with mock.patch('juhannus.models.timezone.now', return_value=week_before_midsummer):
+            call_command("create_event", stdout=StringIO())
+            self.assertEqual(Event.objects.count(), event_count)
+            call_command("create_event", "--force", stdout=StringIO())
+            self.assertEqual(Event.objects.count(), event_count + 1)
+
+    def test_create_event_during_midsummer_week(self):
+        two_days_before_midsummer = get_midsummer_saturday(2019) - datetime.timedelta(days=2)
+        event_count = Event.objects.count()
+        with mock.patch('juhannus.models.timezone.now', return_value=two_days_before_midsummer):
+            call_command("create_event", stdout=StringIO())
+            call_command("create_event", stdout=StringIO())
+        self.assertEqual(Event.objects.count(), event_count + 1)
+        event = Event.objects.get(year=2019)
+        self.assertEqual((event.header_id, event.body_id), (1, 1))  # copied from 2018, not the later 2020
+
+    def test_create_event_by_seconds(self):
+        sat = get_midsummer_saturday(2019)
+        sun_evening = sat.replace(hour=23, minute=59, second=59) - datetime.timedelta(days=6)
+        event_count = Event.objects.count()
+        with mock.patch('juhannus.models.timezone.now', return_value=sun_evening):
+            call_command("create_event", stdout=StringIO())
+            self.assertEqual(Event.objects.count(), event_count)
+        with mock.patch('juhannus.models.timezone.now', return_value=sun_evening + datetime.timedelta(seconds=2)):
+            call_command("create_event", stdout=StringIO())
+            self.assertEqual(Event.objects.count(), event_count + 1)
+
+    def test_rebuild_leaderboard(self):
+        # fixtures bypass the signals, so the leaderboard starts out empty
+        with self.assertRaises(CommandError):
+            call_command("rebuild_leaderboard", "--check", stdout=StringIO())
+        call_command("rebuild_leaderboard", stdout=StringIO())
+        entry = LeaderboardEntry.objects.get()
+        self.assertEqual((entry.name, entry.participations, entry.wins), ("asset 463 / groovy ^ pier", 1, 0))
+        out = StringIO()
+        call_command("rebuild_leaderboard", "--check", stdout=out)
+        self.assertIn("matches", out.getvalue())
+
+    @shared_cache()
+    @override_settings(PARTICIPANT_WINDOW=1)
+    def test_export_archive_bypasses_page_cache(self):
+        cache.clear()
+        event = Event.objects.get(year=2018)
+        event.is_final = True
+        event.save()
+        Participant.objects.create(event=event, name="second", vote=1)
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": 2018})
+        self.assertContains(self.client.get(endpoint), 'id="more-rows"')
+        with tempfile.TemporaryDirectory() as directory:
+            call_command("export_archive", directory, stdout=StringIO())
+            page = (Path(directory) / "2018" / "index.html").read_text()
+        # The whole table, not the cached window that links to rows the archive does not have
+        self.assertIn("second", page)
+        self.assertNotIn('id="more-rows"', page)
+        # and the whole table did not replace the cached window
+        self.assertContains(self.client.get(endpoint), 'id="more-rows"')
+
+    def test_export_archive(self):
+        event = Event.objects.get(year=2018)
+        event.result = 6
+        event.is_final = True
+        event.save()
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            out = StringIO()
+            call_command("export_archive", directory, stdout=out)
+            self.assertIn("Exported 2 pages, 0 unchanged", out.getvalue())
+            manifest = json.loads((directory / "manifest.json").read_text())
+            self.assertEqual(sorted(manifest["pages"]), ["2018", "stats"])
+            self.assertEqual(len(manifest["pages"]["2018"]["files"]), 5)
+            self.assertEqual(json.loads((directory / "stats.json").read_text())["winners"],
+                             [{"name": "asset 463 / groovy ^ pier", "count": 1}])
+            page = (directory / "2018" / "vote-desc.html").read_bytes()
+            self.assertIn(b"Asset 463", page)
+            self.assertEqual(gzip.decompress((directory / "2018" / "vote-desc.html.gz").read_bytes()), page)
+            self.assertEqual(brotli.decompress((directory / "2018" / "vote-desc.html.br").read_bytes()), page)
+
+            call_command("export_archive", directory, stdout=out)
+            self.assertIn("Exported 0 pages, 2 unchanged", out.getvalue())
+
+            Participant.objects.create(event=event, name="newcomer", vote=7)
+            call_command("export_archive", directory, stdout=out)
+            self.assertIn("Exported 2 pages, 0 unchanged", out.getvalue())
+            self.assertIn(b"newcomer", (directory / "2018" / "index.html").read_bytes())
+
+            event.is_final = False
+            event.save()
+            call_command("export_archive", directory, stdout=out)
+            self.assertFalse((directory / "2018" / "index.html").exists())
+
+    def test_seed_data(self):
+        with self.assertRaises(CommandError):
+            call_command("seed_data", "--years", "10", stdout=StringIO())
+        call_command("seed_data", "--years", "3", "--participants", "300", stdout=StringIO())
+        events = Event.objects.order_by("year")[2:]
+        self.assertEqual([event.participants.count() for event in events], [75, 100, 125])
+        self.assertEqual([event.get_histogram().count for event in events], [75, 100, 125])
+        self.assertEqual([event.is_final for event in events], [True, True, False])
+        # Most of the participants come back the next year
+        self.assertEqual(LeaderboardEntry.objects.filter(participations=3).count(), 23)
+        call_command("rebuild_leaderboard", "--check", stdout=StringIO())
+
+        call_command("seed_data", "--years", "10", "--participants", "100", "--replace", stdout=StringIO())
+        self.assertEqual(Participant.objects.filter(event__year__gte=2017).count(), 100)
+
+    def test_benchmark_pages(self):
+        out = StringIO()
+        call_command("benchmark_pages", "--repeat", "1", stdout=out)
+        self.assertIn("/2020/?vote=desc", out.getvalue())
+        self.assertIn("POST /2020/", out.getvalue())
+        self.assertFalse(Participant.objects.filter(name__startswith="benchmark-").exists())
+
+    def test_production_profile_leaves_out_dev_tools(self):
+        script = ("import sys; from config.wsgi import application; "
+                  "print(sorted({name.split('.')[0] for name in sys.modules} & {'debug_toolbar', 'django_extensions'}))")
+
+        def loaded(dev_tools):
+            env = {**os.environ, "DEBUG": "True", "DEV_TOOLS": dev_tools}
+            return subprocess.run([sys.executable, "-c", script], cwd=settings.BASE_DIR, env=env, check=True,
+                                  capture_output=True, text=True).stdout.strip()
+
+        self.assertEqual(loaded("False"), "[]")
+        self.assertEqual(loaded("True"), "['debug_toolbar', 'django_extensions']")
+
+    def test_benchmark_startup_importtime(self):
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:      1500 |       1500 |     django.utils\n"
+                  "import time:       500 |       2000 |   django\n"
+                  "import time:       250 |        250 | juhannus.metrics\n")
+        self.assertEqual(BenchmarkStartup().parse_importtime(stderr), {"django": 2.0, "juhannus": 0.25})
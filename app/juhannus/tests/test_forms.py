@@ -1,6 +1,8 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from juhannus.forms import SubmitForm
+from juhannus.forms import SubmitForm, ParticipantAdminForm
 from juhannus.models import Participant
 
 
@@ -12,17 +14,13 @@ class FormsTests(TestCase):
         self.assertFalse(form.is_valid())
         form = SubmitForm(data={"name": "abc°", "vote": 6, "event": 1})  # invalid letter in name
         self.assertFalse(form.is_valid())
-        with self.assertRaises(AttributeError):
-            # a field value too long causes the field to become null and raises an attribute error
-            form = SubmitForm(
-                data={"name": "abcdefabcdefabcdefabcdefabcdefabcdefabcdefabcdef", "vote": "6", "event": 1})
-            self.assertFalse(form.is_valid())
+        form = SubmitForm(
+            data={"name": "abcdefabcdefabcdefabcdefabcdefabcdefabcdefabcdef", "vote": "6", "event": 1})  # too long
+        self.assertFalse(form.is_valid())
         form = SubmitForm(data={"name": "abc", "vote": 666, "event": 1})  # too high vote
         self.assertFalse(form.is_valid())
-        with self.assertRaises(AttributeError):
-            # invalid event number also raises an AttributeError
-            form = SubmitForm(data={"name": "abc", "vote": 1, "event": 666})
-            self.assertFalse(form.is_valid())
+        form = SubmitForm(data={"name": "abc", "vote": 1, "event": 666})  # invalid event number
+        self.assertFalse(form.is_valid())
 
     def test_form_valid(self):
         form = SubmitForm(data={"name": "abc", "vote": 6, "event": 1})
@@ -41,3 +39,17 @@ class FormsTests(TestCase):
         self.assertTrue(form.is_valid())
         form.save()
         self.assertGreater(Participant.objects.count(), original_count)
+
+    def test_form_duplicate_name_is_left_to_the_database(self):
+        form = SubmitForm(data={"name": "ASSET 463 / Groovy ^ Pier", "vote": 6, "event": 1})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(form.is_valid())
+        self.assertFalse([query for query in queries if "juhannus_participant" in query["sql"]])
+
+    def test_admin_form_duplicate_name(self):
+        form = ParticipantAdminForm(data={"name": "ASSET 463 / Groovy ^ Pier", "vote": 6, "event": 1})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors["name"], ["Name already in use. Choose another"])
+        instance = Participant.objects.get(pk=1)
+        form = ParticipantAdminForm(data={"name": "ASSET 463 / Groovy ^ Pier", "vote": 6, "event": 1}, instance=instance)
+        self.assertTrue(form.is_valid())
@@ -0,0 +1,118 @@
+import asyncio
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from juhannus import broker
+from juhannus.broker import CacheBroker, LocalBroker
+from juhannus.models import Event, Participant
+from juhannus.tests.utils import shared_cache
+
+
+class LiveTests(TestCase):
+    fixtures = ['test_juhannus_events.json']
+
+    def setUp(self):
+        patcher = mock.patch.object(broker, '_broker', LocalBroker())
+        self.broker = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_cache_broker(self):
+        self.enterContext(shared_cache())
+        cache.clear()
+        patcher = mock.patch.object(broker, '_broker', CacheBroker(poll_interval=0.01))
+        self.broker = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_broker_resumes_from_last_id(self):
+        first = self.broker.publish("participant-new", {"id": 1})
+        self.broker.publish("participant-new", {"id": 2})
+        messages = [message async for message in self.broker.alisten(first, timeout=0.01, duration=0.05)]
+        self.assertEqual([message[2] for message in messages if message], [{"id": 2}])
+        # Ids from before a restart are not resumed from
+        messages = [message async for message in self.broker.alisten(99, timeout=0.01, duration=0.05)]
+        self.assertEqual([message for message in messages if message], [])
+
+    async def test_async_listen(self):
+        self.broker.publish("participant-new", {"id": 1})
+        messages = self.broker.alisten(0, timeout=0.01, duration=1)
+        self.assertEqual((await anext(messages))[2], {"id": 1})
+        self.assertIsNone(await anext(messages))
+        # Published from another thread while waiting
+        waiting = asyncio.ensure_future(anext(messages))
+        await asyncio.sleep(0)
+        await asyncio.to_thread(self.broker.publish, "participant-new", {"id": 2})
+        self.assertEqual((await waiting)[2], {"id": 2})
+        await messages.aclose()
+        self.assertFalse(self.broker.waiters)
+
+    def test_changes_are_published_on_commit(self):
+        event = Event.objects.get(year=2020)
+        with self.captureOnCommitCallbacks(execute=True):
+            participant = Participant.objects.create(event=event, name="live", vote=42)
+        with self.captureOnCommitCallbacks(execute=True):
+            participant.vote = 43
+            participant.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            participant.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            event.result = 43
+            event.save()
+        self.assertEqual([(message[1], message[2].get("vote")) for message in self.broker.get_messages(0)],
+                         [("participant-new", 42), ("participant-modified", 43), ("participant-deleted", 43),
+                          ("result", None)])
+
+    async def test_cache_broker_between_workers(self):
+        self.use_cache_broker()
+        workers = [CacheBroker(poll_interval=0.01) for _ in range(2)]
+        first = workers[0].publish("participant-new", {"id": 1})
+        self.assertEqual(workers[1].publish("participant-new", {"id": 2}), first + 1)
+        # An id issued by one worker resumes in another
+        messages = [message async for message in workers[1].alisten(first, timeout=0.01, duration=0.05)]
+        self.assertEqual([message[2] for message in messages if message], [{"id": 2}])
+
+        # A message that was numbered but never stored holds up the ones after it for one poll only
+        cache.incr(workers[0].last_id_key)
+        workers[0].publish("participant-new", {"id": 4})
+        messages = [message async for message in workers[1].alisten(first + 1, timeout=1, duration=0.1)]
+        self.assertEqual([message[2] for message in messages if message], [{"id": 4}])
+
+    @override_settings(LIVE_STREAM_SECONDS=0.1)
+    async def test_stream(self):
+        self.use_cache_broker()
+        self.broker.publish("participant-new", {"year": 2018, "id": 1, "name": "old", "vote": 1})
+        self.broker.publish("participant-new", {"year": 2020, "id": 2, "name": "new", "vote": 2})
+        response = await self.async_client.get(reverse("juhannus:event-live"), headers={"Last-Event-ID": "0"})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('id: 2\nevent: participant-new\ndata: {"year": 2020, "id": 2, "name": "new", "vote": 2}\n\n',
+                      content)
+        self.assertNotIn('"old"', content)
+
+    async def test_index_subscribes_to_latest_year_only(self):
+        self.use_cache_broker()
+        response = await self.async_client.get(reverse("juhannus:event-detail", kwargs={"year": 2020}))
+        self.assertContains(response, "EventSource")
+        response = await self.async_client.get(reverse("juhannus:event-detail", kwargs={"year": 2018}))
+        self.assertNotContains(response, "EventSource")
+
+    async def test_feed_off_without_shared_broker(self):
+        # Streams would only hear about the changes made in their own process
+        response = await self.async_client.get(reverse("juhannus:event-detail", kwargs={"year": 2020}))
+        self.assertNotContains(response, "EventSource")
+        self.assertEqual((await self.async_client.get(reverse("juhannus:event-live"))).status_code, 404)
+
+    async def test_feed_off_with_cache_in_process_memory(self):
+        self.use_cache_broker()
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.assertFalse(self.broker.shared)
+            self.assertEqual((await self.async_client.get(reverse("juhannus:event-live"))).status_code, 404)
+
+    def test_feed_off_without_asgi(self):
+        # Every stream would hold a sync worker
+        self.use_cache_broker()
+        self.assertNotContains(self.client.get(reverse("juhannus:event-detail", kwargs={"year": 2020})),
+                               "EventSource")
+        self.assertEqual(self.client.get(reverse("juhannus:event-live")).status_code, 404)
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from prometheus_client import REGISTRY
+
+from juhannus import metrics
+
+
+class MetricsTests(TestCase):
+    fixtures = ['test_juhannus_events.json']
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_queries_and_rendering(self):
+        route = {"route": "event-detail"}
+        requests = self.sample("juhannus_request_seconds_count", method="GET", **route)
+        queries = self.sample("juhannus_request_queries_sum", **route)
+        renders = self.sample("juhannus_template_render_seconds_count", **route)
+        self.client.get(reverse("juhannus:event-detail", kwargs={"year": 2018}))
+        self.assertEqual(self.sample("juhannus_request_seconds_count", method="GET", **route), requests + 1)
+        self.assertEqual(self.sample("juhannus_template_render_seconds_count", **route), renders + 1)
+        self.assertGreater(self.sample("juhannus_request_queries_sum", **route), queries)
+
+        admin = self.sample("juhannus_request_seconds_count", route="admin", method="GET")
+        self.client.get(reverse("admin:index"))
+        self.assertEqual(self.sample("juhannus_request_seconds_count", route="admin", method="GET"), admin + 1)
+
+    def test_votes(self):
+        def votes():
+            return {outcome: self.sample("juhannus_votes_total", outcome=outcome)
+                    for outcome in ["accepted", "closed", "name_in_use", "invalid"]}
+
+        endpoint = reverse("juhannus:event-latest")
+        before = votes()
+        self.client.post(endpoint, {"name": "late", "vote": 5, "event": 2, "action": "save"})
+        self.client.post(endpoint, {"name": "bad", "vote": 500, "event": 2, "action": "save"})
+        with mock.patch("juhannus.models.Event.is_voting_available", return_value=True):
+            self.client.post(endpoint, {"name": "new", "vote": 5, "event": 2, "action": "save"})
+            self.client.post(endpoint, {"name": "NEW", "vote": 6, "event": 2, "action": "save"})
+        after = votes()
+        self.assertEqual({outcome: after[outcome] - before[outcome] for outcome in after},
+                         {"accepted": 1, "closed": 1, "name_in_use": 1, "invalid": 1})
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_endpoint_access(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 404)
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        self.assertContains(response, "juhannus_request_seconds_bucket")
+        self.assertEqual(response["Cache-Control"], "no-store")
+
+        self.client.force_login(get_user_model().objects.create_user("staff", is_staff=True))
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    def test_workers_add_up(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Each process writes its own files, like gunicorn workers
+            for _ in range(2):
+                subprocess.run([sys.executable, "-c", "from juhannus import metrics; metrics.count_vote('accepted')"],
+                               cwd=settings.BASE_DIR, env={**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory},
+                               check=True)
+            with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                exported = metrics.export().decode()
+        self.assertIn('juhannus_votes_total{outcome="accepted"} 2.0', exported)
@@ -0,0 +1,42 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class MigrationsTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([("juhannus", target)])
+        return executor.loader.project_state([("juhannus", target)]).apps
+
+    def get_latest(self):
+        return MigrationExecutor(connection).loader.graph.leaf_nodes("juhannus")[0][1]
+
+    def test_duplicate_years_are_merged(self):
+        apps = self.migrate("0007_event_modified")
+        self.addCleanup(self.migrate, self.get_latest())
+        Event = apps.get_model("juhannus", "Event")
+        Participant = apps.get_model("juhannus", "Participant")
+        LeaderboardEntry = apps.get_model("juhannus", "LeaderboardEntry")
+        header = apps.get_model("juhannus", "Header").objects.create(title="h", text="h")
+        body = apps.get_model("juhannus", "Body").objects.create(title="b", text="b")
+        first = Event.objects.create(year=2019, header=header, body=body)
+        second = Event.objects.create(year=2019, header=header, body=body, result=5, is_final=True)
+        for event, name, normalized, vote in [(first, "Same", "same", 5), (first, "first", "first", 1),
+                                              (second, "same", "same", 3)]:
+            Participant.objects.create(event=event, name=name, normalized_name=normalized, vote=vote)
+        LeaderboardEntry.objects.create(name="same", participations=2)
+        LeaderboardEntry.objects.create(name="first", participations=1)
+
+        apps = self.migrate("0008_event_year_unique")
+        Event = apps.get_model("juhannus", "Event")
+        event = Event.objects.get(year=2019)
+        self.assertEqual(event.pk, second.pk)
+        self.assertEqual(sorted(event.participants.values_list("normalized_name", flat=True)),
+                         ["first", "same", f"same#{Participant.objects.get(name='Same').pk}"])
+        histogram = apps.get_model("juhannus", "VoteHistogram").objects.get(event=event)
+        self.assertEqual((histogram.count, histogram.total), (3, 9))
+        # The vote of 5 hits the result of the event it moved to
+        self.assertEqual(apps.get_model("juhannus", "LeaderboardEntry").objects.get(name="same").wins, 1)
+
@@ -1,11 +1,22 @@
 
 
-from unittest import mock
+import datetime
+import threading
+import zoneinfo
+from unittest import mock, skipUnless
 
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import QuerySet
+from django.db.models.functions import Lower
 from django.test import TestCase
 from django.utils import timezone
 
-from juhannus.models import Event, Header, Body, Participant
+from juhannus import models
+from juhannus.api import get_keyset_page
+
+from juhannus.models import Event, Header, Body, Participant, VoteHistogram, LeaderboardEntry, \
+    get_midsummer_calendar
 
 
 class ModelsTests(TestCase):
@@ -79,3 +90,273 @@ class ModelsTests(TestCase):
             self.assertTrue(event.is_voting_available())
         with mock.patch('juhannus.models.timezone.localtime', return_value=late_vote + timezone.timedelta(seconds=1)):
             self.assertFalse(event.is_voting_available())
+
+    def test_histogram_follows_participants(self):
+        histogram = self.midsummer2018.get_histogram()
+        self.assertEqual((histogram.count, histogram.total, histogram.buckets[6]), (1, 6, 1))
+
+        other = Participant.objects.create(event=self.midsummer2018, name="other", vote=10)
+        histogram.refresh_from_db()
+        self.assertEqual((histogram.count, histogram.total, histogram.buckets[10]), (2, 16, 1))
+
+        other = Participant.objects.get(pk=other.pk)
+        other.vote = 20
+        other.save()
+        histogram.refresh_from_db()
+        self.assertEqual((histogram.count, histogram.total, histogram.buckets[10], histogram.buckets[20]),
+                         (2, 26, 0, 1))
+
+        other.delete()
+        histogram.refresh_from_db()
+        self.assertEqual((histogram.count, histogram.total, histogram.buckets[20]), (1, 6, 0))
+
+    def test_histogram_move_between_events(self):
+        participant = Participant.objects.get(pk=self.participant.pk)
+        participant.event = self.midsummer2020
+        participant.save()
+        self.assertEqual(self.midsummer2018.get_histogram().count, 0)
+        self.assertEqual(self.midsummer2020.get_histogram().buckets[6], 1)
+
+    def test_unloaded_participant_save(self):
+        # Instances without a remembered state apply deltas from the row they overwrite, nothing gets recounted
+        event = Event.objects.get(pk=self.midsummer2018.pk)
+        event.result = 10
+        event.is_final = True
+        event.save()
+        Participant.objects.create(event=event, name="other", vote=12)
+        with mock.patch.object(VoteHistogram, "rebuild"), mock.patch.object(LeaderboardEntry, "rebuild"):
+            participant = Participant.objects.defer("name").get(pk=self.participant.pk)
+            participant.vote = 10
+            participant.save()
+            Participant(pk=participant.pk, event=self.midsummer2020, name="moved", vote=20).save(
+                update_fields=["event", "name", "vote"])
+            VoteHistogram.rebuild.assert_not_called()
+            LeaderboardEntry.rebuild.assert_not_called()
+        self.assertEqual(self.midsummer2018.get_histogram().buckets[6], 0)
+        self.assertEqual(self.midsummer2018.get_histogram().count, 1)
+        self.assertEqual(self.midsummer2020.get_histogram().buckets[20], 1)
+        self.assertEqual(LeaderboardEntry.compute(), {
+            name: {"participations": participations, "wins": wins}
+            for name, participations, wins in LeaderboardEntry.objects.values_list("name", "participations", "wins")
+            if participations})
+        self.assertEqual(event.participants.get().rank, 1)
+
+    def test_histogram_statistics(self):
+        histogram = VoteHistogram(event=self.midsummer2020)
+        self.assertIsNone(histogram.median)
+        self.assertIsNone(histogram.mean)
+        for i, vote in enumerate([1, 2, 2, 10]):
+            Participant.objects.create(event=self.midsummer2020, name=f"p{i}", vote=vote)
+        histogram = VoteHistogram.objects.get(event=self.midsummer2020)
+        self.assertEqual(histogram.median, 2)
+        self.assertEqual(histogram.mean, 3.8)
+        self.assertEqual([vote for vote, _, _ in histogram.get_distribution()], [1, 2, 10])
+        Participant.objects.create(event=self.midsummer2020, name="p11", vote=11)
+        Participant.objects.create(event=self.midsummer2020, name="p12", vote=12)
+        histogram.refresh_from_db()
+        self.assertEqual(histogram.median, 6)
+        self.assertEqual(VoteHistogram.rebuild(self.midsummer2020.pk).buckets, histogram.buckets)
+
+    def test_leaderboard_follows_participants_and_results(self):
+        def entry(name):
+            return LeaderboardEntry.objects.values_list("participations", "wins").get(name=name)
+
+        Participant.objects.create(event=self.midsummer2020, name=" Asset 463 / GROOVY ^ Pier", vote=20)
+        self.assertEqual(entry("asset 463 / groovy ^ pier"), (2, 0))
+
+        event = Event.objects.get(pk=self.midsummer2018.pk)
+        event.result = 6
+        event.save()
+        self.assertEqual(entry("asset 463 / groovy ^ pier"), (2, 0))  # not final yet
+        event.is_final = True
+        event.save()
+        self.assertEqual(entry("asset 463 / groovy ^ pier"), (2, 1))
+
+        participant = Participant.objects.get(pk=self.participant.pk)
+        participant.name = "renamed"
+        participant.save()
+        self.assertEqual(entry("asset 463 / groovy ^ pier"), (1, 0))
+        self.assertEqual(entry("renamed"), (1, 1))
+
+        # Nobody hit the result, the closest guess wins
+        event.result = 7
+        event.save()
+        self.assertEqual(entry("renamed"), (1, 1))
+        closer = Participant.objects.create(event=event, name="closer", vote=8)
+        self.assertEqual((entry("renamed"), entry("closer")), ((1, 1), (1, 1)))
+        closer.vote = 7
+        closer.save()
+        self.assertEqual((entry("renamed"), entry("closer")), ((1, 0), (1, 1)))
+        closer.delete()
+        self.assertEqual((entry("renamed"), entry("closer")), ((1, 1), (0, 0)))
+
+        participant = Participant.objects.get(pk=self.participant.pk)
+        participant.delete()
+        self.assertEqual(entry("renamed"), (0, 0))
+        self.assertEqual(LeaderboardEntry.compute(), {"asset 463 / groovy ^ pier": {"participations": 1, "wins": 0}})
+
+    def test_leaderboard_first_votes_race(self):
+        update = QuerySet.update
+        calls = []
+
+        def racing_update(queryset, **kwargs):
+            # The other first vote of the name inserts its row right after this update found none
+            if not calls:
+                calls.append(update(queryset, **kwargs))
+                LeaderboardEntry.objects.create(name="racer", participations=1)
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", racing_update):
+            LeaderboardEntry.apply("Racer", participations=1)
+        self.assertEqual(LeaderboardEntry.objects.values_list("participations", flat=True).get(name="racer"), 2)
+
+    def test_rank_participants(self):
+        event = Event.objects.get(pk=self.midsummer2020.pk)
+        for name, vote in [("a", 10), ("b", 14), ("c", 6), ("d", 13), ("e", 20)]:
+            Participant.objects.create(event=event, name=name, vote=vote)
+
+        def ranks():
+            return list(event.participants.order_by("name").values_list("name", "distance", "rank"))
+
+        self.assertEqual({rank for _, _, rank in ranks()}, {None})
+        event.result = 12
+        event.save()
+        # Ties share the rank and the next rank skips past them
+        self.assertEqual(ranks(), [("a", 2, 2), ("b", 2, 2), ("c", 6, 4), ("d", 1, 1), ("e", 8, 5)])
+        with self.assertNumQueries(2):
+            event.rank_participants()
+        Participant.objects.create(event=event, name="f", vote=12)
+        self.assertEqual([rank for _, _, rank in ranks()], [3, 3, 5, 2, 6, 1])
+        event.result = None
+        event.save()
+        self.assertEqual({(distance, rank) for _, distance, rank in ranks()}, {(None, None)})
+
+    def test_normalized_name_fits_its_columns(self):
+        # A valid name of 32 characters that casefold to three each
+        participant = Participant(event=self.midsummer2020, name="ﬃ" * 32, vote=1)
+        participant.full_clean()
+        participant.save()
+        self.assertEqual(participant.normalized_name, "ffi" * 21 + "f")
+        self.assertTrue(LeaderboardEntry.objects.filter(name=participant.normalized_name).exists())
+
+    def test_normalized_name_is_unique_per_event(self):
+        self.assertEqual(self.participant.normalized_name, "asset 463 / groovy ^ pier")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Participant.objects.create(event=self.midsummer2018, name="ASSET 463 / Groovy ^ Pier ", vote=1)
+        Participant.objects.create(event=self.midsummer2020, name="ASSET 463 / Groovy ^ Pier ", vote=1)
+        duplicate = Participant(event=self.midsummer2020, name="asset 463 / groovy ^ pier", vote=2)
+        with self.assertRaises(ValidationError):
+            duplicate.full_clean()
+
+    def test_voting_deadline_boundary(self):
+        event = self.midsummer2018
+        deadline = event.get_voting_deadline()
+        self.assertEqual(deadline.isoformat(), "2018-06-21T23:59:59+03:00")
+        with mock.patch('juhannus.models.timezone.localtime', return_value=deadline):
+            self.assertTrue(event.is_voting_available())
+        with mock.patch('juhannus.models.timezone.localtime', return_value=deadline + datetime.timedelta(microseconds=1)):
+            self.assertFalse(event.is_voting_available())
+        # the same moment seen from another time zone is still the same deadline
+        with mock.patch('juhannus.models.timezone.localtime',
+                        return_value=deadline.astimezone(datetime.timezone.utc)):
+            self.assertTrue(event.is_voting_available())
+        self.assertEqual(event.get_voting_deadline(year=2020).isoformat(), "2020-06-18T23:59:59+03:00")
+        self.assertEqual(event.get_results_deadline().isoformat(), "2018-06-24T22:00:00+03:00")
+
+    def test_deadline_across_dst(self):
+        # The deadline has June's UTC offset whatever the season it is computed in, the memoized calendar must
+        # not keep the offset of the moment it was first computed
+        deadlines = {"Europe/Helsinki": "2018-06-21T20:59:59+00:00", "America/Santiago": "2018-06-22T03:59:59+00:00"}
+        for name, deadline in deadlines.items():
+            for now in [datetime.datetime(2018, 1, 15, 12, tzinfo=datetime.timezone.utc),
+                        datetime.datetime(2018, 6, 15, 12, tzinfo=datetime.timezone.utc)]:
+                models._get_midsummer_calendar.cache_clear()
+                with self.subTest(name, now=now), timezone.override(zoneinfo.ZoneInfo(name)), \
+                        mock.patch("juhannus.models.timezone.now", return_value=now):
+                    voting_deadline = get_midsummer_calendar(2018).voting_deadline
+                    self.assertEqual(voting_deadline.astimezone(datetime.timezone.utc).isoformat(), deadline)
+        models._get_midsummer_calendar.cache_clear()
+
+    def test_calendar_is_memoized(self):
+        event = Event.objects.get(pk=self.midsummer2018.pk)
+        calendar = event.get_calendar()
+        self.assertIs(event.get_calendar(), calendar)
+        self.assertIs(get_midsummer_calendar(2018), calendar)
+        with mock.patch('juhannus.models._get_midsummer_calendar') as compute:
+            event.get_header_text()
+            event.get_body_text()
+            event.is_voting_available()
+            compute.assert_not_called()
+        with timezone.override("UTC"):
+            self.assertEqual(get_midsummer_calendar(2018).voting_deadline.isoformat(), "2018-06-21T23:59:59+00:00")
+
+    def test_rendered_text_cache(self):
+        event = Event.objects.select_related("header", "body").get(pk=self.midsummer2018.pk)
+        self.assertEqual(event.get_body_text(), "2o18 2 o 1 8")
+        with mock.patch.object(Event, "_subst_text") as subst_text:
+            event.get_body_text()
+            Event.objects.select_related("body").get(pk=event.pk).get_body_text()
+            subst_text.assert_not_called()
+
+        body = event.body
+        body.text = "$voting_deadline"
+        body.save()
+        self.assertFalse([key for key in models._rendered_texts if key[:2] == ("Body", body.pk)])
+        self.assertEqual(Event.objects.get(pk=event.pk).get_body_text(), "21.6")
+
+        # an edit that never reached this process' signals is still noticed through the text
+        Body.objects.filter(pk=body.pk).update(text="$year_spaced")
+        self.assertEqual(Event.objects.get(pk=event.pk).get_body_text(), "2 o 1 8")
+
+    def test_rendered_text_cache_between_threads(self):
+        body = self.midsummer2018.body
+        errors = []
+
+        def render():
+            try:
+                for year in range(1000, 3000):
+                    Event(year=year, header=self.midsummer2018.header, body=body).get_body_text()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=render)
+        thread.start()
+        # Forgetting walks the entries while the other thread keeps adding them
+        while thread.is_alive():
+            models.forget_rendered_texts(body)
+        thread.join()
+        self.assertEqual(errors, [])
+
+
+@skipUnless(connection.vendor in ("sqlite", "postgresql"), "Query plans are checked on SQLite and PostgreSQL")
+class QueryPlanTests(TestCase):
+    fixtures = ['test_juhannus_events.json']
+
+    def setUp(self):
+        self.participants = Event.objects.get(year=2018).participants.all()
+        if connection.vendor == "postgresql":
+            # The test tables are tiny, make the planner show what it does with big ones
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertOrderedByIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        # No sort step on top of the index scan
+        self.assertNotIn("TEMP B-TREE" if connection.vendor == "sqlite" else "Sort", plan)
+
+    def test_event_view_orderings(self):
+        by_name = self.participants.order_by(Lower("name"))
+        by_vote = self.participants.order_by("vote")
+        self.assertOrderedByIndex(by_name, "participant_event_lname_idx")
+        self.assertOrderedByIndex(by_name.reverse(), "participant_event_lname_idx")
+        self.assertOrderedByIndex(by_vote, "participant_event_vote_idx")
+        self.assertOrderedByIndex(by_vote.reverse(), "participant_event_vote_idx")
+
+    def test_api_keyset_pages(self):
+        for variant, index in [("name-asc", "participant_event_lname_idx"), ("name-desc", "participant_event_lname_idx"),
+                               ("vote-asc", "participant_event_vote_idx"), ("vote-desc", "participant_event_vote_idx")]:
+            after = ("m", 10) if variant.startswith("name") else (50, 10)
+            self.assertOrderedByIndex(get_keyset_page(self.participants, variant)[0], index)
+            self.assertOrderedByIndex(get_keyset_page(self.participants, variant, after)[0], index)
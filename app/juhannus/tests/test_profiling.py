@@ -0,0 +1,69 @@
+import pstats
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from juhannus import profiling
+
+
+class ProfilingTests(TestCase):
+    fixtures = ['test_juhannus_events.json']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(
+            MIDDLEWARE=["juhannus.middleware.ProfilingMiddleware", *settings.MIDDLEWARE],
+            PROFILE_DIR=self.directory, PROFILE_SAMPLE_RATE=0, PROFILE_ROUTES=["event-stats"], PROFILE_TOKEN="secret")
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get_functions(self, file):
+        return {function for _, _, function in pstats.Stats(str(file.path)).stats}
+
+    def test_sampling(self):
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": 2018})
+        self.client.get(endpoint)
+        self.client.get(endpoint, headers={"X-Profile": "wrong"})
+        self.assertEqual(profiling.read_directory(self.directory), [])
+
+        self.client.get(endpoint, headers={"X-Profile": "secret"})
+        self.client.get(reverse("juhannus:event-stats"))
+        files = profiling.read_directory(self.directory)
+        self.assertEqual([file.view for file in files], ["juhannus.event-detail", "juhannus.event-stats"])
+        self.assertGreater(files[0].queries, 0)
+        # The async view, its ORM calls and the rendering all end up in the profile
+        self.assertTrue({"add_event_context", "get_participant_window", "render"} <= self.get_functions(files[0]))
+
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            self.client.get(endpoint)
+        self.assertEqual(len(profiling.read_directory(self.directory)), 3)
+
+    async def test_asgi(self):
+        await self.async_client.get(reverse("juhannus:event-detail", kwargs={"year": 2018}),
+                                    headers={"X-Profile": "secret"})
+        files = profiling.read_directory(self.directory)
+        self.assertEqual(len(files), 1)
+        self.assertTrue({"add_event_context", "get_participant_window"} <= self.get_functions(files[0]))
+
+    def test_report(self):
+        with self.assertRaises(CommandError):
+            call_command("profile_report", dir=self.directory, stdout=StringIO())
+        for year in [2018, 2020]:
+            self.client.get(reverse("juhannus:event-detail", kwargs={"year": year}), headers={"X-Profile": "secret"})
+        self.client.get(reverse("juhannus:event-stats"))
+        Path(self.directory, "unrelated.prof").touch()
+
+        out = StringIO()
+        call_command("profile_report", dir=self.directory, view="event-detail", top=5, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[1].startswith("juhannus.event-detail"))
+        self.assertEqual(lines[1].split()[1], "2")
+        self.assertNotIn("juhannus.event-stats", out.getvalue())
+        self.assertIn("List reduced", out.getvalue())
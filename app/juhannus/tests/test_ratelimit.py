@@ -0,0 +1,100 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from juhannus.models import Participant
+from juhannus.ratelimit import CacheRateLimiter, LocalRateLimiter
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_token_bucket(self):
+        now = [100.0]
+        limiter = LocalRateLimiter(client_rate=0.5, client_burst=2, global_rate=10, global_burst=100)
+        with mock.patch.object(limiter, "clock", lambda: now[0]):
+            self.assertEqual([limiter.take("a"), limiter.take("a")], [0, 0])
+            self.assertEqual(limiter.take("a"), 2)
+            self.assertEqual(limiter.take("b"), 0)
+            now[0] += 1
+            self.assertEqual(limiter.take("a"), 1)
+            now[0] += 1
+            self.assertEqual(limiter.take("a"), 0)
+            # Refilling stops at the burst
+            now[0] += 60
+            self.assertEqual([limiter.take("a") for _ in range(3)], [0, 0, 2])
+
+    def test_pruning(self):
+        now = [100.0]
+        limiter = LocalRateLimiter(1, 2, 100, 100, max_clients=4)
+        with mock.patch.object(limiter, "clock", lambda: now[0]):
+            for client in "abcd":
+                limiter.take(client)
+            now[0] += 2
+            limiter.take("e")
+        self.assertEqual(set(limiter.buckets), {"*", "e"})
+
+    def test_shared_between_workers(self):
+        cache.clear()
+        workers = [CacheRateLimiter(client_rate=0.01, client_burst=2, global_rate=0.01, global_burst=3)
+                   for _ in range(2)]
+        self.assertEqual([workers[0].take("a"), workers[1].take("a")], [0, 0])
+        self.assertGreater(workers[0].take("a"), 0)
+        self.assertEqual(workers[1].take("b"), 0)
+        # Out of global tokens, although b has one left
+        self.assertGreater(workers[0].take("b"), 0)
+
+
+@override_settings(VOTE_CLIENT_RATE=0.01, VOTE_CLIENT_BURST=3, VOTE_GLOBAL_RATE=0.01, VOTE_GLOBAL_BURST=25)
+class VoteRateLimitTests(TestCase):
+    fixtures = ['test_juhannus_events.json']
+
+    def setUp(self):
+        patcher = mock.patch("juhannus.models.Event.is_voting_available", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def vote(self, name, address, **headers):
+        data = {"name": name, "vote": 5, "event": 2, "action": "save"}
+        return self.client.post(reverse("juhannus:event-latest"), data, REMOTE_ADDR=address, headers=headers)
+
+    def test_flooding_client_does_not_crowd_out_voters(self):
+        statuses = {"bot": [], "voters": []}
+        # Ten posts from the bot for every vote from a person
+        for index in range(20):
+            for attempt in range(10):
+                statuses["bot"].append(self.vote(f"bot {index} {attempt}", "203.0.113.66").status_code)
+            statuses["voters"].append(self.vote(f"voter {index}", f"198.51.100.{index}").status_code)
+
+        self.assertEqual(statuses["voters"], [302] * 20)
+        self.assertEqual(statuses["bot"].count(302), 3)
+        self.assertEqual(statuses["bot"].count(429), 197)
+        self.assertEqual(Participant.objects.filter(event=2, name__startswith="voter").count(), 20)
+        self.assertEqual(Participant.objects.filter(event=2, name__startswith="bot").count(), 3)
+
+        # Turned away before the session, the csrf check and the form
+        with self.assertNumQueries(0):
+            response = self.vote("bot again", "203.0.113.66")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(int(response["Retry-After"]), range(90, 101))
+
+    def test_global_limit(self):
+        # Two left of the global bucket, whoever comes first gets them
+        for index in range(23):
+            self.vote(f"early {index}", f"198.51.100.{index}")
+        self.assertEqual([self.vote(f"late {index}", f"192.0.2.{index}").status_code for index in range(3)],
+                         [302, 302, 429])
+        self.assertEqual(self.client.get(reverse("juhannus:event-latest")).status_code, 200)
+
+    @override_settings(VOTE_CLIENT_HEADER="X-Forwarded-For")
+    def test_behind_proxy(self):
+        statuses = [self.vote(f"voter {index}", "10.0.0.1", X_Forwarded_For=f"203.0.113.1, 198.51.100.{index % 2}")
+                    .status_code for index in range(8)]
+        self.assertEqual(statuses, [302] * 6 + [429] * 2)
+
+    def test_off_for_benchmark_clients(self):
+        # Clients created under the override leave the middleware out
+        with override_settings(VOTE_RATE_LIMIT=False):
+            self.client = Client()
+            statuses = {self.vote(f"benchmark {index}", "127.0.0.1").status_code for index in range(10)}
+        self.assertEqual(statuses, {302})
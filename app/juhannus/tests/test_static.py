@@ -0,0 +1,66 @@
+import gzip
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+import brotli
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from juhannus.staticfiles import IMMUTABLE
+
+
+class StaticFilesTests(TestCase):
+    fixtures = ['test_juhannus_events.json']
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = Path(cls.enterClassContext(tempfile.TemporaryDirectory()))
+        cls.enterClassContext(override_settings(STATIC_ROOT=str(cls.root)))
+        call_command("collectstatic", interactive=False, stdout=StringIO())
+        cls.original = (Path(settings.BASE_DIR) / "juhannus/static/juhannus/style.css").read_bytes()
+
+    def get_css_url(self):
+        response = self.client.get(reverse("juhannus:event-detail", kwargs={"year": 2018}))
+        url = response.content.decode().split('rel="stylesheet" href="')[1].split('"')[0]
+        self.assertRegex(url, r"^/static/juhannus/style\.[0-9a-f]{12}\.css$")
+        return url
+
+    def test_collectstatic_writes_compressed_variants(self):
+        hashed = self.root / self.get_css_url().removeprefix("/static/")
+        self.assertEqual(hashed.read_bytes(), self.original)
+        self.assertEqual(gzip.decompress(Path(f"{hashed}.gz").read_bytes()), self.original)
+        self.assertEqual(brotli.decompress(Path(f"{hashed}.br").read_bytes()), self.original)
+
+    def test_serving(self):
+        url = self.get_css_url()
+        for accept, encoding, decompress in [("gzip, deflate, br", "br", brotli.decompress),
+                                             ("gzip, br;q=0", "gzip", gzip.decompress),
+                                             ("", None, bytes)]:
+            response = self.client.get(url, headers={"Accept-Encoding": accept})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get("Content-Encoding"), encoding)
+            self.assertEqual(decompress(b"".join(response.streaming_content)), self.original)
+            self.assertEqual(response["Content-Type"], "text/css")
+            self.assertEqual(response["Cache-Control"], IMMUTABLE)
+            self.assertEqual(response["Vary"], "Accept-Encoding")
+            # Assets skip the session and auth middleware
+            self.assertNotIn("Cookie", response["Vary"])
+            response.close()
+
+        response = self.client.get(url, headers={"If-Modified-Since": response["Last-Modified"]})
+        self.assertEqual(response.status_code, 304)
+
+        # Without the hash the file may change with the next deploy
+        response = self.client.get("/static/juhannus/style.css")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        response.close()
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.client.get("/static/juhannus/missing.css").status_code, 404)
+        self.assertEqual(self.client.get("/static/../manage.py").status_code, 404)
+        self.assertEqual(self.client.post(self.get_css_url()).status_code, 404)
@@ -1,17 +1,30 @@
 import datetime
+import gzip
+import json
+import re
+import time
 from unittest import mock
 
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.http import QueryDict
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils.http import http_date
 from django.utils import timezone
 
+from juhannus import pagecache, views
 from juhannus.models import Event, Participant, get_midsummer_saturday
 from juhannus.forms import SubmitForm
+from juhannus.tests.utils import add_participants, shared_cache
 
 
 class ViewsTests(TestCase):
     fixtures = ['test_juhannus_events.json', 'test_juhannus_users.json']
 
+    def setUp(self):
+        cache.clear()
+
     def test_empty_db(self):
         endpoint = reverse("juhannus:event-latest")
         self.assertEqual(endpoint, "/")
@@ -20,34 +33,24 @@ class ViewsTests(TestCase):
             self.assertEqual(response.content, b"No events in db")
             self.assertEqual(response.status_code, 200)
 
-    def test_new_event_creation_prior_midsummer_week(self):
-        week_before_midsummer = get_midsummer_saturday(2019) - datetime.timedelta(days=7)
-        event_count = Event.objects.count()
-        with mock.patch('juhannus.models.timezone.now', return_value=week_before_midsummer):
-            response = self.client.get(reverse("juhannus:event-latest"))
-            self.assertEqual(response.status_code, 200)
-            self.assertEqual(Event.objects.count(), event_count)
-
-    def test_new_event_creation_during_midsummer_week(self):
-        two_days_before_midsummer = get_midsummer_saturday(2019) - datetime.timedelta(days=2)
-        event_count = Event.objects.count()
-        with mock.patch('juhannus.models.timezone.now', return_value=two_days_before_midsummer):
-            response = self.client.get(reverse("juhannus:event-latest"))
-            self.assertEqual(response.status_code, 200)
-            self.assertEqual(Event.objects.count(), event_count + 1)
-
-    def test_new_event_creation_by_seconds(self):
+    @mock.patch('juhannus.views._event_years', new_callable=set)
+    def test_event_creation_fallback(self, event_years):
         sat = get_midsummer_saturday(2019)
-        sun_evening = sat.replace(hour=23, minute=59, second=59) - datetime.timedelta(days=6)
         event_count = Event.objects.count()
-        with mock.patch('juhannus.models.timezone.now', return_value=sun_evening):
-            response = self.client.get(reverse("juhannus:event-latest"))
-            self.assertEqual(response.status_code, 200)
+        with mock.patch('juhannus.models.timezone.now', return_value=sat - datetime.timedelta(days=7)):
+            self.assertEqual(self.client.get(reverse("juhannus:event-latest")).status_code, 200)
             self.assertEqual(Event.objects.count(), event_count)
-        with mock.patch('juhannus.models.timezone.now', return_value=sun_evening + datetime.timedelta(seconds=2)):
-            response = self.client.get(reverse("juhannus:event-latest"))
-            self.assertEqual(response.status_code, 200)
-            self.assertEqual(Event.objects.count(), event_count + 1)
+        with mock.patch('juhannus.models.timezone.now', return_value=sat - datetime.timedelta(days=2)):
+            self.assertEqual(self.client.get(reverse("juhannus:event-latest")).status_code, 200)
+            self.assertEqual(Event.objects.get(year=2019).header_id, 1)
+            self.assertEqual(event_years, {2019})
+            # Known to exist from here on
+            with self.assertNumQueries(0):
+                async_to_sync(views.acreate_current_event)()
+        with mock.patch('juhannus.models.timezone.now', return_value=sat + datetime.timedelta(days=30)):
+            event_years.clear()
+            with self.assertNumQueries(0):
+                async_to_sync(views.acreate_current_event)()
 
     def test_endpoints(self):
         response = self.client.get(reverse("juhannus:event-latest"))
@@ -132,3 +135,248 @@ class ViewsTests(TestCase):
         response = self.client.post(endpoint, {**form.data, **{"action": "delete", "pk": 2}})
         self.assertEqual(response.status_code, 302)
         self.assertLess(Participant.objects.last().name, "abcd")
+
+    def test_vote_distribution(self):
+        response = self.client.get(reverse("juhannus:event-detail", kwargs={"year": 2018}))
+        self.assertContains(response, "Mediaani: 6, Keskiarvo: 6.0")
+        response = self.client.get(reverse("juhannus:event-detail", kwargs={"year": 2020}))
+        self.assertNotContains(response, "Mediaani")
+
+    def test_stats(self):
+        self.client.login(username='superuser', password='123')
+        self.client.post(reverse("juhannus:event-latest"), {"name": "ABC", "vote": 6, "event": 1, "action": "save"})
+        self.client.post(reverse("juhannus:event-latest"), {"name": "abc", "vote": 6, "event": 2, "action": "save"})
+        response = self.client.get(reverse("juhannus:event-stats"))
+        self.assertContains(response, 'limit=50')
+        response = self.client.get(reverse("juhannus:event-stats-data"))
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.json(), {"complete": True, "winners": [],
+                                           "participants": [{"name": "abc", "count": 2}]})
+
+    def test_stats_data(self):
+        first = Event.objects.first()
+        for year in range(2000, 2010):
+            event = Event.objects.create(year=year, result=5, is_final=True, header=first.header, body=first.body)
+            for index in range(40):
+                Participant.objects.create(event=event, name=f"participant {index:02}", vote=5 + index % 3)
+        endpoint = reverse("juhannus:event-stats-data")
+        response = self.client.get(endpoint, {"limit": 2})
+        self.assertEqual(response.json(), {
+            "complete": False,
+            "winners": [{"name": f"participant {index:02}", "count": 10} for index in [0, 3]],
+            "participants": [{"name": f"participant {index:02}", "count": 10} for index in [0, 1]],
+        })
+        self.assertEqual(len(self.client.get(endpoint, {"limit": 50}).json()["participants"]), 40)
+        self.assertEqual(self.client.get(endpoint, {"limit": "0"}).status_code, 400)
+        self.assertEqual(self.client.get(endpoint, {"limit": "all"}).status_code, 400)
+
+        response = self.client.get(endpoint, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        stats = json.loads(gzip.decompress(response.content))
+        self.assertTrue(stats["complete"])
+        self.assertEqual(len(stats["winners"]), 14)
+
+        # The payload is built once, later requests only check the change markers
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+        with self.assertNumQueries(1):
+            response = self.client.get(endpoint, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        # The etag stands for the content in any encoding
+        self.assertEqual(self.client.get(endpoint, headers={"If-None-Match": etag, "Accept-Encoding": "br"})
+                         .status_code, 304)
+        # Only the limits of the stats page are kept
+        self.assertIsNotNone(cache.get(pagecache.get_stats_key(None)))
+        self.assertIsNone(cache.get(pagecache.get_stats_key(2)))
+
+        # A changed vote that does not move the leaderboards keeps the etag
+        participant = event.participants.get(name="participant 38")
+        participant.vote = 8
+        participant.save()
+        self.assertEqual(self.client.get(endpoint, headers={"If-None-Match": etag}).status_code, 304)
+        Participant.objects.create(event=event, name="newcomer", vote=1)
+        response = self.client.get(endpoint, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({"name": "newcomer", "count": 1}, response.json()["participants"])
+
+    def test_closest_guess_wins(self):
+        event = Event.objects.get(year=2018)
+        event.result = 9
+        event.is_final = True
+        event.save()
+        Participant.objects.create(event=event, name="far", vote=1)
+        response = self.client.get(reverse("juhannus:event-detail", kwargs={"year": 2018}))
+        self.assertEqual(re.findall(r'class="winner" data-id="(\d+)"', response.content.decode()), ["1"])
+        response = self.client.get(reverse("juhannus:event-stats-data"))
+        self.assertEqual(response.json()["winners"], [{"name": "asset 463 / groovy ^ pier", "count": 1}])
+
+    def test_post_duplicate_name(self):
+        self.client.login(username='superuser', password='123')
+        endpoint = reverse("juhannus:event-latest")
+        original_count = Participant.objects.count()
+        data = {"name": " asset 463 / GROOVY ^ pier ", "vote": 7, "event": 1, "action": "save"}
+        response = self.client.post(endpoint, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context["form"], "name", "Name already in use. Choose another")
+        self.assertEqual(Participant.objects.count(), original_count)
+        response = self.client.post(endpoint, {**data, "event": 2})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Participant.objects.last().normalized_name, "asset 463 / groovy ^ pier")
+
+    @shared_cache()
+    def test_finalized_page_cache(self):
+        cache.clear()
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": 2018})
+        response = self.client.get(endpoint)
+        with self.assertNumQueries(4):  # not final yet, so nothing is cached
+            self.client.get(endpoint)
+
+        event = Event.objects.get(year=2018)
+        event.result = 6
+        event.is_final = True
+        event.save()
+        response = self.client.get(endpoint)
+        with self.assertNumQueries(0):
+            cached = self.client.get(endpoint)
+        self.assertEqual(cached.content, response.content)
+        with self.assertNumQueries(0):
+            self.client.get(endpoint + "?name=asc")
+        self.assertNotEqual(self.client.get(endpoint + "?vote=desc").content, response.content)
+
+        # Purged once the change is committed, a request before that could only cache the old page again
+        participant = Participant.objects.get(pk=1)
+        participant.name = "renamed"
+        with self.captureOnCommitCallbacks() as callbacks:
+            participant.save()
+        self.assertIsNotNone(cache.get(pagecache.get_page_key(2018, "name-asc")))
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(endpoint), "renamed")
+
+        event.header.text = "Changed header"
+        with self.captureOnCommitCallbacks(execute=True):
+            event.header.save()
+        self.assertContains(self.client.get(endpoint), "Changed header")
+
+        self.client.login(username='superuser', password='123')
+        response = self.client.get(endpoint)
+        self.assertContains(response, 'value="modify"')
+
+    def test_no_page_cache_in_local_memory(self):
+        event = Event.objects.get(year=2018)
+        event.is_final = True
+        event.save()
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": 2018})
+        self.client.get(endpoint)
+        self.assertIsNone(cache.get(pagecache.get_page_key(2018, "name-asc")))
+        with self.assertNumQueries(4):
+            self.client.get(endpoint)
+
+    def test_conditional_get(self):
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": 2018})
+        response = self.client.get(endpoint)
+        etag = response.headers["ETag"]
+        with self.assertNumQueries(2):  # the event list and the change markers, no participants
+            response = self.client.get(endpoint, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        # No Last-Modified, If-Modified-Since cannot tell a change of the voting deadline or of the user
+        self.assertNotIn("Last-Modified", response.headers)
+        response = self.client.get(endpoint, headers={"If-Modified-Since": http_date(time.time() + 60)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(endpoint + "?vote=asc", headers={"If-None-Match": etag}).status_code, 200)
+        # A deploy of new static files
+        with mock.patch("juhannus.views.static", return_value="/static/juhannus/style.0123456789ab.css"):
+            self.assertEqual(self.client.get(endpoint, headers={"If-None-Match": etag}).status_code, 200)
+
+        Participant.objects.create(event_id=1, name="newcomer", vote=1)
+        response = self.client.get(endpoint, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        self.client.login(username='superuser', password='123')
+        self.assertEqual(self.client.get(endpoint, headers={"If-None-Match": response.headers["ETag"]}).status_code,
+                         200)
+
+        # The stats page has no data of its own, new participants leave it as it was
+        endpoint = reverse("juhannus:event-stats")
+        response = self.client.get(endpoint)
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+        Participant.objects.create(event_id=1, name="another", vote=1)
+        self.assertEqual(self.client.get(endpoint, headers={"If-None-Match": response["ETag"]}).status_code, 304)
+
+    @override_settings(VOTE_BATCHING=False)
+    def test_vote_leaves_event_row_alone(self):
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": 2018})
+        etag = self.client.get(endpoint).headers["ETag"]
+        modified = Event.objects.get(year=2018).modified
+        data = {"name": "newcomer", "vote": 6, "event": 1, "action": "save"}
+        with mock.patch("juhannus.models.Event.is_voting_available", return_value=True):
+            # The form's event lookups, the insert and the histogram and leaderboard updates, with their savepoints
+            with self.assertNumQueries(16):
+                self.assertEqual(self.client.post(endpoint, data).status_code, 302)
+        self.assertEqual(Event.objects.get(year=2018).modified, modified)
+        self.assertNotEqual(self.client.get(endpoint, headers={"If-None-Match": etag}).status_code, 304)
+
+        # Renames count no votes but change the page all the same
+        etag = self.client.get(endpoint).headers["ETag"]
+        participant = Participant.objects.get(name="newcomer")
+        participant.name = "renamed"
+        participant.save()
+        self.assertEqual(self.client.get(endpoint, headers={"If-None-Match": etag}).status_code, 200)
+
+    @shared_cache()
+    def test_conditional_get_cached_page(self):
+        cache.clear()
+        event = Event.objects.get(year=2018)
+        event.is_final = True
+        event.save()
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": 2018})
+        etag = self.client.get(endpoint).headers["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(endpoint, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_asgi(self):
+        response = await self.async_client.get(reverse("juhannus:event-detail", kwargs={"year": 2018}))
+        self.assertContains(response, "Mediaani: 6, Keskiarvo: 6.0")
+        response = await self.async_client.get(reverse("juhannus:event-detail", kwargs={"year": 1999}))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse("juhannus:event-stats"))
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.post(reverse("juhannus:event-latest"),
+                                                {"name": "abc", "vote": 6, "event": 1, "action": "save"})
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(PARTICIPANT_WINDOW=2)
+    def test_windowed_participants(self):
+        add_participants(Event.objects.get(year=2018))
+        endpoint = reverse("juhannus:event-detail", kwargs={"year": 2018})
+
+        def get_all(url):
+            response = self.client.get(url)
+            names, pages = [], 0
+            while True:
+                content = response.content.decode()
+                names += re.findall(r'data-name="([^"]*)"', content)
+                pages += 1
+                more = re.search(r'<tr id="more-rows" data-next="([^"]*)"', content)
+                if not more:
+                    return names, pages, response
+                response = self.client.get(more.group(1).replace("&amp;", "&"))
+
+        names, pages, _ = get_all(endpoint + "?vote=desc")
+        self.assertEqual(names, ["delta", "echo", "Alpha", "bravo", "Asset 463 / Groovy ^ Pier", "charlie"])
+        self.assertEqual(pages, 3)
+        response = self.client.get(endpoint)
+        self.assertEqual(len(response.context["participants"]), 2)
+        self.assertContains(response, '<span id="participant-count">6</span>')
+
+        self.client.login(username='superuser', password='123')
+        response = self.client.get(response.context["next_rows"])
+        self.assertContains(response, 'value="modify"', count=2)
+        self.assertEqual(self.client.get(reverse("juhannus:event-rows", kwargs={"year": 2018}) + "?after=x").status_code,
+                         400)
+        # The cursor of the name ordering is refused under the vote ordering
+        rows, params = response.context["next_rows"].split("?", 1)
+        self.assertEqual(self.client.get(rows + "?vote=asc&after=" + QueryDict(params)["after"]).status_code, 400)
@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+from django.test import override_settings
+
+from juhannus.models import Participant
+
+# The page cache and the cache broker are only used with a cache the workers share, a file cache stands in for one
+SHARED_CACHES = {"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                             "LOCATION": os.path.join(tempfile.gettempdir(), "juhannus-test-cache")}}
+
+
+def shared_cache():
+    return override_settings(CACHES=SHARED_CACHES)
+
+
+# Ties in the votes and names that differ in case, for the orderings of the tables and the api
+PARTICIPANTS = [("bravo", 10), ("Alpha", 10), ("charlie", 3), ("delta", 50), ("echo", 10)]
+
+
+def add_participants(event):
+    for name, vote in PARTICIPANTS:
+        Participant.objects.create(event=event, name=name, vote=vote)
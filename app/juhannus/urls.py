@@ -1,11 +1,18 @@
 from django.urls import path
 
-from juhannus.views import EventView, StatsView
+from juhannus.api import EventListApiView, EventApiView, ParticipantListApiView
+from juhannus.views import EventView, StatsView, StatsDataView, LiveView, ParticipantRowsView
 
 app_name = "juhannus"
 
 urlpatterns = [
     path('<int:year>/', EventView.as_view(), name="event-detail"),
+    path('<int:year>/rows/', ParticipantRowsView.as_view(), name="event-rows"),
     path('stats/', StatsView.as_view(), name='event-stats'),
+    path('stats.json', StatsDataView.as_view(), name='event-stats-data'),
+    path('live/', LiveView.as_view(), name='event-live'),
+    path('api/events/', EventListApiView.as_view(), name='api-events'),
+    path('api/events/<int:year>/', EventApiView.as_view(), name='api-event'),
+    path('api/events/<int:year>/participants/', ParticipantListApiView.as_view(), name='api-participants'),
     path('', EventView.as_view(), name="event-latest")
 ]
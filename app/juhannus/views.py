@@ -1,103 +1,417 @@
+import datetime
+import hashlib
+import hmac
 import json
 
-from django.db.models import Count, F
-from django.db.models.functions import Lower
-from django.http import HttpResponse, Http404
-from django.shortcuts import get_object_or_404
-from django.views import generic
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse, Http404, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.templatetags.static import static
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views import generic
 from django.views.generic.base import ContextMixin
 
-from juhannus.models import Event, Participant, get_midsummer_saturday
+from juhannus import api, metrics, pagecache
+from juhannus.batching import VoteStatus, get_batcher
+from juhannus.broker import get_broker, is_live_feed_available
+from juhannus.compression import ENCODINGS, compress_variants, get_accepted_encodings
+from juhannus.models import (Event, Participant, LeaderboardEntry, change_marker, create_midsummer_event,
+                             get_midsummer_week_start)
 from juhannus.forms import SubmitForm
 
 
+def get_participant_window(event, params, after=None, size=None):
+    """
+    Up to size participants of the event in the order of the ?name=/?vote= params, starting after the keyset
+    cursor, and the query string for the window after it (None if this is the last one, or if size is None)
+    """
+    participants, key = api.get_keyset_page(event.participants.all(), pagecache.get_sort_variant(params), after)
+    if size is None:
+        return list(participants), None
+    participants = list(participants[:size + 1])
+    if len(participants) <= size:
+        return participants, None
+    participants = participants[:size]
+    next_params = params.copy()
+    next_params["after"] = api.encode_cursor(getattr(participants[-1], key), participants[-1].pk)
+    return participants, next_params.urlencode()
+
+
+# Years this process has seen an event for during midsummer week, so the fallback below queries once per year
+_event_years = set()
+
+
+async def acreate_current_event():
+    """
+    Fallback for when the create_event command is not scheduled: the first request of midsummer week creates the
+    event of the year. Outside of the week this does not query at all
+    """
+    now = timezone.localtime()
+    week_start = get_midsummer_week_start(now.year)
+    if now.year in _event_years or not week_start <= now < week_start + datetime.timedelta(days=7):
+        return
+    if not await Event.objects.filter(year=now.year).aexists():
+        try:
+            await sync_to_async(create_midsummer_event)(now.year)
+        except Event.DoesNotExist:
+            # Nothing to copy the header and body from
+            return
+    _event_years.add(now.year)
+
+
+def get_stats(limit=None):
+    """
+    The all-time leaderboards, the first limit rows of each. complete is False if either one was cut short
+    """
+    stats = {"complete": True}
+    for key, field in [("winners", "wins"), ("participants", "participations")]:
+        rows = (LeaderboardEntry.objects
+                .filter(**{f"{field}__gt": 0})
+                .order_by(f"-{field}", "name")
+                .values_list("name", field))
+        rows = list(rows if limit is None else rows[:limit + 1])
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            stats["complete"] = False
+        stats[key] = [{"name": name, "count": count} for name, count in rows]
+    return stats
+
+
+class ConditionalGetMixin:
+    """
+    Answers If-None-Match from the change markers of the events, before the page is built. Views return the etag
+    parts from get_validators, or None to always render. There is no Last-Modified, the pages also change with
+    things that have no time of their own (the voting deadline, the user, a deploy of new static files)
+    """
+
+    def get_validators(self, markers):
+        raise NotImplementedError
+
+    async def get(self, request, *args, **kwargs):
+        markers = [marker async for marker in Event.objects.order_by("year").values_list("year", change_marker())]
+        validators = self.get_validators(markers) if markers else None
+        if validators is None:
+            return self.render_to_response(await self.aget_context_data())
+
+        etag = quote_etag(hashlib.md5(repr(validators).encode(), usedforsecurity=False).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.render_to_response(await self.aget_context_data())
+        response.headers["ETag"] = etag
+        return response
+
+
 class BaseEventView(ContextMixin):
-    def __init__(self):
-        super().__init__()
-        self.events = Event.objects.select_related("body", "header").order_by("year")
+    """
+    The public pages are async views, so that a slow client only holds a connection under ASGI and not a worker.
+    Queries go through the async ORM, templates are rendered in a thread once the response is returned
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.events = Event.objects.select_related("body", "header", "histogram").order_by("year")
+
+    async def dispatch(self, request, *args, **kwargs):
+        # The lazy request.user cannot be loaded from async code, resolve it once for the whole request
+        request.user = await request.auser()
+        return await super().dispatch(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         ctx["events"] = self.events
         return ctx
 
+    async def aget_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["events"] = [event async for event in self.events]
+        return ctx
+
 
-class EventView(BaseEventView, generic.FormView):
+class EventView(ConditionalGetMixin, BaseEventView, generic.FormView):
     template_name = 'juhannus/index.html'
     form_class = SubmitForm
+    # The static archive renders whole tables
+    windowed = True
 
-    def dispatch(self, request, *args, **kwargs):
-        if not self.events:
+    async def ahas_events(self):
+        await acreate_current_event()
+        return await self.events.aexists()
+
+    async def get(self, request, *args, **kwargs):
+        # The cached pages are the windowed ones, the archive renders its whole tables itself
+        if self.windowed and kwargs.get("year") and not request.user.is_staff:
+            page = await pagecache.aget_page(kwargs["year"], request.GET)
+            if page is not None:
+                response = HttpResponse(page["content"], headers=page["headers"])
+                return get_conditional_response(request, etag=page["headers"].get("ETag"), response=response)
+
+        if not await self.ahas_events():
+            return HttpResponse("No events in db")
+        response = await super().get(request, *args, **kwargs)
+        if response.status_code == 200 and self.is_page_cacheable():
+            response.add_post_render_callback(
+                lambda rendered: pagecache.set_page(self.event.year, request.GET, rendered))
+        return response
+
+    async def post(self, request, *args, **kwargs):
+        if not await self.ahas_events():
             return HttpResponse("No events in db")
+        # Form handling, staff edits and the vote batcher stay synchronous
+        return await sync_to_async(super().post)(request, *args, **kwargs)
+
+    async def put(self, *args, **kwargs):
+        return await self.post(*args, **kwargs)
+
+    def get_validators(self, markers):
+        year = self.kwargs.get("year") or markers[-1][0]
+        modified = dict(markers).get(year)
+        if modified is None:
+            return None
+        voting_available = Event(year=year).is_voting_available()
+        etag_parts = [
+            year, modified, [marker[0] for marker in markers],
+            pagecache.get_sort_variant(self.request.GET),
+            self.request.user.is_superuser,
+            voting_available,
+            # The voting form carries a csrf token, which must match the cookie of this client
+            voting_available and self.request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+            # A deploy changes the hashed names of the static files the page links to
+            static("juhannus/style.css"),
+        ]
+        return etag_parts
 
-        # use .localtime() when comparing to pytz-created datetime object
-        year = timezone.localtime().year
-        if timezone.localtime().strftime("%V") == get_midsummer_saturday(year).strftime("%V"):
-            # Only hit db when the week is correct
-            if not Event.objects.filter(year=year):
-                previous = Event.objects.order_by("year").last()
-                Event.objects.create(year=year, header=previous.header, body=previous.body)
-        return super().dispatch(request, *args, **kwargs)
+    def is_page_cacheable(self):
+        # Finalized events stop changing once voting has closed, apart from admin edits which purge the cache
+        return (self.windowed and bool(self.kwargs.get("year")) and not self.request.user.is_staff
+                and self.event.is_final and not self.event.is_voting_available())
 
     def get_success_url(self):
         return self.request.get_full_path()
 
     def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
+        return self.add_event_context(super().get_context_data(**kwargs))
+
+    async def aget_context_data(self, **kwargs):
+        ctx = await super().aget_context_data(**kwargs)
+        # Runs in a worker thread, the participant window and rebuilding a missing histogram query the database
+        return await sync_to_async(self.add_event_context)(ctx)
 
+    def add_event_context(self, ctx):
         sort_order = "vote" if self.request.GET.get("vote") else "name"
 
+        events = list(ctx["events"])
         if not self.kwargs.get("year"):
-            ctx['event'] = self.events.order_by("year").last()
+            ctx['event'] = events[-1]
         else:
-            try:
-                ctx["event"] = self.events.get(year=self.kwargs.get("year"))
-            except Event.DoesNotExist:
+            ctx["event"] = next((event for event in events if event.year == self.kwargs["year"]), None)
+            if ctx["event"] is None:
                 raise Http404
 
-        ctx["participants"] = ctx["event"].participants.order_by(
-            sort_order if sort_order == "vote" else Lower(sort_order))
+        self.event = ctx["event"]
+        ctx["live"] = (self.event.year == events[-1].year and not self.request.user.is_superuser
+                       and is_live_feed_available(self.request))
+        ctx["histogram"] = ctx["event"].get_histogram()
+        ctx["participants"], next_rows = get_participant_window(
+            self.event, self.request.GET, size=settings.PARTICIPANT_WINDOW if self.windowed else None)
+        if next_rows:
+            next_rows = reverse("juhannus:event-rows", kwargs={"year": self.event.year}) + "?" + next_rows
+        ctx["next_rows"] = next_rows
 
+        ctx["sort_order"] = sort_order
         ctx["ascending"] = False if self.request.GET.get(sort_order, "").lower() == "desc" else True
-
-        if not ctx["ascending"]:
-            ctx["participants"] = ctx["participants"].reverse()
         return ctx
 
     def form_valid(self, form):
         action = form.data.get("action")
-        if action == "modify" and self.request.user.is_staff:
-            instance = get_object_or_404(Participant, pk=form.data.get("pk"))
-            vote = SubmitForm(self.request.POST, instance=instance)
-            vote.save()
-        if action == "delete" and self.request.user.is_staff:
-            instance = get_object_or_404(Participant, pk=form.data.get("pk"))
-            instance.delete()
-        if action == "save":
-            vote = form.save(commit=False)
-            if vote.event.is_voting_available() or self.request.user.is_staff:
-                vote.save()
+        try:
+            if action == "modify" and self.request.user.is_staff:
+                instance = get_object_or_404(Participant, pk=form.data.get("pk"))
+                vote = SubmitForm(self.request.POST, instance=instance)
+                with transaction.atomic():
+                    vote.save()
+            if action == "delete" and self.request.user.is_staff:
+                instance = get_object_or_404(Participant, pk=form.data.get("pk"))
+                instance.delete()
+            if action == "save":
+                vote = form.save(commit=False)
+                if settings.VOTE_BATCHING and not self.request.user.is_staff:
+                    status = get_batcher().submit(vote)
+                    if status == VoteStatus.NAME_IN_USE:
+                        raise IntegrityError
+                    if status == VoteStatus.FAILED:
+                        form.add_not_saved_error()
+                        metrics.count_vote("failed")
+                        return super().form_invalid(form)
+                    if status == VoteStatus.CLOSED:
+                        metrics.count_vote("closed")
+                    else:
+                        metrics.count_vote("accepted")
+                elif vote.event.is_voting_available() or self.request.user.is_staff:
+                    with transaction.atomic():
+                        vote.save()
+                    metrics.count_vote("accepted")
+                else:
+                    metrics.count_vote("closed")
+        except IntegrityError:
+            # (event, normalized_name) is unique, so concurrent submissions of the same name cannot both get in
+            form.add_name_in_use_error()
+            if action == "save":
+                metrics.count_vote("name_in_use")
+            return super().form_invalid(form)
         return super().form_valid(form)
 
+    def form_invalid(self, form):
+        if form.data.get("action") == "save":
+            metrics.count_vote("invalid")
+        return super().form_invalid(form)
+
 
-class StatsView(BaseEventView, generic.TemplateView):
+class StatsView(ConditionalGetMixin, BaseEventView, generic.TemplateView):
+    """
+    Page for the leaderboards, which it fetches from StatsDataView
+    """
     template_name = 'juhannus/stats.html'
+    # Rows of each leaderboard in the first request, the rest follow in a second one
+    first_rows = 50
 
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        participants = (Participant.objects
-                        .annotate(lname=Lower("name"))
-                        .values("lname")
-                        .annotate(count=Count("lname"))
-                        .order_by("-count", "lname"))
-        highscores = (Participant.objects
-                      .filter(event__is_final=True, event__result__isnull=False, vote=F("event__result"))
-                      .annotate(lname=Lower("name"))
-                      .values("lname")
-                      .annotate(count=Count("id"))
-                      .order_by("-count", "lname"))
-
-        ctx["participants_json"] = json.dumps(list(participants))
-        ctx["highscores_json"] = json.dumps(list(highscores))
+    async def get(self, request, *args, **kwargs):
+        response = await super().get(request, *args, **kwargs)
+        patch_cache_control(response, public=True, max_age=settings.STATS_PAGE_MAX_AGE)
+        return response
+
+    def get_validators(self, markers):
+        # Without the data the page only changes with the list of years, or with a deploy of new static files
+        return [[marker[0] for marker in markers], static("juhannus/style.css")]
+
+    async def aget_context_data(self, **kwargs):
+        ctx = await super().aget_context_data(**kwargs)
+        ctx["first_rows"] = self.first_rows
         return ctx
+
+
+class StatsDataView(generic.View):
+    """
+    The leaderboards of the stats page as JSON, ?limit=N for the top N of each. The payloads the stats page asks for
+    are built once per change of the events and cached with their compressed variants, requests only pick the
+    encoding. Other limits are built for their request and not kept
+    """
+    cached_limits = {StatsView.first_rows, None}
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            limit = int(request.GET["limit"]) if "limit" in request.GET else None
+            if limit is not None and limit < 1:
+                raise ValueError
+        except ValueError:
+            return HttpResponse("limit must be a positive integer", status=400)
+
+        # The leaderboards only change together with some event
+        markers = [marker async for marker in Event.objects.order_by("year").values_list("year", change_marker())]
+        if limit not in self.cached_limits:
+            payload = await sync_to_async(self.build_payload)(markers, limit, fast=True)
+        else:
+            payload = await pagecache.aget_stats(limit)
+            if payload is None or payload["markers"] != markers:
+                payload = await sync_to_async(self.build_payload)(markers, limit)
+                await pagecache.aset_stats(limit, payload)
+
+        accepted = get_accepted_encodings(request)
+        encoding = next((encoding for encoding in ENCODINGS
+                         if encoding in accepted and encoding in payload["variants"]), None)
+        response = HttpResponse(payload["variants"].get(encoding, payload["content"]), content_type="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        # Votes change the markers but mostly not the leaderboards, the etag is of the content so clients keep theirs
+        response.headers["ETag"] = payload["etag"]
+        response.headers["Vary"] = "Accept-Encoding"
+        patch_cache_control(response, no_cache=True)
+        return get_conditional_response(request, etag=payload["etag"], response=response)
+
+    def build_payload(self, markers, limit, fast=False):
+        content = json.dumps(get_stats(limit), separators=(",", ":")).encode()
+        return {
+            "markers": markers,
+            "content": content,
+            "variants": compress_variants(content, fast),
+            # Weak like GZipMiddleware makes it, the bodies of the encodings are not byte for byte the same
+            "etag": "W/" + quote_etag(hashlib.md5(content, usedforsecurity=False).hexdigest()),
+        }
+
+
+class ParticipantRowsView(generic.TemplateView):
+    """
+    The next window of rows of the EventView table, after the cursor the previous window ended with
+    """
+    template_name = 'juhannus/participant_rows.html'
+
+    async def get(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        event = await aget_object_or_404(Event, year=kwargs["year"])
+        try:
+            after = api.decode_cursor(request.GET.get("after", ""), pagecache.get_sort_variant(request.GET))
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+        participants, next_rows = await sync_to_async(get_participant_window)(
+            event, request.GET, after, settings.PARTICIPANT_WINDOW)
+        return self.render_to_response({
+            "event": event,
+            "participants": participants,
+            "next_rows": next_rows and request.path + "?" + next_rows,
+        })
+
+
+class LiveView(generic.View):
+    """
+    Server-Sent Events of participant and result changes of the current year, fed by signals through the broker.
+    Streams end after LIVE_STREAM_SECONDS, EventSource reconnects with Last-Event-ID and resumes. Only served where
+    the pages subscribe to it, see is_live_feed_available: under WSGI every stream would hold a worker
+    """
+
+    async def get(self, request, *args, **kwargs):
+        if not is_live_feed_available(request):
+            raise Http404
+        year = await Event.objects.order_by("year").values_list("year", flat=True).alast()
+        try:
+            last_id = int(request.headers["Last-Event-ID"])
+        except (KeyError, ValueError):
+            last_id = None
+        # The stream waits on the event loop instead of occupying a thread per client
+        response = StreamingHttpResponse(self.astream(year, last_id), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # tell nginx not to buffer the stream
+        return response
+
+    async def astream(self, year, last_id):
+        # Nothing below needs the database, do not keep a connection for the lifetime of the stream
+        await sync_to_async(lambda: connection.close())()
+        yield "retry: 5000\n\n"
+        async for message in get_broker().alisten(last_id, duration=settings.LIVE_STREAM_SECONDS):
+            yield self.format_message(message, year)
+
+    def format_message(self, message, year):
+        if message is None:
+            return ": keepalive\n\n"
+        message_id, event, data = message
+        if data.get("year") != year:
+            return ""
+        return f"id: {message_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class MetricsView(generic.View):
+    """
+    Prometheus text format of juhannus.metrics, for staff or scrapers with the METRICS_TOKEN bearer token
+    """
+
+    def get(self, request, *args, **kwargs):
+        token = settings.METRICS_TOKEN
+        authorization = request.headers.get("Authorization", "")
+        if not (token and hmac.compare_digest(authorization, f"Bearer {token}")) and not request.user.is_staff:
+            raise Http404
+        response = HttpResponse(metrics.export(), content_type=metrics.CONTENT_TYPE)
+        patch_cache_control(response, no_store=True)
+        return response